@@ -0,0 +1,729 @@
+"""
+    asyncio engine for Sender and Receiver
+    Python 3
+    Usage: python3 aio.py send sender_port receiver_port FileToSend.txt max_win rot [options]
+           python3 aio.py receive receiver_port FileReceived.txt [flp rlp] [options]
+           python3 aio.py serve receiver_port output_dir [flp rlp] [options]
+    coding: utf-8
+
+    Same protocol as sender.py/receiver.py, but every endpoint is an asyncio.DatagramProtocol driven by
+    event-loop timers instead of threads polling sockets, so many transfers can share one loop:
+
+        await asyncio.gather(send_file(('127.0.0.1', 9000), 'a.txt', 3000, 500),
+                             send_file(('127.0.0.1', 9001), 'b.txt', 3000, 500))
+"""
+import asyncio
+import concurrent.futures
+import itertools
+import logging, sys
+import os
+import random
+import argparse
+import struct
+
+from util import *
+from segment import SegmentSource
+from congestion import CONGESTION_CONTROLS
+from reliable import ReliableSender, ReliableReceiver
+from tracelog import Event
+
+MAX_SYN_TIMES = 3  # RESET after the third SYN is unanswered
+MAX_FIN_TIMES = 8  # every DATA byte is acked by then, give up waiting for the FIN ACK
+TIME_WAIT = 2  # seconds the receiver keeps acking retransmitted FINs
+
+logger = logging.getLogger(__name__)
+SEGMENT_TYPES = frozenset(type.value for type in Type)
+
+
+def parse_datagram(data: bytes):
+    '''the parse_segment_header fields of a datagram, None for one too short or of an unknown type'''
+    try:
+        header = parse_segment_header(data)
+    except (struct.error, IndexError):
+        return None
+    return header if header[1] in SEGMENT_TYPES else None
+
+
+class SenderProtocol(ReliableSender, asyncio.DatagramProtocol):
+    def __init__(self, filename: str, max_win: int, rot: int, min_rto: float = 10, max_rto: float = 60000,
+                 cc: str = 'reno', sack: bool = True, offset: int = 0, length: int = None, stripe: tuple = None,
+                 mss: int = DEFAULT_MSS, pmtu_probe: bool = False) -> None:
+        '''
+        One sending connection, everything runs in event-loop callbacks so no lock is needed.
+        :param filename: the file to send
+        :param max_win: the maximum window size in bytes
+        :param rot: the initial retransmission timer in milliseconds
+        :param min_rto: lower bound of the adaptive retransmission timer in milliseconds
+        :param max_rto: upper bound of the adaptive retransmission timer in milliseconds
+        :param cc: the congestion control algorithm, one of CONGESTION_CONTROLS
+        :param sack: whether to ask the receiver for selective acknowledgements
+        :param offset: file offset of the first byte to send
+        :param length: bytes to send from offset, the rest of the file by default
+        :param stripe: (transfer id, file size) when this connection is one stripe of a striped transfer
+        :param mss: the DATA payload size, lowered to what the receiver takes
+        :param pmtu_probe: probe the path for a bigger payload than mss before sending data
+        '''
+        super().__init__(max_win, rot, min_rto, max_rto, cc, sack, mss)
+        self.loop = asyncio.get_running_loop()
+        self.done = self.loop.create_future()  # bytes sent, or the error that ended the connection
+        self.transport = None
+        self.file_path = filename
+        self.offset = offset
+        self.length = length
+        self.stripe = stripe
+        self.pmtu_probe = pmtu_probe
+        self.probe_sizes = []  # payload sizes left to probe
+        self.probe_times = 0  # probes sent for probe_sizes[0]
+        self.state = State.NONE
+        self.init_seq = -1
+        self.syn_times = 0
+        self.syn_time = None  # sending time of the first SYN, None once SYN is retransmitted
+        self.fin_times = 0
+        self.timer = None  # event-loop timer of the earliest deadline
+        self.timer_deadline = None
+        self.t_start = get_current_time()
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        '''log a segment, the names are only looked up when tracing'''
+        if logger.isEnabledFor(logging.DEBUG):
+            t_inv = round(get_current_time() - self.t_start, 2)
+            logger.debug(f'{event.name.lower()}  {t_inv:<10}  {Type(type).name:<4} {seq:<6}  {length}')
+
+    def send_control(self, seg: bytes):
+        self.transport.sendto(seg)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.pmtu_probe:
+            set_dont_fragment(transport.get_extra_info('socket'))
+        self.init_seq = generate_random_int(0, SEQ_MOD[HEADER_VERSION]-1)
+        self.state = State.CONNECT
+        self.send_syn()
+
+    def connection_lost(self, exc):
+        self.finish(exc or ConnectionError('transport closed'))
+
+    def error_received(self, exc):
+        # ICMP port unreachable before the receiver is up, the SYN timer retries
+        logger.debug(f'sender socket error: {exc}')
+        if self.state == State.PROBE:
+            # EMSGSIZE, the probe is bigger than the local interface MTU
+            self.probe_sizes = []
+            self.loop.call_soon(self.send_probe)
+
+    def finish(self, result):
+        '''end the connection with the bytes sent or an exception'''
+        self.state = State.END
+        self.cancel_timer()
+        if self.source is not None:
+            self.source.close()
+            self.source = None
+        if not self.done.done():
+            if isinstance(result, BaseException):
+                self.done.set_exception(result)
+            else:
+                self.done.set_result(result)
+
+    # timers
+    def set_timer(self, deadline: float):
+        '''make sure on_timer runs no later than deadline (milliseconds)'''
+        if self.timer is not None and self.timer_deadline <= deadline:
+            return
+        self.cancel_timer()
+        self.timer_deadline = deadline
+        self.timer = self.loop.call_later(max(deadline - get_current_time(), 0) / 1000, self.on_timer)
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def on_timer(self):
+        self.timer = None
+        if self.state == State.CONNECT:
+            self.timeout_rto()
+            self.send_syn()
+        elif self.state == State.PROBE:
+            self.send_probe()
+        elif self.state == State.DATA_TRANS:
+            self.fire_timers()
+            self.probe_window()
+            self.pump()
+        elif self.state == State.CLOSE:
+            self.timeout_rto()
+            self.send_fin()
+
+    def schedule(self):
+        '''arm the event-loop timer for the earliest segment timer, or a zero window probe'''
+        deadline = self.timers.next_deadline()
+        if deadline is None and self.window_blocked():
+            deadline = get_current_time() + self.rtt.rto
+        if deadline is not None:
+            self.set_timer(deadline)
+
+    # handshake and teardown
+    def send_syn(self):
+        self.syn_times += 1
+        if self.syn_times > MAX_SYN_TIMES:
+            self.transport.sendto(build_segment_header(Type.RESET, 0))
+            self.trace(Event.SND, Type.RESET.value, 0, 0)
+            self.finish(ConnectionRefusedError('no answer to SYN'))
+            return
+        # offer the largest payload when probing, the probes find what the path carries
+        flags, payload = build_syn_payload(mss=MAX_MSS if self.pmtu_probe else self.max_data_size,
+                                           stripe=None if self.stripe is None else (*self.stripe, self.offset, self.length))
+        if self.sack:
+            flags |= Flag.SACK
+        self.transport.sendto(build_segment_header(Type.SYN, self.init_seq, flags=flags) + payload)
+        self.syn_time = get_current_time() if self.syn_times == 1 else None
+        self.trace(Event.SND, Type.SYN.value, self.init_seq, 0)
+        self.set_timer(get_current_time() + self.rtt.rto)
+
+    def send_fin(self):
+        self.fin_times += 1
+        if self.fin_times > MAX_FIN_TIMES:
+            # the receiver has every byte, it only missed our FIN
+            self.finish(self.source.file_size)
+            return
+        self.transport.sendto(build_segment_header(Type.FIN, self.data_seq))
+        self.trace(Event.SND, Type.FIN.value, self.data_seq, 0)
+        self.set_timer(get_current_time() + self.rtt.rto)
+
+    def start_probe(self, limit: int):
+        '''path MTU probing (DPLPMTUD, RFC 8899): climb PMTU_PROBE_SIZES while probes are acked'''
+        self.cancel_timer()  # SYN timer
+        self.state = State.PROBE
+        self.probe_sizes = pmtu_probe_mss(self.max_data_size, limit)
+        self.send_probe()
+
+    def send_probe(self):
+        if self.state != State.PROBE:
+            return
+        if not self.probe_sizes or self.probe_times >= MAX_PROBES:
+            # the ladder ended or the path dropped every probe of this size
+            self.start_data_trans()
+            return
+        self.probe_times += 1
+        size = self.probe_sizes[0]
+        self.transport.sendto(build_probe(size))
+        self.trace(Event.SND, Type.DATA.value, size + HEADER_SIZE, size)
+        self.set_timer(get_current_time() + self.rtt.rto)
+
+    def on_probe_ack(self, size: int):
+        if self.state != State.PROBE or not self.probe_sizes or size != self.probe_sizes[0] + HEADER_SIZE:
+            return  # late reply
+        self.max_data_size = self.probe_sizes.pop(0)
+        self.probe_times = 0
+        self.cancel_timer()
+        self.send_probe()
+
+    def start_data_trans(self):
+        self.cancel_timer()  # SYN or probe timer
+        self.start_data(SegmentSource(self.file_path, self.data_seq, self.max_data_size, self.offset, self.length))
+        if self.source.seg_count == 0:
+            self.close()
+            return
+        self.state = State.DATA_TRANS
+        self.pump()
+
+    def close(self):
+        self.cancel_timer()  # segment timers
+        self.state = State.CLOSE
+        self.send_fin()
+
+    # receiving
+    def datagram_received(self, data: bytes, addr):
+        header = parse_datagram(data)
+        if header is None or header[1] != Type.ACK.value:
+            return
+        _, type, flags, seq, header_size = header
+        self.trace(Event.RCV, type, seq, len(data)-header_size)
+        if flags & Flag.PROBE:
+            self.on_probe_ack(seq)
+            return
+        rwnd, mss, _, _, _, blocks = parse_ack_payload(flags, data[header_size:])
+        if self.state == State.CONNECT:
+            if seq != seq_add(self.init_seq, 1):
+                return
+            if self.stripe is not None and not flags & Flag.STRIPE:
+                self.finish(ConnectionRefusedError("the receiver doesn't take striped transfers"))
+                return
+            self.sack = self.sack and bool(flags & Flag.SACK)
+            if rwnd is not None:
+                self.rwnd = rwnd
+            if self.syn_time is not None:
+                self.sample_rtt(get_current_time() - self.syn_time)
+            self.data_seq = seq
+            # receivers without the MSS option take DEFAULT_MSS, and a segment must fit the window
+            self.max_data_size = min(self.max_data_size, mss or DEFAULT_MSS, self.max_win)
+            if self.pmtu_probe and mss is not None:
+                self.start_probe(min(mss, self.max_win))
+            else:
+                self.start_data_trans()
+        elif self.state == State.DATA_TRANS:
+            if self.on_ack(seq, flags, rwnd, blocks):
+                self.close()
+            else:
+                self.pump()
+        elif self.state == State.CLOSE:
+            if seq == seq_add(self.data_seq, 1):
+                self.finish(self.source.file_size)
+
+    # sending
+    def pump(self):
+        '''send the pending retransmissions, then every new segment the window takes'''
+        for retrans_id in self.take_retransmissions():
+            header, payload = self.source.segment(retrans_id)
+            self.transport.sendto(b''.join((header, payload)))
+            self.trace(Event.SND, Type.DATA.value, self.source.id_to_seq(retrans_id), len(payload))
+        while self.window_open():
+            header, payload = self.source.segment(self.send_id)
+            # datagram transports take one buffer, the join is the only copy of the payload
+            self.transport.sendto(b''.join((header, payload)))
+            self.trace(Event.SND, Type.DATA.value, self.source.id_to_seq(self.send_id), len(payload))
+            self.sent_new()
+        self.schedule()
+
+
+class OutputFile:
+    def __init__(self, loop, path: str, size: int = None) -> None:
+        '''
+        Output file of a transfer, every connection writes its own byte range with positional writes.
+        :param path: the file to store the transfer in
+        :param size: the file size of a striped transfer, None when one connection carries the whole file
+        '''
+        self.path = path
+        self.size = size
+        self.done = loop.create_future()  # bytes received once every byte is on disk
+        self.received = 0
+        self.users = 0  # connections writing to the file
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if size is None else 0), 0o644)
+        if size is not None:
+            # stripes write in any order, and a longer old file must not leave a tail
+            os.ftruncate(self.fd, size)
+
+    def complete(self, written: int):
+        '''a connection wrote its whole range'''
+        self.users -= 1
+        self.received += written
+        if self.size is None or self.received >= self.size:
+            self.close()
+            if not self.done.done():
+                self.done.set_result(self.received)
+
+    def fail(self, exc: BaseException):
+        self.users -= 1
+        if not self.done.done():
+            self.done.set_exception(exc)
+        if self.users == 0:
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ReceiveConnection(ReliableReceiver):
+    def __init__(self, server, address: tuple, conn_id: int, output: OutputFile, offset: int = 0) -> None:
+        '''
+        Reassembly state and writer task of one sender, owned by a ReceiverServer.
+        :param server: the ReceiverServer whose socket this connection shares
+        :param address: the sender address
+        :param conn_id: the connection id, the initial seq of the sender's SYN
+        :param output: the file into which the received data is stored
+        :param offset: file offset of the first byte, non-zero for stripes
+        '''
+        super().__init__(server.max_win, server.max_mss, server.rlp)
+        self.server = server
+        self.loop = server.loop
+        self.address = address
+        self.conn_id = conn_id
+        self.output = output
+        self.output.users += 1
+        self.offset = offset
+        self.error = None  # why the connection was aborted
+        self.write_queue = asyncio.Queue()  # in-order data waiting for the writer task
+        self.writer_task = self.loop.create_task(self.writer())
+        self.written = 0
+        self.state = State.NONE
+        self.t_start = get_current_time()
+        self.last_seen = self.t_start  # for the idle timeout
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        '''log a segment of this connection, the names are only looked up when tracing'''
+        if logger.isEnabledFor(logging.DEBUG):
+            t_inv = round(get_current_time() - self.t_start, 2)
+            logger.debug(f'{self.address[0]}:{self.address[1]}  {event.name.lower()}  {t_inv:<10}  {Type(type).name:<4} {seq:<6}  {length}')
+
+    def handle(self, version: int, type: int, flags: int, seq: int, payload: bytes):
+        self.last_seen = get_current_time()
+        self.trace(Event.RCV, type, seq, len(payload))
+        if type == Type.SYN.value:
+            if self.state not in (State.NONE, State.CONNECT):
+                return
+            self.accept_syn(version, seq, flags)
+            # echo SACK permitted and the stripe, answer the MSS option with ours
+            self.reply_ack(self.want_seq, flags & (Flag.SACK | Flag.STRIPE | Flag.MSS))
+            self.state = State.CONNECT
+        elif type == Type.DATA.value and flags & Flag.PROBE:
+            # path MTU probe, echo its size
+            self.reply_ack(seq, Flag.PROBE)
+        elif type == Type.DATA.value:
+            self.on_data(seq, payload)
+        elif type == Type.FIN.value:
+            if self.state != State.CLOSE:
+                self.state = State.CLOSE
+                # flush and close the file, then linger to ack retransmitted FINs
+                self.write_queue.put_nowait(None)
+                self.loop.call_later(TIME_WAIT, self.server.remove, self)
+            self.want_seq = seq_add(seq, 1, self.seq_mod)
+            self.reply_ack(self.want_seq)
+        elif type == Type.RESET.value:
+            self.abort(ConnectionResetError('transfer reset by the sender'))
+
+    def abort(self, exc: BaseException):
+        '''drop the connection, the transfer fails once its pending writes are done'''
+        if self.state not in (State.CLOSE, State.END):
+            self.error = exc
+            self.write_queue.put_nowait(None)
+        self.state = State.END
+        self.server.remove(self)
+
+    def on_data(self, seq: int, data: bytes):
+        if self.state not in (State.CONNECT, State.DATA_TRANS):
+            return
+        self.state = State.DATA_TRANS
+        self.receive_data(seq, data)
+
+    def send_ack(self, ack_seg: bytes):
+        self.server.queue_ack(self.address, ack_seg)
+
+    def deliver(self, seq: int, data: bytes, slot: int):
+        if not data:
+            return  # zero window probe
+        self.queued(len(data))
+        self.write_queue.put_nowait(data)
+
+    async def writer(self):
+        '''write in-order data in the executor, everything queued so far goes in one write'''
+        closing = False
+        try:
+            while not closing:
+                chunks = [await self.write_queue.get()]
+                while not self.write_queue.empty():
+                    chunks.append(self.write_queue.get_nowait())
+                if None in chunks:
+                    closing = True
+                    chunks = chunks[:chunks.index(None)]
+                data = b''.join(chunks)
+                if data:
+                    await self.loop.run_in_executor(None, os.pwrite, self.output.fd, data, self.offset + self.written)
+                    self.written += len(data)
+                    self.drained(len(data))
+                # window update once half the buffer is free again
+                if not closing and self.window_reopened():
+                    self.reply_ack(self.want_seq, Flag.UPDATE)
+        except OSError as exc:
+            self.error = exc
+        if self.error is None:
+            self.output.complete(self.written)
+        else:
+            self.output.fail(self.error)
+
+
+class ReceiverServer(asyncio.DatagramProtocol):
+    def __init__(self, output, flp: float = 0, rlp: float = 0, max_win: int = 1<<14,
+                 max_connections: int = 256, idle_timeout: float = 60, on_accept=None, max_mss: int = MAX_MSS) -> None:
+        '''
+        Receive from many senders on one socket. Connections are keyed by (sender address, connection id),
+        the connection id being the initial seq of the SYN; a SYN with a new id from a known address
+        replaces that address's old connection.
+        :param output: callable(address, conn_id) returning the file to store a new connection in
+        :param flp: forward loss probability, emulated drop of DATA/SYN/FIN segments
+        :param rlp: reverse loss probability, emulated drop of ACKs
+        :param max_win: the receive buffer of every connection in bytes
+        :param max_connections: SYNs beyond this many connections are dropped
+        :param idle_timeout: seconds without a segment before a connection is dropped
+        :param on_accept: callable(ReceiveConnection) run for every new connection
+        :param max_mss: the largest DATA payload accepted, offered to senders at SYN
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.transport = None
+        self.output = output
+        self.flp = float(flp)
+        self.rlp = float(rlp)
+        self.max_win = int(max_win)
+        # a segment bigger than the receive buffer could never be accepted
+        self.max_mss = min(int(max_mss), self.max_win, MAX_MSS)
+        self.max_connections = int(max_connections)
+        self.idle_timeout = float(idle_timeout)
+        self.on_accept = on_accept
+        self.connections = {}  # (address, conn_id) -> ReceiveConnection
+        self.transfers = {}  # transfer id -> OutputFile shared by the stripes of a striped transfer
+        self.peers = {}  # address -> its current ReceiveConnection
+        self.ack_queues = {}  # address -> ACKs waiting for the next flush
+        self.flush_handle = None
+        self.sweep_handle = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.sweep_handle = self.loop.call_later(self.idle_timeout / 2, self.sweep)
+
+    def connection_lost(self, exc):
+        if self.sweep_handle is not None:
+            self.sweep_handle.cancel()
+        for conn in list(self.connections.values()):
+            if conn.state != State.CLOSE:
+                conn.abort(exc or ConnectionError('server closed'))
+        self.connections.clear()
+        self.peers.clear()
+
+    def datagram_received(self, data: bytes, addr):
+        header = parse_datagram(data)
+        if header is None:
+            return  # not a segment of this protocol
+        version, type, flags, seq, header_size = header
+        # forward segment loss
+        if random.random() <= self.flp:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{addr[0]}:{addr[1]}  drp  {Type(type).name:<4} {seq:<6}  {len(data)-header_size}')
+            return
+        conn = self.peers.get(addr)
+        if type == Type.SYN.value and (conn is None or conn.conn_id != seq):
+            _, stripe, _, _ = parse_syn_payload(flags, data[header_size:])
+            conn = self.accept(addr, seq, stripe)
+        if conn is not None:
+            conn.handle(version, type, flags, seq, data[header_size:])
+
+    def accept(self, address: tuple, conn_id: int, stripe: tuple = None):
+        old = self.peers.get(address)
+        if old is not None:
+            old.abort(ConnectionResetError('replaced by a new connection'))
+        # connections in TIME_WAIT only ack FINs, they don't count
+        active = sum(conn.state != State.CLOSE for conn in self.connections.values())
+        if active >= self.max_connections:
+            logger.warning(f'refuse {address[0]}:{address[1]}, {active} connections open')
+            return None
+        if stripe is None:
+            output, offset = OutputFile(self.loop, self.output(address, conn_id)), 0
+        else:
+            transfer_id, size, offset, _ = stripe
+            output = self.transfers.get(transfer_id)
+            if output is None:
+                output = OutputFile(self.loop, self.output(address, transfer_id), size)
+                self.transfers[transfer_id] = output
+                output.done.add_done_callback(lambda _: self.transfers.pop(transfer_id, None))
+        conn = ReceiveConnection(self, address, conn_id, output, offset)
+        self.connections[(address, conn_id)] = conn
+        self.peers[address] = conn
+        if self.on_accept is not None:
+            self.on_accept(conn)
+        return conn
+
+    def remove(self, conn: ReceiveConnection):
+        self.connections.pop((conn.address, conn.conn_id), None)
+        if self.peers.get(conn.address) is conn:
+            del self.peers[conn.address]
+
+    def sweep(self):
+        '''drop connections whose sender went silent'''
+        now = get_current_time()
+        for conn in list(self.connections.values()):
+            if conn.state != State.CLOSE and now - conn.last_seen > self.idle_timeout * 1000:
+                conn.abort(TimeoutError(f'no segment for {self.idle_timeout} seconds'))
+        self.sweep_handle = self.loop.call_later(self.idle_timeout / 2, self.sweep)
+
+    def queue_ack(self, address: tuple, ack_seg: bytes):
+        self.ack_queues.setdefault(address, []).append(ack_seg)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_soon(self.flush_acks)
+
+    def flush_acks(self):
+        '''send the queued ACKs round-robin, one per connection per round, so a busy sender can't delay the others'''
+        self.flush_handle = None
+        queues = self.ack_queues
+        self.ack_queues = {}
+        if self.transport.is_closing():
+            return
+        for acks in itertools.zip_longest(*queues.values()):
+            for address, ack_seg in zip(queues, acks):
+                if ack_seg is not None:
+                    self.transport.sendto(ack_seg, address)
+
+
+async def send_file(receiver_address: tuple, filename: str, max_win: int, rot: int,
+                    local_address: tuple = ('127.0.0.1', 0), **options):
+    '''
+    send filename to the receiver listening on receiver_address
+    :param local_address: the address to send from, any free port by default
+    :param options: min_rto, max_rto, cc, sack, offset, length and stripe, as in SenderProtocol
+    :return: the number of bytes sent
+    '''
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: SenderProtocol(filename, max_win, rot, **options),
+        local_addr=local_address, remote_addr=receiver_address)
+    try:
+        return await protocol.done
+    finally:
+        transport.close()
+
+
+def send_stripes(receiver_address: tuple, filename: str, max_win: int, rot: int, stripes: list, options: dict):
+    '''process pool worker: send the (offset, length) stripes one connection after another'''
+    async def main():
+        sent = 0
+        for offset, length in stripes:
+            sent += await send_file(receiver_address, filename, max_win, rot, offset=offset, length=length, **options)
+        return sent
+    return asyncio.run(main())
+
+
+async def send_file_striped(receiver_address: tuple, filename: str, max_win: int, rot: int,
+                            streams: int = 4, stripe_size: int = None, **options):
+    '''
+    send filename split into byte ranges (stripes), streams connections at a time, each from its own process
+    :param streams: the number of concurrent connections and worker processes
+    :param stripe_size: bytes per stripe, the file is split evenly across the streams by default
+    :param options: min_rto, max_rto, cc and sack, as in SenderProtocol
+    :return: the number of bytes sent
+    '''
+    file_size = os.path.getsize(filename)
+    if stripe_size is None:
+        stripe_size = max(-(-file_size // streams), 1)
+    stripes = [(offset, min(stripe_size, file_size - offset)) for offset in range(0, file_size, stripe_size)] or [(0, 0)]
+    options['stripe'] = (generate_random_int(0, (1<<32)-1), file_size)
+    streams = min(streams, len(stripes))
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ProcessPoolExecutor(streams) as pool:
+        sent = await asyncio.gather(*(
+            loop.run_in_executor(pool, send_stripes, receiver_address, filename, max_win, rot, stripes[i::streams], options)
+            for i in range(streams)))
+    return sum(sent)
+
+
+async def receive_file(local_address: tuple, filename: str, flp: float = 0, rlp: float = 0, max_win: int = 1<<14,
+                       streams: int = 1, max_mss: int = MAX_MSS):
+    '''
+    receive one file on local_address into filename
+    :param streams: connections accepted at once, for striped transfers
+    :param max_mss: the largest DATA payload accepted
+    :return: the number of bytes received, once the file is closed; the socket lingers TIME_WAIT seconds more
+    '''
+    loop = asyncio.get_running_loop()
+    accepted = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ReceiverServer(lambda address, conn_id: filename, flp, rlp, max_win, max_connections=streams,
+                               on_accept=lambda conn: accepted.done() or accepted.set_result(conn), max_mss=max_mss),
+        local_addr=local_address)
+    try:
+        conn = await accepted
+        size = await conn.output.done
+    except BaseException:
+        transport.close()
+        raise
+    loop.call_later(TIME_WAIT, transport.close)
+    return size
+
+
+async def serve(local_address: tuple, output_dir: str, flp: float = 0, rlp: float = 0, max_win: int = 1<<14,
+                max_connections: int = 256, idle_timeout: float = 60, max_mss: int = MAX_MSS):
+    '''
+    receive files from any number of senders on local_address until cancelled,
+    every transfer is stored as output_dir/<host>_<port>_<connection or transfer id>
+    '''
+    loop = asyncio.get_running_loop()
+    os.makedirs(output_dir, exist_ok=True)
+
+    def output(address, conn_id):
+        return os.path.join(output_dir, f'{address[0]}_{address[1]}_{conn_id}')
+
+    def report(output, done):
+        if done.exception() is not None:
+            logger.info(f'{output.path} failed: {done.exception()!r}')
+        else:
+            logger.info(f'{output.path} completed, {done.result()} bytes')
+
+    def on_accept(conn):
+        # once per transfer, stripes share their output
+        if conn.output.users == 1 and conn.output.received == 0:
+            conn.output.done.add_done_callback(lambda done: report(conn.output, done))
+
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: ReceiverServer(output, flp, rlp, max_win, max_connections, idle_timeout, on_accept=on_accept, max_mss=max_mss),
+        local_addr=local_address)
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S')
+
+    parser = argparse.ArgumentParser(description='asyncio sender and receiver')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    send_parser = subparsers.add_parser('send')
+    send_parser.add_argument('sender_port', type=int)
+    send_parser.add_argument('receiver_port', type=int)
+    send_parser.add_argument('filename')
+    send_parser.add_argument('max_win', type=int, help='maximum window size in bytes')
+    send_parser.add_argument('rot', type=int, help='initial retransmission timer in milliseconds')
+    send_parser.add_argument('--min-rto', type=float, default=10, help='lower bound of the adaptive RTO in milliseconds')
+    send_parser.add_argument('--max-rto', type=float, default=60000, help='upper bound of the adaptive RTO in milliseconds')
+    send_parser.add_argument('--cc', choices=CONGESTION_CONTROLS, default='reno', help='congestion control algorithm')
+    send_parser.add_argument('--no-sack', dest='sack', action='store_false', help="don't negotiate selective acknowledgements")
+    send_parser.add_argument('--streams', type=int, default=1, help='send stripes of the file over this many connections, sender_port is unused then')
+    send_parser.add_argument('--stripe-size', type=int, help='bytes per stripe, the file is split evenly by default')
+    send_parser.add_argument('--mss', type=int, default=DEFAULT_MSS, help='DATA payload size in bytes, lowered to what the receiver takes')
+    send_parser.add_argument('--pmtu-probe', action='store_true', help='probe the path for a bigger payload before sending data')
+    receive_parser = subparsers.add_parser('receive')
+    receive_parser.add_argument('receiver_port', type=int)
+    receive_parser.add_argument('filename')
+    receive_parser.add_argument('flp', type=float, nargs='?', default=0, help='forward loss probability')
+    receive_parser.add_argument('rlp', type=float, nargs='?', default=0, help='reverse loss probability')
+    receive_parser.add_argument('--max-win', type=int, default=1<<14, help='receive buffer in bytes, advertised to the sender')
+    receive_parser.add_argument('--streams', type=int, default=1, help='connections of a striped transfer accepted at once')
+    receive_parser.add_argument('--max-mss', type=int, default=MAX_MSS, help='largest DATA payload accepted, capped by --max-win')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('receiver_port', type=int)
+    serve_parser.add_argument('output_dir', help='every connection is stored as <host>_<port>_<connection id> in it')
+    serve_parser.add_argument('flp', type=float, nargs='?', default=0, help='forward loss probability')
+    serve_parser.add_argument('rlp', type=float, nargs='?', default=0, help='reverse loss probability')
+    serve_parser.add_argument('--max-win', type=int, default=1<<14, help='receive buffer of every connection in bytes')
+    serve_parser.add_argument('--max-connections', type=int, default=256, help='concurrent connections accepted')
+    serve_parser.add_argument('--idle-timeout', type=float, default=60, help='seconds before a silent connection is dropped')
+    serve_parser.add_argument('--max-mss', type=int, default=MAX_MSS, help='largest DATA payload accepted, capped by --max-win')
+    for subparser in (send_parser, receive_parser, serve_parser):
+        subparser.add_argument('-v', '--verbose', action='store_true', help='log every segment')
+    args = parser.parse_args()
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    async def main():
+        if args.command == 'serve':
+            await serve(('127.0.0.1', args.receiver_port), args.output_dir, args.flp, args.rlp, args.max_win,
+                        args.max_connections, args.idle_timeout, args.max_mss)
+            return
+        if args.command == 'send' and args.streams > 1:
+            size = await send_file_striped(('127.0.0.1', args.receiver_port), args.filename, args.max_win, args.rot,
+                                           args.streams, args.stripe_size,
+                                           min_rto=args.min_rto, max_rto=args.max_rto, cc=args.cc, sack=args.sack,
+                                           mss=args.mss, pmtu_probe=args.pmtu_probe)
+        elif args.command == 'send':
+            size = await send_file(('127.0.0.1', args.receiver_port), args.filename, args.max_win, args.rot,
+                                   local_address=('127.0.0.1', args.sender_port),
+                                   min_rto=args.min_rto, max_rto=args.max_rto, cc=args.cc, sack=args.sack,
+                                   mss=args.mss, pmtu_probe=args.pmtu_probe)
+        else:
+            size = await receive_file(('127.0.0.1', args.receiver_port), args.filename, args.flp, args.rlp, args.max_win,
+                                      args.streams, args.max_mss)
+            await asyncio.sleep(TIME_WAIT)  # keep acking retransmitted FINs
+        logger.info(f'{args.command} {args.filename} completed, {size} bytes')
+
+    asyncio.run(main())
@@ -0,0 +1,292 @@
+import collections
+import ctypes
+import ctypes.util
+import select
+import socket
+import struct
+import threading
+
+from util import HEADER_SIZE, MAX_UDP_PAYLOAD
+
+# Linux values, not exported by every python build
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+MAX_BATCH = 64  # datagrams per syscall, also the kernel's UDP_MAX_SEGMENTS for GSO
+GRO_BUFFERSIZE = 1<<16
+
+
+def seg_size(seg):
+    '''bytes in a segment given as a sequence of buffers'''
+    return sum(len(buf) for buf in seg)
+
+
+class RecvRing:
+    def __init__(self, slot_size: int) -> None:
+        '''
+        Fixed-size receive buffers reused across datagrams, so receiving allocates nothing once warm.
+        A slot is filled by the kernel and handed out as memoryviews; it goes back to the free list
+        when every datagram in it is released, possibly from another thread.
+        Slots are added on demand, their number follows the data held by the reader.
+        :param slot_size: bytes per slot, the largest datagram (or GRO batch) to receive
+        '''
+        self.slot_size = slot_size
+        self.bufs = []  # slot -> bytearray
+        self.views = []  # slot -> memoryview of the whole slot
+        self.refs = []  # slot -> datagrams not released yet
+        self.free = collections.deque()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.bufs)
+
+    def acquire(self):
+        '''a free slot, it belongs to the caller until released'''
+        with self.lock:
+            if not self.free:
+                self.bufs.append(bytearray(self.slot_size))
+                self.views.append(memoryview(self.bufs[-1]))
+                self.refs.append(0)
+                self.free.append(len(self.bufs) - 1)
+            slot = self.free.popleft()
+            self.refs[slot] = 1
+            return slot
+
+    def hold(self, slot: int, count: int):
+        '''the slot carries count datagrams, each released on its own'''
+        with self.lock:
+            self.refs[slot] = count
+
+    def retain(self, slot: int):
+        '''one more reference to a slot in use, released on its own'''
+        with self.lock:
+            self.refs[slot] += 1
+
+    def release(self, slot: int):
+        with self.lock:
+            self.refs[slot] -= 1
+            if self.refs[slot] == 0:
+                self.free.append(slot)
+
+
+class PlainIO:
+    name = 'plain'
+
+    def __init__(self, sock: socket.socket, bufsize: int) -> None:
+        '''
+        One sendmsg/recvfrom_into per datagram, works everywhere.
+        Segments are sequences of buffers (header, payload) gathered by the kernel, never joined here.
+        :param sock: the bound UDP socket
+        :param bufsize: the largest datagram to receive
+        '''
+        self.sock = sock
+        self.bufsize = bufsize
+        self.ring = RecvRing(bufsize)
+
+    def send_batch(self, segs: list, address: tuple):
+        for seg in segs:
+            self.sock.sendmsg(seg, (), 0, address)
+
+    def recv_batch(self):
+        '''
+        list of (datagram, address, slot), raises socket.timeout like recvfrom.
+        datagram is a memoryview into ring slot, valid until ring.release(slot).
+        '''
+        slot = self.ring.acquire()
+        try:
+            n, address = self.sock.recvfrom_into(self.ring.views[slot])
+        except:
+            self.ring.release(slot)
+            raise
+        return [(self.ring.views[slot][:n], address, slot)]
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+# struct sockaddr_in: family (host order), port, ipv4 address, padding
+SOCKADDR_IN = struct.Struct('=H2s4s8x')
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def buffer_address(buf):
+    '''a ctypes view of buf for taking its address, copied only when buf is read-only'''
+    try:
+        return (ctypes.c_char * len(buf)).from_buffer(buf)
+    except TypeError:
+        return (ctypes.c_char * len(buf)).from_buffer_copy(buf)
+
+
+class MmsgIO(PlainIO):
+    name = 'mmsg'
+
+    def __init__(self, sock: socket.socket, bufsize: int) -> None:
+        '''sendmmsg/recvmmsg through ctypes, up to MAX_BATCH datagrams per syscall'''
+        super().__init__(sock, bufsize)
+        if not hasattr(libc, 'sendmmsg') or not hasattr(libc, 'recvmmsg'):
+            raise OSError('sendmmsg/recvmmsg not available')
+        # preallocated send vector, headers are copied into one buffer and payloads referenced in place
+        self.send_headers = ctypes.create_string_buffer(MAX_BATCH * HEADER_SIZE)
+        self.send_headers_view = memoryview(self.send_headers).cast('B')  # takes bytes and header views alike
+        self.send_name = ctypes.create_string_buffer(SOCKADDR_IN.size)
+        self.send_address = None
+        self.send_iovs = (iovec * (2 * MAX_BATCH))()
+        self.send_vec = (mmsghdr * MAX_BATCH)()
+        for i in range(MAX_BATCH):
+            hdr = self.send_vec[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.send_name)
+            hdr.msg_namelen = SOCKADDR_IN.size
+            hdr.msg_iov = ctypes.pointer(self.send_iovs[2*i])
+        # preallocated receive vector, pointed at free ring slots before every call
+        self.recv_names = [ctypes.create_string_buffer(SOCKADDR_IN.size) for _ in range(MAX_BATCH)]
+        self.recv_iovs = (iovec * MAX_BATCH)()
+        self.recv_vec = (mmsghdr * MAX_BATCH)()
+        self.slot_addresses = []  # ring slot -> address of its buffer
+        for i in range(MAX_BATCH):
+            self.recv_iovs[i].iov_len = bufsize
+            hdr = self.recv_vec[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.recv_names[i])
+            hdr.msg_iov = ctypes.pointer(self.recv_iovs[i])
+            hdr.msg_iovlen = 1
+
+    def send_batch(self, segs: list, address: tuple):
+        if address != self.send_address:
+            self.send_name.raw = SOCKADDR_IN.pack(
+                socket.AF_INET, address[1].to_bytes(2, 'big'), socket.inet_aton(address[0]))
+            self.send_address = address
+        headers_base = ctypes.addressof(self.send_headers)
+        sent = 0
+        while sent < len(segs):
+            batch = segs[sent:sent+MAX_BATCH]
+            payloads = []  # keeps the payload buffers exported while the kernel reads them
+            for i, (header, payload) in enumerate(batch):
+                self.send_headers_view[i*HEADER_SIZE:(i+1)*HEADER_SIZE] = header
+                self.send_iovs[2*i].iov_base = headers_base + i*HEADER_SIZE
+                self.send_iovs[2*i].iov_len = HEADER_SIZE
+                self.send_iovs[2*i+1].iov_len = len(payload)
+                if len(payload):
+                    payload = buffer_address(payload)
+                    payloads.append(payload)
+                    self.send_iovs[2*i+1].iov_base = ctypes.addressof(payload)
+                self.send_vec[i].msg_hdr.msg_iovlen = 2
+            n = libc.sendmmsg(self.sock.fileno(), self.send_vec, len(batch), 0)
+            del payloads
+            if n <= 0:
+                # send buffer full (the socket is non-blocking under a timeout), let sendmsg wait
+                self.sock.sendmsg(batch[0], (), 0, address)
+                n = 1
+            sent += n
+
+    def recv_batch(self):
+        timeout = self.sock.gettimeout()
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            raise socket.timeout('timed out')
+        slots = [self.ring.acquire() for _ in range(MAX_BATCH)]
+        for i, slot in enumerate(slots):
+            while slot >= len(self.slot_addresses):
+                # a new slot, its bytearray never resizes so the address stays valid
+                buf = self.ring.bufs[len(self.slot_addresses)]
+                self.slot_addresses.append(ctypes.addressof((ctypes.c_char * len(buf)).from_buffer(buf)))
+            self.recv_iovs[i].iov_base = self.slot_addresses[slot]
+            self.recv_vec[i].msg_hdr.msg_namelen = SOCKADDR_IN.size
+        n = libc.recvmmsg(self.sock.fileno(), self.recv_vec, MAX_BATCH, socket.MSG_DONTWAIT, None)
+        for slot in slots[max(n, 0):]:
+            self.ring.release(slot)
+        if n <= 0:
+            return super().recv_batch()
+        datagrams = []
+        for i in range(n):
+            _, port, addr = SOCKADDR_IN.unpack(self.recv_names[i].raw)
+            datagrams.append((self.ring.views[slots[i]][:self.recv_vec[i].msg_len],
+                              (socket.inet_ntoa(addr), int.from_bytes(port, 'big')), slots[i]))
+        return datagrams
+
+
+class GsoIO(MmsgIO):
+    name = 'gso'
+
+    def __init__(self, sock: socket.socket, bufsize: int, gro: bool = False) -> None:
+        '''
+        UDP GSO on send (one buffer split by the kernel), UDP GRO on receive (coalesced datagrams)
+        :param gro: enable GRO, only for sockets whose every read goes through recv_batch
+        '''
+        super().__init__(sock, bufsize)
+        # both raise OSError on kernels without UDP GSO/GRO
+        sock.setsockopt(SOL_UDP, UDP_SEGMENT, 0)
+        if gro:
+            sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+        # a slot takes a whole coalesced batch
+        self.ring = RecvRing(max(bufsize, GRO_BUFFERSIZE))
+
+    def send_batch(self, segs: list, address: tuple):
+        # GSO needs equal sized segments, only the last one may be shorter
+        sizes = [seg_size(seg) for seg in segs]
+        i = 0
+        while i < len(segs):
+            size = sizes[i]
+            j = i + 1
+            limit = min(MAX_BATCH, MAX_UDP_PAYLOAD // size)
+            while j < len(segs) and j - i < limit and sizes[j] <= size:
+                j += 1
+                if sizes[j-1] < size:
+                    break
+            if j - i == 1:
+                self.sock.sendmsg(segs[i], (), 0, address)
+            else:
+                # the kernel gathers every header and payload into one buffer and splits it every size bytes
+                bufs = [buf for seg in segs[i:j] for buf in seg]
+                self.sock.sendmsg(bufs, [(SOL_UDP, UDP_SEGMENT, struct.pack('H', size))], 0, address)
+            i = j
+
+    def recv_batch(self):
+        slot = self.ring.acquire()
+        view = self.ring.views[slot]
+        try:
+            n, ancdata, _, address = self.sock.recvmsg_into([view], socket.CMSG_SPACE(4))
+        except:
+            self.ring.release(slot)
+            raise
+        for level, type, cmsg_data in ancdata:
+            if level == SOL_UDP and type == UDP_GRO:
+                size, = struct.unpack('i', cmsg_data[:4])
+                # datagrams of one batch share the slot
+                offsets = range(0, max(n, 1), size)
+                self.ring.hold(slot, len(offsets))
+                return [(view[i:min(i+size, n)], address, slot) for i in offsets]
+        return [(view[:n], address, slot)]
+
+
+IO_BACKENDS = {
+    'gso': GsoIO,
+    'mmsg': MmsgIO,
+    'plain': PlainIO,
+}
+
+def open_batch_io(sock: socket.socket, bufsize: int, backend: str = 'auto', gro: bool = False):
+    '''the requested batch I/O backend, 'auto' picks the best one the kernel supports'''
+    if backend == 'gso':
+        return GsoIO(sock, bufsize, gro)
+    if backend != 'auto':
+        return IO_BACKENDS[backend](sock, bufsize)
+    try:
+        return GsoIO(sock, bufsize, gro)
+    except OSError:
+        pass
+    try:
+        return MmsgIO(sock, bufsize)
+    except OSError:
+        return PlainIO(sock, bufsize)
@@ -0,0 +1,231 @@
+"""
+    Loopback benchmark: runs receiver.py and sender.py as subprocesses over a grid of
+    files, windows, loss probabilities and RTOs, and reports completion time, goodput,
+    retransmissions and peak RSS of every run.
+    Usage: python3 bench.py [--files ...] [--windows ...] [--flp ...] [--rlp ...] [--rto ...] [--csv out.csv] [--json out.json]
+
+    The defaults are the scenarios of cmd.txt. Compare two versions with
+        python3 bench.py --json new.json --baseline old.json
+    and run it over an emulated path (see proxy.py) with
+        python3 bench.py --forward delay=20,jitter=5,rate=8 --reverse delay=20
+"""
+import argparse
+import csv
+import filecmp
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ['file', 'size', 'max_win', 'flp', 'rlp', 'rto', 'forward', 'reverse', 'seed', 'status',
+          'completion_s', 'wall_s', 'goodput_Bps', 'segments_sent', 'retransmitted_segments', 'timeouts',
+          'sender_rss_kb', 'receiver_rss_kb']
+
+
+def free_ports(count: int):
+    '''UDP ports nobody is bound to right now'''
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        socks.append(sock)
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+def wait_rusage(proc: subprocess.Popen, timeout: float):
+    '''
+    wait for proc like Popen.wait, killing it after timeout seconds
+    :return: (returncode, peak RSS in KB), returncode is None when it was killed
+    '''
+    deadline = time.monotonic() + timeout
+    while True:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return proc.returncode, rusage.ru_maxrss
+        if time.monotonic() > deadline:
+            proc.send_signal(signal.SIGKILL)
+            _, _, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = -signal.SIGKILL
+            return None, rusage.ru_maxrss
+        time.sleep(0.01)
+
+
+def run_once(file: str, max_win: int, flp: float, rlp: float, rto: int, seed: int,
+             timeout: float = 120, sender_args: list = (), receiver_args: list = (),
+             forward: str = '', reverse: str = ''):
+    '''
+    one transfer of file on free loopback ports, in a scratch directory for the logs
+    :param forward: proxy.py link SPEC from sender to receiver, the transfer goes through proxy.py if either is set
+    :param reverse: proxy.py link SPEC from receiver to sender
+    :return: a result row with the FIELDS keys
+    '''
+    row = {'file': os.path.basename(file), 'size': os.path.getsize(file), 'max_win': max_win,
+           'flp': flp, 'rlp': rlp, 'rto': rto, 'forward': forward, 'reverse': reverse, 'seed': seed}
+    work_dir = tempfile.mkdtemp(prefix='bench-')
+    proxy = None
+    try:
+        receiver_port, sender_port, proxy_port = free_ports(3)
+        output = os.path.join(work_dir, 'received')
+        metrics_json = os.path.join(work_dir, 'sender.json')
+        receiver = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'receiver.py'), str(receiver_port), str(sender_port), output,
+             str(flp), str(rlp), '--seed', str(seed), *receiver_args],
+            cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        target_port = receiver_port
+        if forward or reverse:
+            proxy = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, 'proxy.py'), str(proxy_port), str(receiver_port),
+                 '--forward', forward, '--reverse', reverse, '--seed', str(seed)],
+                cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            target_port = proxy_port
+        time.sleep(0.3)  # receiver socket bound
+        t_start = time.monotonic()
+        sender = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, 'sender.py'), str(sender_port), str(target_port),
+             os.path.abspath(file), str(max_win), str(rto), '--seed', str(seed), '--metrics-json', metrics_json,
+             *sender_args],
+            cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        sender_code, row['sender_rss_kb'] = wait_rusage(sender, timeout)
+        row['wall_s'] = round(time.monotonic() - t_start, 3)
+        # the receiver leaves after TIME_WAIT
+        receiver_code, row['receiver_rss_kb'] = wait_rusage(receiver, 10 if sender_code is None else timeout)
+
+        counters = {}
+        if os.path.exists(metrics_json):
+            with open(metrics_json) as f:
+                metrics = json.load(f)
+            counters = metrics['counters']
+            row['completion_s'] = metrics['elapsed_s']
+            row['goodput_Bps'] = round(metrics['gauges'].get('goodput_Bps', 0))
+            for name in ('segments_sent', 'retransmitted_segments', 'timeouts'):
+                row[name] = counters.get(name, 0)
+        if sender_code == 0 and counters.get('resets_sent'):
+            # the sender gave up on the connection, e.g. every SYN lost, nothing was transferred,
+            # the receiver waits on until it is killed if the RESET was lost too
+            row['status'] = 'reset'
+        elif sender_code is None or receiver_code is None:
+            row['status'] = 'timeout'
+        elif sender_code != 0 or receiver_code != 0:
+            row['status'] = 'error'
+        elif not os.path.exists(output):
+            row['status'] = 'missing'
+        elif not filecmp.cmp(file, output, shallow=False):
+            row['status'] = 'corrupt'
+        else:
+            row['status'] = 'ok'
+    finally:
+        if proxy is not None:
+            proxy.terminate()
+            proxy.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return row
+
+
+def summarize(rows: list):
+    '''per scenario (every field but the seed): run count, failures and the median of the measurements'''
+    scenarios = {}
+    for row in rows:
+        key = (row['file'], row['max_win'], row['flp'], row['rlp'], row['rto'], row['forward'], row['reverse'])
+        scenarios.setdefault(key, []).append(row)
+    summary = []
+    for (file, max_win, flp, rlp, rto, forward, reverse), runs in scenarios.items():
+        ok = [run for run in runs if run['status'] == 'ok']
+        # a RESET after lost SYNs is the protocol working, not a failed transfer
+        resets = [run for run in runs if run['status'] == 'reset']
+        scenario = {'file': file, 'max_win': max_win, 'flp': flp, 'rlp': rlp, 'rto': rto,
+                    'forward': forward, 'reverse': reverse, 'runs': len(runs), 'resets': len(resets),
+                    'failed': len(runs) - len(ok) - len(resets)}
+        for name in ('completion_s', 'goodput_Bps', 'retransmitted_segments', 'sender_rss_kb', 'receiver_rss_kb'):
+            values = [run[name] for run in ok if run.get(name) is not None]
+            scenario[name] = round(statistics.median(values), 3) if values else None
+        summary.append(scenario)
+    return summary
+
+
+def compare(summary: list, baseline: list, tolerance: float):
+    '''
+    print the completion time of every scenario against the baseline report
+    :return: whether no scenario regressed by more than tolerance (a ratio) or started failing
+    '''
+    def key(scenario):
+        return (scenario['file'], scenario['max_win'], scenario['flp'], scenario['rlp'], scenario['rto'],
+                scenario.get('forward', ''), scenario.get('reverse', ''))
+
+    old = {key(scenario): scenario for scenario in baseline}
+    passed = True
+    for scenario in summary:
+        before = old.get(key(scenario))
+        if before is None or not before['completion_s']:
+            continue
+        if scenario['failed'] > before['failed'] or scenario['completion_s'] is None:
+            print(f'{key(scenario)}: {scenario["failed"]} failed runs, {before["failed"]} before  REGRESSION')
+            passed = False
+            continue
+        ratio = scenario['completion_s'] / before['completion_s']
+        regressed = ratio > tolerance
+        passed = passed and not regressed
+        print(f'{key(scenario)}: {before["completion_s"]} s -> {scenario["completion_s"]} s '
+              f'(x{ratio:.2f}){"  REGRESSION" if regressed else ""}')
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        usage="python3 bench.py [options]",
+        description='loopback benchmark of sender.py and receiver.py, the defaults are the scenarios of cmd.txt')
+    parser.add_argument('--files', nargs='+', default=[os.path.join(HERE, 'random1.txt'), os.path.join(HERE, 'asyoulik.txt')])
+    parser.add_argument('--windows', nargs='+', type=int, default=[1000, 3000], help='max_win values in bytes')
+    parser.add_argument('--flp', nargs='+', type=float, default=[0, 0.2], help='forward loss probabilities')
+    parser.add_argument('--rlp', nargs='+', type=float, default=[0, 0.3], help='reverse loss probabilities')
+    parser.add_argument('--rto', nargs='+', type=int, default=[500], help='initial RTOs in milliseconds')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per scenario, seeded seed, seed+1, ...')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the first run of every scenario')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before a run is killed')
+    parser.add_argument('--sender-args', default='', help="extra sender.py options, e.g. '--cc cubic --io plain'")
+    parser.add_argument('--receiver-args', default='', help='extra receiver.py options')
+    parser.add_argument('--forward', default='', help='run through proxy.py with this sender to receiver link SPEC')
+    parser.add_argument('--reverse', default='', help='run through proxy.py with this receiver to sender link SPEC')
+    parser.add_argument('--csv', help='write every run to this CSV file')
+    parser.add_argument('--json', help='write the runs and the per scenario summary to this JSON file')
+    parser.add_argument('--baseline', help='JSON report of an earlier version to compare completion times with')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='completion time ratio reported as a regression')
+    args = parser.parse_args()
+
+    rows = []
+    for file, max_win, flp, rlp, rto, repeat in itertools.product(
+            args.files, args.windows, args.flp, args.rlp, args.rto, range(args.repeat)):
+        row = run_once(file, max_win, flp, rlp, rto, args.seed + repeat, args.timeout,
+                       args.sender_args.split(), args.receiver_args.split(), args.forward, args.reverse)
+        rows.append(row)
+        print(f"{row['file']:<16} win {max_win:<6} flp {flp:<5} rlp {rlp:<5} rto {rto:<5} seed {row['seed']:<4} "
+              f"{row['status']:<8} {row.get('completion_s')} s  {row.get('goodput_Bps')} B/s  "
+              f"rexmit {row.get('retransmitted_segments')}  rss {row['sender_rss_kb']}/{row['receiver_rss_kb']} KB")
+    summary = summarize(rows)
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'runs': rows, 'summary': summary}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['summary']
+        if not compare(summary, baseline, args.tolerance):
+            sys.exit(1)
+    if any(row['status'] not in ('ok', 'reset') for row in rows):
+        sys.exit(1)
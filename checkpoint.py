@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import time
+
+# bytes hashed at each end of the file for its identity
+IDENTITY_SAMPLE = 1<<16
+# the receiver commits written data at least this often
+CHECKPOINT_BYTES = 1<<20
+CHECKPOINT_INTERVAL = 1
+
+
+def file_identity(path: str):
+    '''
+    16-byte identity of a file: its size, mtime and first and last 64k hashed.
+    Cheap for multi-GB files, and a file rewritten in place gets a new mtime.
+    '''
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+        digest.update(f.read(IDENTITY_SAMPLE))
+        if stat.st_size > IDENTITY_SAMPLE:
+            f.seek(max(stat.st_size - IDENTITY_SAMPLE, IDENTITY_SAMPLE))
+            digest.update(f.read())
+    return digest.digest()
+
+
+def prefix_sample(fd: int, size: int):
+    '''hash of the last 64k of the first size bytes of the open file fd'''
+    start = max(size - IDENTITY_SAMPLE, 0)
+    return hashlib.blake2b(os.pread(fd, size - start, start), digest_size=16).hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, output_path: str) -> None:
+        '''
+        How much of a partial output file is safely on disk, kept next to it as output_path.ckpt,
+        so an interrupted transfer resumes from there.
+        :param output_path: the file being received
+        '''
+        self.output_path = output_path
+        self.path = f'{output_path}.ckpt'
+        self.file_id = None
+        self.file_size = 0
+        self.committed = 0  # bytes of the output file flushed to disk
+        self.last_bytes = 0  # committed at the last save
+        self.last_time = time.monotonic()
+
+    def resume_offset(self, file_id: bytes, file_size: int):
+        '''
+        the bytes already received of this file, 0 unless the checkpoint is of the same file
+        and the output still holds what it committed, then track this file from there
+        '''
+        offset = 0
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            with open(self.output_path, 'rb') as output:
+                stat = os.fstat(output.fileno())
+                committed = saved['committed']
+                # the output may have been replaced, truncated or rewritten by another transfer since
+                if (saved['file_id'] == file_id.hex() and saved['file_size'] == file_size
+                        and saved['output'] == [stat.st_dev, stat.st_ino] and stat.st_size >= committed
+                        and saved['sample'] == prefix_sample(output.fileno(), committed)):
+                    offset = min(committed, file_size)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.file_id = file_id
+        self.file_size = file_size
+        self.committed = self.last_bytes = offset
+        return offset
+
+    def due(self):
+        '''whether enough was written since the last save'''
+        return (self.committed - self.last_bytes >= CHECKPOINT_BYTES
+                or time.monotonic() - self.last_time >= CHECKPOINT_INTERVAL)
+
+    def save(self, file):
+        '''
+        flush file to disk, then record how much of it is there, replaced atomically,
+        with the inode of the output and a sample of the committed bytes to tell it is still the same data
+        '''
+        file.flush()
+        os.fsync(file.fileno())
+        # file may be write-only
+        with open(self.output_path, 'rb') as output:
+            stat = os.fstat(output.fileno())
+            sample = prefix_sample(output.fileno(), self.committed)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'file_id': self.file_id.hex(), 'file_size': self.file_size, 'committed': self.committed,
+                       'output': [stat.st_dev, stat.st_ino], 'sample': sample}, f)
+        os.replace(tmp_path, self.path)
+        self.last_bytes = self.committed
+        self.last_time = time.monotonic()
+
+    def remove(self):
+        '''the transfer completed or the output is written afresh, nothing to resume'''
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,96 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from util import *
+from segment import SegmentSource
+
+COMPRESS_LEVEL = 6
+# spare cores, the send loop has one
+COMPRESS_WORKERS = min(max((os.cpu_count() or 1) - 1, 0), 2)
+# after this many segments in a row don't shrink, only every COMPRESS_RETRY-th one is tried
+COMPRESS_MISSES = 8
+COMPRESS_RETRY = 16
+
+
+def compress_payload(payload, level: int = COMPRESS_LEVEL):
+    '''zlib stream of payload, None when it doesn't shrink'''
+    data = zlib.compress(payload, level)
+    return data if len(data) < len(payload) else None
+
+
+def decompress_payload(payload, limit: int):
+    '''
+    the data of a compressed DATA payload
+    :param limit: the most data a segment may carry
+    :raise zlib.error: the stream is corrupt, truncated or inflates beyond limit
+    '''
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, limit)
+    if not decompressor.eof or decompressor.unconsumed_tail:
+        raise zlib.error('incomplete or oversized compressed segment')
+    return data
+
+
+class CompressedSegmentSource(SegmentSource):
+    def __init__(self, *args, level: int = COMPRESS_LEVEL, workers: int = COMPRESS_WORKERS,
+                 ahead: int = 64, **kwargs) -> None:
+        '''
+        SegmentSource whose DATA payloads are zlib compressed, every segment on its own so each one
+        decompresses without the others, seqs still count file bytes.
+        Payloads are compressed ahead of the send loop on a thread pool (zlib releases the GIL),
+        those that don't shrink go out raw, and incompressible data is mostly not tried at all.
+        :param level: zlib compression level
+        :param workers: compression threads, 0 compresses in the send loop
+        :param ahead: segments compressed ahead of the one being sent
+        '''
+        super().__init__(*args, **kwargs)
+        self.level = level
+        self.ahead = max(ahead, 1)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='compress') if workers > 0 else None
+        self.compressed = {}  # seg id -> future of the compressed payload, None to send it raw
+        self.next_id = 0  # segments before next_id were submitted
+        self.dropped_id = 0  # compressed payloads before dropped_id were dropped
+        self.misses = 0  # segments in a row that didn't shrink
+
+    def segment(self, seg_id: int, flags: int = 0):
+        '''the (header, payload) of segment seg_id, flagged COMPRESS when the payload is compressed'''
+        if self.pool is None:
+            payload = self.try_compress(seg_id)
+        else:
+            self.prefetch(seg_id)
+            future = self.compressed.get(seg_id)
+            payload = None if future is None else future.result()
+        if payload is None:
+            return super().segment(seg_id, flags)
+        return self.header(seg_id, flags | Flag.COMPRESS), payload
+
+    def try_compress(self, seg_id: int):
+        '''compressed payload of seg_id, None to send it raw'''
+        if self.misses >= COMPRESS_MISSES and seg_id % COMPRESS_RETRY:
+            return None
+        return self.compress_payload(seg_id)
+
+    def compress_payload(self, seg_id: int):
+        payload = compress_payload(self.payload(seg_id), self.level)
+        # a worker thread may race on misses, it only steers which segments are tried
+        self.misses = 0 if payload is not None else self.misses + 1
+        return payload
+
+    def prefetch(self, seg_id: int):
+        # acked segments are never sent again
+        acked_id = self.acked_id
+        for id in range(self.dropped_id, acked_id):
+            self.compressed.pop(id, None)
+        self.dropped_id = max(self.dropped_id, acked_id)
+        last_id = min(seg_id + self.ahead, self.seg_count)
+        for id in range(max(self.next_id, seg_id), last_id):
+            if self.misses < COMPRESS_MISSES or not id % COMPRESS_RETRY:
+                self.compressed[id] = self.pool.submit(self.compress_payload, id)
+        self.next_id = max(self.next_id, last_id)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        self.compressed.clear()
+        super().close()
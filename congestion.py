@@ -0,0 +1,125 @@
+class CongestionControl:
+    def __init__(self, mss: int) -> None:
+        '''
+        Congestion window (cwnd, in bytes) the Sender consults on every ACK, duplicate ACK and timeout.
+        The Sender owns loss recovery (which segments to resend), the controller only owns the window.
+        :param mss: the maximum payload size of a DATA segment
+        '''
+        self.mss = mss
+        self.cwnd = float('inf')
+        self.ssthresh = float('inf')
+
+    def on_ack(self, acked: int, now: float):
+        '''new cumulative ACK for acked bytes outside loss recovery, now in milliseconds'''
+
+    def on_enter_recovery(self, flight_size: int, now: float):
+        '''three duplicate ACKs, fast retransmit and enter loss recovery'''
+
+    def on_dup_ack(self):
+        '''duplicate ACK during loss recovery'''
+
+    def on_partial_ack(self, acked: int):
+        '''ACK during loss recovery that leaves more holes to retransmit (NewReno)'''
+
+    def on_exit_recovery(self):
+        '''ACK covering everything sent before loss recovery started'''
+
+    def on_timeout(self, flight_size: int, now: float):
+        '''retransmission timer fired'''
+
+
+class FixedWindow(CongestionControl):
+    '''no congestion control, the sender is only limited by max_win'''
+
+
+class Reno(CongestionControl):
+    def __init__(self, mss: int) -> None:
+        '''slow start, congestion avoidance and NewReno fast recovery (RFC 5681, RFC 6582)'''
+        super().__init__(mss)
+        self.cwnd = 10 * mss  # initial window (RFC 6928)
+
+    def on_ack(self, acked: int, now: float):
+        if self.cwnd < self.ssthresh:
+            # slow start, appropriate byte counting with L = 2 (RFC 3465)
+            self.cwnd += min(acked, 2 * self.mss)
+        else:
+            self.congestion_avoidance(acked, now)
+
+    def congestion_avoidance(self, acked: int, now: float):
+        self.cwnd += self.mss * acked / self.cwnd
+
+    def reduce(self, flight_size: int, now: float):
+        '''multiplicative decrease on a congestion event'''
+        self.ssthresh = max(flight_size / 2, 2 * self.mss)
+
+    def on_enter_recovery(self, flight_size: int, now: float):
+        self.reduce(flight_size, now)
+        self.cwnd = self.ssthresh + 3 * self.mss
+
+    def on_dup_ack(self):
+        # every duplicate ACK means a segment left the network
+        self.cwnd += self.mss
+
+    def on_partial_ack(self, acked: int):
+        # deflate by the acked bytes, add back one segment for the retransmission
+        self.cwnd = max(self.cwnd - acked + self.mss, self.mss)
+
+    def on_exit_recovery(self):
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, flight_size: int, now: float):
+        self.reduce(flight_size, now)
+        self.cwnd = self.mss
+
+
+class Cubic(Reno):
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss: int) -> None:
+        '''CUBIC window growth (RFC 9438) on top of the Reno loss recovery'''
+        super().__init__(mss)
+        self.w_max = 0  # window before the last reduction, in segments
+        self.k = 0  # seconds to grow back to w_max
+        self.epoch_start = None  # start of the current congestion avoidance epoch, milliseconds
+        self.w_est = 0  # Reno-friendly window estimate, in segments
+
+    def congestion_avoidance(self, acked: int, now: float):
+        cwnd = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd < self.w_max:
+                self.k = ((self.w_max - cwnd) / self.C) ** (1/3)
+            else:
+                self.k = 0
+                self.w_max = cwnd
+            self.w_est = cwnd
+        t = (now - self.epoch_start) / 1000
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        target = min(max(target, cwnd), 1.5 * cwnd)
+        segs = acked / self.mss
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * segs / cwnd
+        cwnd += (target - cwnd) / cwnd * segs
+        self.cwnd = max(cwnd, self.w_est) * self.mss
+
+    def reduce(self, flight_size: int, now: float):
+        cwnd = self.cwnd / self.mss
+        # fast convergence: release bandwidth when the window stopped growing
+        if cwnd < self.w_max:
+            self.w_max = cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = cwnd
+        self.epoch_start = None
+        self.ssthresh = max(self.cwnd * self.BETA, 2 * self.mss)
+
+    def on_enter_recovery(self, flight_size: int, now: float):
+        self.reduce(flight_size, now)
+        self.cwnd = self.ssthresh
+
+
+# congestion control algorithms selectable from the CLI
+CONGESTION_CONTROLS = {
+    'reno': Reno,
+    'cubic': Cubic,
+    'fixed': FixedWindow,
+}
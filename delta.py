@@ -0,0 +1,205 @@
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+from util import *
+
+DELTA_BLOCK = 1024  # smallest basis block
+ADLER_MOD = 65521
+# signatures that fit one SYN ACK next to the other options
+MAX_SIGNATURES = (MAX_UDP_PAYLOAD - HEADER_SIZE - 64 - DELTA.size) // SIGNATURE.size
+# delta stream records: an op, then a literal length (the literal data follows),
+# a run of basis blocks, or the digest of the new file, which ends the stream
+OP_LITERAL, OP_COPY, OP_END = 0, 1, 2
+LITERAL = struct.Struct('!BI')
+COPY = struct.Struct('!BII')
+END = struct.Struct('!B16s')
+RECORDS = {OP_LITERAL: LITERAL, OP_COPY: COPY, OP_END: END}
+COPY_CHUNK = 1<<20  # basis bytes read at once while copying
+
+
+def strong_sum(block):
+    return hashlib.blake2b(block, digest_size=8).digest()
+
+
+def file_digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def signature_block_size(size: int):
+    '''DELTA_BLOCK, or bigger for big basis files so their signatures fit one SYN ACK'''
+    return max(DELTA_BLOCK, -(-size // MAX_SIGNATURES))
+
+
+def block_signatures(path: str):
+    '''(block size, SIGNATURE entries) of the full blocks of the basis file'''
+    block_size = signature_block_size(os.path.getsize(path))
+    entries = bytearray()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            entries += SIGNATURE.pack(zlib.adler32(block), strong_sum(block))
+    return block_size, bytes(entries)
+
+
+def write_delta(path: str, block_size: int, signatures: bytes, out):
+    '''
+    Write the delta stream that turns the receiver's basis into the file at path (the rsync algorithm):
+    a rolling Adler-32 finds candidate blocks at every offset, the strong sum confirms them.
+    Pure Python rolls through changed regions at about 2 MB/s, unchanged ones skip a block per match.
+    :param block_size: the basis block size
+    :param signatures: the SIGNATURE entries of the basis blocks
+    :param out: binary file the stream is written to
+    :return: (literal bytes, copied bytes)
+    '''
+    table = {}  # weak sum -> {strong sum: block index}
+    for index, (weak, strong) in enumerate(SIGNATURE.iter_unpack(signatures)):
+        table.setdefault(weak, {}).setdefault(strong, index)
+    literal_bytes = copied_bytes = 0
+    run = None  # [first block, count] of the copy not written yet
+
+    def flush_run():
+        nonlocal run
+        if run is not None:
+            out.write(COPY.pack(OP_COPY, *run))
+            run = None
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        digest = file_digest()
+        digest.update(data)
+        pos = literal_start = 0
+        last = size - block_size  # the last offset a block starts at
+        while pos <= last:
+            weak = zlib.adler32(data[pos:pos + block_size])
+            a, b = weak & 0xffff, weak >> 16
+            while True:
+                strongs = table.get(weak)
+                if strongs is not None:
+                    index = strongs.get(strong_sum(data[pos:pos + block_size]))
+                    if index is not None:
+                        break
+                if pos == last:
+                    index = None
+                    break
+                # roll the window one byte forward
+                old = data[pos]
+                a = (a - old + data[pos + block_size]) % ADLER_MOD
+                b = (b - block_size * old + a - 1) % ADLER_MOD
+                weak = b << 16 | a
+                pos += 1
+            if index is None:
+                break
+            if literal_start < pos:
+                flush_run()
+                out.write(LITERAL.pack(OP_LITERAL, pos - literal_start))
+                out.write(data[literal_start:pos])
+                literal_bytes += pos - literal_start
+            if run is not None and run[0] + run[1] == index:
+                run[1] += 1
+            else:
+                flush_run()
+                run = [index, 1]
+            copied_bytes += block_size
+            pos += block_size
+            literal_start = pos
+        if literal_start < size:
+            flush_run()
+            out.write(LITERAL.pack(OP_LITERAL, size - literal_start))
+            out.write(data[literal_start:size])
+            literal_bytes += size - literal_start
+        flush_run()
+        out.write(END.pack(OP_END, digest.digest()))
+        if size:
+            data.close()
+    return literal_bytes, copied_bytes
+
+
+class DeltaWriter:
+    def __init__(self, basis_path: str, block_size: int) -> None:
+        '''
+        File-like target of a delta stream: rebuilds the new file from literal data and basis blocks
+        into basis_path.delta, which replaces the basis once the stream ends and the digest matches.
+        :param basis_path: the receiver's copy, the output file
+        :param block_size: the block size of the signatures sent to the sender
+        '''
+        self.basis_path = basis_path
+        self.tmp_path = f'{basis_path}.delta'
+        self.block_size = block_size
+        self.basis = open(basis_path, 'rb')
+        self.block_count = os.fstat(self.basis.fileno()).st_size // block_size
+        self.out = open(self.tmp_path, 'wb')
+        self.digest = file_digest()
+        self.record = bytearray()  # record header read so far
+        self.literal = 0  # literal bytes still to come
+        self.ended = False
+        self.ok = False  # the new file replaced the basis
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None or self.ended:
+            return
+        data = memoryview(data)
+        try:
+            while data:
+                if self.literal:
+                    chunk = data[:self.literal]
+                    self.emit(chunk)
+                    self.literal -= len(chunk)
+                    data = data[len(chunk):]
+                    continue
+                if not self.record and data[0] not in RECORDS:
+                    raise ValueError(f'unknown delta op {data[0]}')
+                record = RECORDS[self.record[0] if self.record else data[0]]
+                take = record.size - len(self.record)
+                self.record += data[:take]
+                data = data[take:]
+                if len(self.record) == record.size:
+                    self.apply(record.unpack(self.record))
+                    self.record.clear()
+                    if self.ended:
+                        break
+        except (OSError, ValueError) as e:
+            self.error = e
+
+    def apply(self, record: tuple):
+        op = record[0]
+        if op == OP_LITERAL:
+            self.literal = record[1]
+        elif op == OP_COPY:
+            first, count = record[1:]
+            if first + count > self.block_count:
+                raise ValueError(f'copy of blocks {first}+{count} beyond the basis')
+            self.basis.seek(first * self.block_size)
+            remaining = count * self.block_size
+            while remaining:
+                chunk = self.basis.read(min(remaining, COPY_CHUNK))
+                if not chunk:
+                    raise ValueError('the basis was truncated during the transfer')
+                self.emit(chunk)
+                remaining -= len(chunk)
+        else:
+            self.ended = True
+            if record[1] != self.digest.digest():
+                raise ValueError('the rebuilt file does not match the sender digest')
+
+    def emit(self, data):
+        self.out.write(data)
+        self.digest.update(data)
+
+    def close(self):
+        '''replace the basis with the rebuilt file, or keep the basis if the stream was cut short or corrupt'''
+        self.out.close()
+        self.basis.close()
+        if self.ended and self.error is None:
+            os.replace(self.tmp_path, self.basis_path)
+            self.ok = True
+        else:
+            if self.error is None:
+                self.error = ValueError('the delta stream ended early')
+            os.remove(self.tmp_path)
@@ -0,0 +1,123 @@
+import math
+import struct
+from collections import OrderedDict
+
+from util import *
+
+# parity payload header: parity index in its block, stride (parity segments of the block),
+# segment size and DATA bytes of the block, the XOR of the members follows
+PARITY = struct.Struct('!BBHI')
+
+
+def xor_parity(payloads, size: int):
+    '''XOR of payloads, each padded with zeros to size bytes'''
+    acc = 0
+    for payload in payloads:
+        acc ^= int.from_bytes(payload, 'big') << (8 * (size - len(payload)))
+    return acc.to_bytes(size, 'big')
+
+
+def parity_count(block: int, max_parity: int, loss: float):
+    '''parity segments per block of DATA segments: twice the expected losses, at least one'''
+    return min(max_parity, max(1, math.ceil(2 * block * loss)))
+
+
+class FecEncoder:
+    def __init__(self, source, block: int, max_parity: int) -> None:
+        '''
+        Interleaved XOR parity over blocks of DATA segments: parity j of a block covers the members
+        i with i % stride == j, so one loss per member class is rebuilt without a retransmission.
+        :param source: the SegmentSource of the DATA segments
+        :param block: DATA segments per block
+        :param max_parity: most parity segments per block, negotiated at SYN
+        '''
+        self.source = source
+        self.block = block
+        self.max_parity = max_parity
+
+    def closes_block(self, seg_id: int):
+        '''whether seg_id is the last DATA segment of its block'''
+        return (seg_id + 1) % self.block == 0 or seg_id + 1 == self.source.seg_count
+
+    def parity(self, block_id: int, loss: float = 0):
+        '''
+        the parity segments of a block, as (header, payload) pairs
+        :param loss: the loss rate seen so far, it sets how many parity segments are sent
+        '''
+        source = self.source
+        first_id = block_id * self.block
+        ids = range(first_id, min(first_id + self.block, source.seg_count))
+        payloads = [source.payload(id) for id in ids]
+        size = source.max_data_size
+        block_bytes = sum(len(payload) for payload in payloads)
+        # a stride above the member count would only repeat members
+        stride = min(parity_count(self.block, self.max_parity, loss), len(payloads))
+        header = build_segment_header(Type.DATA, source.id_to_seq(first_id), flags=Flag.FEC)
+        return [(header, PARITY.pack(index, stride, size, block_bytes) + xor_parity(payloads[index::stride], size))
+                for index in range(stride)]
+
+
+class FecDecoder:
+    def __init__(self, ring, block: int, mod: int = SEQ_MOD[HEADER_VERSION]) -> None:
+        '''
+        Rebuild a DATA segment from a parity segment and the other members of its class.
+        Members already written are gone from the receive buffer, so the latest ones stay referenced here.
+        :param ring: the RecvRing the payloads live in
+        :param block: DATA segments per block, negotiated at SYN
+        :param mod: the sequence number space
+        '''
+        self.ring = ring
+        self.mod = mod
+        self.cache_size = 2 * block
+        self.written = OrderedDict()  # seq -> (payload, slot) of the latest written DATA
+
+    def keep(self, seq: int, data: memoryview, slot: int):
+        '''hold a reference to written in-order data, slot is None for data outside the ring'''
+        if not data or seq in self.written:
+            return
+        if slot is not None:
+            self.ring.retain(slot)
+        self.written[seq] = (data, slot)
+        if len(self.written) > self.cache_size:
+            _, (_, old_slot) = self.written.popitem(last=False)
+            if old_slot is not None:
+                self.ring.release(old_slot)
+
+    def recover(self, block_seq: int, payload: memoryview, held: dict, want_seq: int):
+        '''
+        :param block_seq: the seq of the parity segment, its block's first DATA byte
+        :param payload: the parity payload
+        :param held: out-of-order data by seq
+        :param want_seq: the next in-order seq
+        :return: (seq, data) of the rebuilt member, None unless exactly one member of the class is missing
+        '''
+        if len(payload) < PARITY.size:
+            return None
+        index, stride, size, block_bytes = PARITY.unpack_from(payload)
+        parity = payload[PARITY.size:]
+        if not stride or not size or len(parity) != size:
+            return None
+        count = (block_bytes + size - 1) // size
+        acc = int.from_bytes(parity, 'big')
+        missing = None
+        for i in range(index, count, stride):
+            seq = seq_add(block_seq, i * size, self.mod)
+            data = held.get(seq)
+            if data is None and seq in self.written:
+                data = self.written[seq][0]
+            if data is None:
+                if seq_lt(seq, want_seq, self.mod) or missing is not None:
+                    return None  # written and forgotten, or more losses than the parity covers
+                missing = (seq, min(size, block_bytes - i * size))
+                continue
+            acc ^= int.from_bytes(data, 'big') << (8 * (size - len(data)))
+        if missing is None:
+            return None
+        seq, length = missing
+        return seq, acc.to_bytes(size, 'big')[:length]
+
+    def close(self):
+        for _, slot in self.written.values():
+            if slot is not None:
+                self.ring.release(slot)
+        self.written.clear()
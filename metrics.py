@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+
+SUB_BUCKET_BITS = 5  # 32 exact buckets, then 16 buckets per power of two
+HALF_SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    def __init__(self, resolution: float = 0.001) -> None:
+        '''
+        Log-linear buckets like HdrHistogram: exact below 32 units, then 16 buckets per power of two,
+        so any recorded value is off by at most 1/16.
+        :param resolution: the value of one unit, 1 us for values in milliseconds
+        '''
+        self.resolution = resolution
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value: float):
+        units = max(int(value / self.resolution), 0)
+        shift = units.bit_length() - SUB_BUCKET_BITS
+        index = units if shift <= 0 else shift * HALF_SUB_BUCKETS + (units >> shift)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def bucket_value(self, index: int):
+        '''lowest value of a bucket'''
+        if index < 2 * HALF_SUB_BUCKETS:
+            return index * self.resolution
+        shift = index // HALF_SUB_BUCKETS - 1
+        return ((index - shift * HALF_SUB_BUCKETS) << shift) * self.resolution
+
+    def percentile(self, p: float):
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def snapshot(self):
+        snapshot = {'count': self.count, 'min': self.min, 'max': self.max,
+                    'mean': self.sum / self.count if self.count else None}
+        for p in PERCENTILES:
+            snapshot[f'p{p}'] = self.percentile(p)
+        return snapshot
+
+
+class Metrics:
+    def __init__(self) -> None:
+        '''
+        Counters, gauges and histograms of one endpoint, by name.
+        Updates aren't locked, callers already hold their own lock on the paths that race.
+        '''
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.t_start = time.monotonic()
+
+    def inc(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        '''add one sample to the histogram name'''
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.record(value)
+
+    def elapsed(self):
+        '''seconds since the metrics were created'''
+        return time.monotonic() - self.t_start
+
+    def snapshot(self):
+        return {
+            'elapsed_s': round(self.elapsed(), 3),
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'histograms': {name: histogram.snapshot() for name, histogram in list(self.histograms.items())},
+        }
+
+    def dump_json(self, path: str):
+        '''write a snapshot to path, replaced atomically so readers never see half a file'''
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def summary(self, title: str):
+        '''end of transfer summary, one metric per line'''
+        def fmt(value):
+            return '-' if value is None else f'{value:.6g}' if isinstance(value, float) else str(value)
+
+        snapshot = self.snapshot()
+        lines = [f"{title} summary ({snapshot['elapsed_s']} s)"]
+        for name, value in sorted({**snapshot['counters'], **snapshot['gauges']}.items()):
+            lines.append(f'  {name:<28} {fmt(value)}')
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append(f'  {name:<28} ' + '  '.join(f'{key} {fmt(value)}' for key, value in histogram.items()))
+        return '\n'.join(lines)
+
+
+class MetricsDumper:
+    def __init__(self, metrics: Metrics, path: str, interval: float = 1) -> None:
+        '''
+        Dump metrics as JSON to path every interval seconds until stopped, for watching a long transfer.
+        :param metrics: the metrics to dump
+        :param path: the JSON file, rewritten on every dump
+        :param interval: seconds between dumps
+        '''
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.dump_json(self.path)
+
+    def stop(self):
+        '''stop dumping and write the final values'''
+        self.stopped.set()
+        self.thread.join()
+        self.metrics.dump_json(self.path)
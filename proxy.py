@@ -0,0 +1,271 @@
+"""
+    UDP relay that impairs the path between sender and receiver: delay, jitter, reordering,
+    duplication, Gilbert-Elliott burst loss and a token-bucket bottleneck with a drop-tail queue.
+    Usage: python3 proxy.py listen_port receiver_port [--forward SPEC] [--reverse SPEC] [--seed N]
+
+    The sender sends to listen_port instead of the receiver port, the receiver replies to the relay.
+        python3 receiver.py 9000 9001 FileReceived.txt 0 0
+        python3 proxy.py 9100 9000 --forward delay=20,jitter=5,rate=8,queue=30000 --reverse delay=20
+        python3 sender.py 9001 9100 FileToSend.txt 30000 500
+
+    SPEC is a comma separated list of key=value for one direction (forward is sender to receiver):
+        delay          one-way delay in ms
+        jitter         delay variation in ms
+        dist           jitter distribution: uniform (delay +- jitter), normal (sigma jitter), exponential (mean jitter)
+        reorder        probability a datagram is held back by reorder_delay ms, later ones overtake it
+        reorder_delay  ms, 2 x delay or 5 ms by default
+        duplicate      probability a datagram is delivered twice
+        loss           loss probability (in the good state)
+        burst_p        probability of going from the good to the bad state, Gilbert-Elliott, 0 disables it
+        burst_r        probability of going from the bad back to the good state
+        burst_loss     loss probability in the bad state
+        rate           bottleneck bandwidth in Mbit/s, 0 is unlimited
+        burst          token bucket depth in bytes
+        queue          bottleneck queue limit in bytes, drop-tail
+"""
+import argparse
+import asyncio
+import logging
+import random
+import signal
+import sys
+
+from util import MAX_UDP_PAYLOAD
+
+logger = logging.getLogger(__name__)
+
+JITTER_DISTRIBUTIONS = ('uniform', 'normal', 'exponential')
+
+
+class Link:
+    def __init__(self, rng: random.Random, delay: float = 0, jitter: float = 0, dist: str = 'uniform',
+                 reorder: float = 0, reorder_delay: float = None, duplicate: float = 0,
+                 loss: float = 0, burst_p: float = 0, burst_r: float = 1, burst_loss: float = 1,
+                 rate: float = 0, burst: int = MAX_UDP_PAYLOAD, queue: int = 1<<20) -> None:
+        '''
+        One direction of the emulated path, see the module docstring for the parameters.
+        Times are ms here and seconds in schedule.
+        :param rng: the seeded random generator of this direction
+        '''
+        if dist not in JITTER_DISTRIBUTIONS:
+            raise ValueError(f'unknown jitter distribution {dist}')
+        self.rng = rng
+        self.delay = delay / 1000
+        self.jitter = jitter / 1000
+        self.dist = dist
+        self.reorder = reorder
+        self.reorder_delay = (max(2 * delay, 5) if reorder_delay is None else reorder_delay) / 1000
+        self.duplicate = duplicate
+        self.loss = loss
+        self.burst_p = burst_p
+        self.burst_r = burst_r
+        self.burst_loss = burst_loss
+        self.rate = rate * 1e6 / 8  # bytes per second
+        self.burst = burst
+        self.queue = queue
+        self.bad = False  # Gilbert-Elliott state
+        self.tat = 0  # theoretical arrival time of the token bucket (GCRA)
+        self.last_delivery = 0  # datagrams that aren't reordered leave in order
+        self.stats = dict.fromkeys(('forwarded', 'lost', 'queue_drops', 'duplicated', 'reordered'), 0)
+
+    def lost(self):
+        if self.burst_p > 0:
+            if self.bad:
+                self.bad = self.rng.random() >= self.burst_r
+            else:
+                self.bad = self.rng.random() < self.burst_p
+        return self.rng.random() < (self.burst_loss if self.bad else self.loss)
+
+    def shape(self, now: float, size: int):
+        '''departure time from the bottleneck, None when the queue is full'''
+        if self.rate <= 0:
+            return now
+        cost = size / self.rate
+        departure = max(now, self.tat - self.burst / self.rate)
+        if (departure - now) * self.rate + size > self.queue:
+            return None
+        self.tat = max(self.tat, now) + cost
+        return departure
+
+    def propagation(self):
+        if not self.jitter:
+            return self.delay
+        if self.dist == 'normal':
+            delay = self.rng.gauss(self.delay, self.jitter)
+        elif self.dist == 'exponential':
+            delay = self.delay + self.rng.expovariate(1 / self.jitter)
+        else:
+            delay = self.delay + self.rng.uniform(-self.jitter, self.jitter)
+        return max(delay, 0)
+
+    def schedule(self, now: float, size: int):
+        '''
+        :return: the delivery times (loop seconds) of a datagram of size bytes sent at now,
+                 none when it's lost, two when it's duplicated
+        '''
+        if self.lost():
+            self.stats['lost'] += 1
+            return []
+        departure = self.shape(now, size)
+        if departure is None:
+            self.stats['queue_drops'] += 1
+            return []
+        copies = 2 if self.rng.random() < self.duplicate else 1
+        self.stats['duplicated'] += copies - 1
+        deliveries = []
+        for _ in range(copies):
+            delivery = departure + self.propagation()
+            if self.rng.random() < self.reorder:
+                self.stats['reordered'] += 1
+                delivery += self.reorder_delay
+            else:
+                delivery = max(delivery, self.last_delivery)
+                self.last_delivery = delivery
+            deliveries.append(delivery)
+        self.stats['forwarded'] += 1
+        return deliveries
+
+
+def parse_link_spec(spec: str):
+    ''''delay=20,dist=normal' -> {'delay': 20.0, 'dist': 'normal'}'''
+    options = {}
+    for item in filter(None, spec.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key == 'dist':
+            options[key] = value.strip()
+        elif key in ('burst', 'queue'):
+            options[key] = int(value)
+        else:
+            options[key] = float(value)
+    return options
+
+
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, relay, client_address: tuple) -> None:
+        '''the relay socket of one sender, the receiver replies to it'''
+        self.relay = relay
+        self.client_address = client_address
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.relay.send(self.relay.reverse, self.relay.transport, data, self.client_address)
+
+    def error_received(self, exc):
+        logger.debug(f'relay socket error: {exc}')
+
+
+class Relay(asyncio.DatagramProtocol):
+    def __init__(self, receiver_address: tuple, forward: Link, reverse: Link) -> None:
+        '''
+        Listens for senders and relays each one to the receiver from its own socket,
+        so the receiver tells the senders apart by address.
+        :param receiver_address: where datagrams from senders go
+        :param forward: the link from senders to the receiver
+        :param reverse: the link from the receiver to senders
+        '''
+        self.receiver_address = receiver_address
+        self.forward = forward
+        self.reverse = reverse
+        self.clients = {}  # sender address -> ClientProtocol, None while its socket is opening
+        self.pending = {}  # sender address -> datagrams received while its socket is opening
+        self.transport = None
+        self.loop = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    def datagram_received(self, data, address):
+        client = self.clients.get(address)
+        if client is not None:
+            self.send(self.forward, client.transport, data, self.receiver_address)
+        elif address in self.clients:
+            self.pending[address].append(data)
+        else:
+            self.clients[address] = None
+            self.pending[address] = [data]
+            self.loop.create_task(self.open_client(address))
+
+    async def open_client(self, address: tuple):
+        _, client = await self.loop.create_datagram_endpoint(
+            lambda: ClientProtocol(self, address), local_addr=('127.0.0.1', 0))
+        self.clients[address] = client
+        logger.info(f'relaying {address[0]}:{address[1]}')
+        for data in self.pending.pop(address):
+            self.send(self.forward, client.transport, data, self.receiver_address)
+
+    def error_received(self, exc):
+        logger.debug(f'relay socket error: {exc}')
+
+    def send(self, link: Link, transport, data: bytes, address: tuple):
+        now = self.loop.time()
+        for delivery in link.schedule(now, len(data)):
+            if delivery <= now:
+                transport.sendto(data, address)
+            else:
+                self.loop.call_at(delivery, self.deliver, transport, data, address)
+
+    @staticmethod
+    def deliver(transport, data: bytes, address: tuple):
+        if not transport.is_closing():
+            transport.sendto(data, address)
+
+    def close(self):
+        for client in self.clients.values():
+            if client is not None:
+                client.transport.close()
+        self.transport.close()
+
+
+async def serve(listen_address: tuple, receiver_address: tuple, forward: Link, reverse: Link):
+    '''relay until cancelled'''
+    loop = asyncio.get_running_loop()
+    _, relay = await loop.create_datagram_endpoint(
+        lambda: Relay(receiver_address, forward, reverse), local_addr=listen_address)
+    try:
+        await loop.create_future()
+    finally:
+        relay.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.INFO,
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S')
+
+    parser = argparse.ArgumentParser(
+        usage="python3 proxy.py listen_port receiver_port [--forward SPEC] [--reverse SPEC] [--seed N]",
+        description='UDP relay emulating delay, jitter, reordering, duplication, burst loss and a bottleneck')
+    parser.add_argument('listen_port', type=int, help='the port the sender sends to')
+    parser.add_argument('receiver_port', type=int)
+    parser.add_argument('--forward', default='', help="sender to receiver link, e.g. 'delay=20,jitter=5,rate=8'")
+    parser.add_argument('--reverse', default='', help='receiver to sender link')
+    parser.add_argument('--seed', type=int, help='seed of the impairments for reproducible runs')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    # one generator per direction, ACK traffic doesn't shift the DATA impairments
+    forward = Link(random.Random(rng.random()), **parse_link_spec(args.forward))
+    reverse = Link(random.Random(rng.random()), **parse_link_spec(args.reverse))
+
+    async def main():
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        try:
+            await serve(('127.0.0.1', args.listen_port), ('127.0.0.1', args.receiver_port), forward, reverse)
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    logger.info(f'forward {forward.stats}')
+    logger.info(f'reverse {reverse.stats}')
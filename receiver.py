@@ -1,194 +1,475 @@
-"""
-    Sample code for Receiver
-    Python 3
-    Usage: python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp
-    coding: utf-8
-
-    Notes:
-        Try to run the server first with the command:
-            python3 receiver_template.py 9000 10000 FileReceived.txt 1 1
-        Then run the sender:
-            python3 sender_template.py 11000 9000 FileToReceived.txt 1000 1
-
-    Author: Rui Li (Tutor for COMP3331/9331)
-"""
-# here are the libs you may find it useful:
-import datetime, time  # to calculate the time delta of packet transmission
-import logging, sys  # to write the log
-import socket  # Core lib, to send packet via UDP socket
-from threading import Thread  # (Optional)threading will make the timer easily implemented
-import random  # for flp and rlp function
-import threading
-
-from util import *
-
-BUFFERSIZE = 1024
-
-seg_type_to_name = {
-    0: 'DATA',
-    1: 'ACK',
-    2: 'SYN',
-    3: 'FIN',
-    4: 'RESET'
-}
-
-class Receiver:
-    def __init__(self, receiver_port: int, sender_port: int, filename: str, flp: float, rlp: float) -> None:
-        '''
-        The server will be able to receive the file from the sender via UDP
-        :param receiver_port: the UDP port number to be used by the receiver to receive PTP segments from the sender.
-        :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver.
-        :param filename: the name of the text file into which the text sent by the sender should be stored
-        :param flp: forward loss probability, which is the probability that any segment in the forward direction (Data, FIN, SYN) is lost.
-        :param rlp: reverse loss probability, which is the probability of a segment in the reverse direction (i.e., ACKs) being lost.
-
-        '''
-        self.address = "127.0.0.1"  # change it to 0.0.0.0 or public ipv4 address if want to test it between different computers
-        self.receiver_port = int(receiver_port)
-        self.sender_port = int(sender_port)
-        self.server_address = (self.address, self.receiver_port)
-        self.store_file = filename
-        self.client_address = ""
-        self.seq_data = {}
-        self.want_seq = 0
-        self.data_start_seq = -1
-        self.max_win = 1<<14  # 16k
-        self.flp = float(flp)
-        self.rlp = float(rlp)
-        self.t_start = 0
-        self.state = State.NONE
-
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.INFO)
-        ch = logging.StreamHandler()
-        ch = logging.FileHandler('Receiver_log.txt', 'w+')
-        ch.setLevel(logging.INFO)
-        # add ch to logger
-        self.logger.addHandler(ch)
-        # init the UDP socket
-        # define socket for the server side and bind address
-        print(f"The sender is using the address {self.server_address} to receive message!")
-        self.receiver_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.receiver_socket.bind(self.server_address)
-        self.receiver_socket.settimeout(2)
-    
-    def run(self) -> None:
-        '''
-        This function contain the main logic of the receiver
-        '''
-        while self.state != State.END:
-            # try to receive any incoming message from the sender
-            try:
-                incoming_message, sender_address = self.receiver_socket.recvfrom(BUFFERSIZE)
-            except:
-                continue
-            if len(incoming_message) == 4:
-                # SYN FIN RESET segment
-                type, seq = struct.unpack('HH', incoming_message)
-                # forward segment loss
-                if random.random() <= self.flp:
-                    if self.t_start == 0:
-                        # SYN loss
-                        self.t_start = get_current_time()
-                        t_inv = 0
-                    else:
-                        t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'drp  {t_inv:<10}  {seg_type_to_name[type]}  {seq:<6}  0')
-                    continue
-                if type == Type.SYN.value:
-                    self.client_address = sender_address
-                    if self.t_start == 0:
-                        self.t_start = get_current_time()
-                        t_inv = 0
-                    else:
-                        t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'rev  {t_inv:<10}  SYN  {seq:<6}  0')
-                    print (f"client{sender_address} send syn message, seq: {seq}")
-                    self.data_start_seq = seq + 1
-                    self.want_seq = seq + 1
-                    self.reply_ack(self.want_seq)
-                    self.state = State.CONNECT
-                
-                if type == Type.FIN.value:
-                    t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'rev  {t_inv:<10}  FIN  {seq:<6}  0')
-                    print (f"client{sender_address} send fin message, seq: {seq}")
-                    # write received data to file
-                    self.write_file()
-                    self.want_seq = seq + 1
-                    self.reply_ack(self.want_seq)
-                    self.state = State.CLOSE
-                    
-                    time_wait_thread = threading.Thread(target=self.time_wait)
-                    time_wait_thread.start()
-                    
-                if type == Type.RESET.value:
-                    t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'rev  {t_inv:<10}  RST  {seq:<6}  0')
-                    self.state = State.END
-            else:
-                # data segment
-                type, seq = struct.unpack('HH', incoming_message[0:4])
-                data = incoming_message[4:]
-                # data loss
-                if random.random() <= self.flp:
-                    t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'drp  {t_inv:<10}  {seg_type_to_name[type]} {seq:<6}  {len(data)}')
-                    continue
-                if type == Type.DATA.value:
-                    t_inv = round(get_current_time() - self.t_start, 2)
-                    self.logger.info(f'rev  {t_inv:<10}  DATA {seq:<6}  {len(data)}')
-                    self.seq_data[seq] = data
-                    
-                    if self.want_seq == seq:
-                        want_seq = (seq+len(data)) % (1<<16)
-                        while want_seq in self.seq_data:
-                            want_seq += len(self.seq_data[want_seq])
-                            want_seq = want_seq % (1<<16)
-                        self.want_seq = want_seq
-                    self.reply_ack(self.want_seq)
-                    self.state = State.DATA_TRANS
-
-    def reply_ack(self, seq):
-        # reverse segment loss 
-        if random.random() <= self.rlp:
-            t_inv = round(get_current_time() - self.t_start, 2)
-            self.logger.info(f'drp  {t_inv:<10}  ACK  {seq:<6}  0')
-            return
-        ack_seg = build_segment_header(Type.ACK, seq)
-        self.receiver_socket.sendto(ack_seg, self.client_address)
-        
-        t_inv = round(get_current_time() - self.t_start, 2)
-        self.logger.info(f'snd  {t_inv:<10}  ACK  {self.want_seq:<6}  0')
-        
-    def write_file(self):
-        with open(self.store_file, "w+") as file:
-            seq = self.data_start_seq
-            while seq in self.seq_data:
-                file.write(str(self.seq_data[seq], 'utf-8'))
-                seq += len(self.seq_data[seq])
-                seq %= 1<<16
-                
-        file.close()
-        
-    def time_wait(self):
-        time.sleep(2)   # wait two second
-        self.state = State.END
-
-
-if __name__ == '__main__':
-    # logging is useful for the log part: https://docs.python.org/3/library/logging.html
-    logging.basicConfig(
-        # filename="Receiver_log.txt",
-        stream=sys.stderr,
-        level=logging.DEBUG,
-        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
-        datefmt='%Y-%m-%d:%H:%M:%S')
-
-    if len(sys.argv) != 6:
-        print(
-            "\n===== Error usage, python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp ======\n")
-        exit(0)
-
-    receiver = Receiver(*sys.argv[1:])
-    receiver.run()
+"""
+    Sample code for Receiver
+    Python 3
+    Usage: python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp
+    coding: utf-8
+
+    Notes:
+        Try to run the server first with the command:
+            python3 receiver_template.py 9000 10000 FileReceived.txt 1 1
+        Then run the sender:
+            python3 sender_template.py 11000 9000 FileToReceived.txt 1000 1
+
+    Author: Rui Li (Tutor for COMP3331/9331)
+"""
+# here are the libs you may find it useful:
+import datetime, time  # to calculate the time delta of packet transmission
+import logging, sys  # to write the log
+import socket  # Core lib, to send packet via UDP socket
+from threading import Thread  # (Optional)threading will make the timer easily implemented
+import random  # for flp and rlp function
+import threading
+import argparse
+import queue
+import select
+import os
+import zlib
+
+from util import *
+from batchio import IO_BACKENDS, open_batch_io
+from tracelog import TRACE_LEVELS, Event, Role, Tracer, Verbosity, convert_file
+from metrics import MetricsDumper
+from fec import FecDecoder
+from compress import decompress_payload
+from checkpoint import Checkpoint
+from delta import DeltaWriter, block_signatures
+from session import SessionWriter
+from reliable import ReliableReceiver
+
+class Receiver(ReliableReceiver):
+    def __init__(self, receiver_port: int, sender_port: int, filename: str, flp: float, rlp: float,
+                 max_win: int = 1<<14, io: str = 'auto', max_mss: int = MAX_MSS,
+                 trace: Verbosity = Verbosity.PACKET, text_log: bool = True,
+                 metrics_json: str = None, metrics_interval: float = 1,
+                 ack_every: int = 2, ack_delay: int = 10, fec: bool = True, compress: bool = True,
+                 delta: bool = True, session: bool = True) -> None:
+        '''
+        The server will be able to receive the file from the sender via UDP
+        :param receiver_port: the UDP port number to be used by the receiver to receive PTP segments from the sender.
+        :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver.
+        :param filename: the name of the text file into which the text sent by the sender should be stored
+        :param flp: forward loss probability, which is the probability that any segment in the forward direction (Data, FIN, SYN) is lost.
+        :param rlp: reverse loss probability, which is the probability of a segment in the reverse direction (i.e., ACKs) being lost.
+        :param max_win: the receive buffer in bytes, advertised to the sender as the flow-control window.
+        :param io: the batch I/O backend, one of IO_BACKENDS or 'auto'.
+        :param max_mss: the largest DATA payload accepted, offered to the sender at SYN.
+        :param trace: which segments go to the binary trace Receiver_trace.bin.
+        :param text_log: convert the trace to Receiver_log.txt once the transfer ends.
+        :param metrics_json: dump the metrics to this JSON file every metrics_interval seconds.
+        :param metrics_interval: seconds between metrics dumps.
+        :param ack_every: with delayed ACKs, ack once this many in-order segments are pending, 1 acks every segment.
+        :param ack_delay: with delayed ACKs, longest time in milliseconds an ACK is held back.
+        :param fec: accept parity segments, lost DATA they cover is rebuilt instead of retransmitted.
+        :param compress: accept zlib compressed DATA, it's decompressed before the write path.
+        :param delta: when filename exists, let the sender send only what differs from it.
+        :param session: accept a session of many files over one connection, filename is then the directory they go to.
+
+        '''
+        super().__init__(max_win, max_mss, rlp, ack_every, ack_delay)
+        self.address = "127.0.0.1"  # change it to 0.0.0.0 or public ipv4 address if want to test it between different computers
+        self.receiver_port = int(receiver_port)
+        self.sender_port = int(sender_port)
+        self.server_address = (self.address, self.receiver_port)
+        self.store_file = filename
+        self.client_address = ""
+        self.file = None  # output file, in-order data is written as soon as it arrives
+        self.checkpoint = None  # Checkpoint of the output file when the sender can resume
+        self.resume_offset = 0  # bytes of the output file kept from an earlier transfer
+        self.accept_delta = delta
+        self.delta = None  # DeltaWriter rebuilding the output file from the sender's delta stream
+        self.accept_session = session
+        self.session = None  # SessionWriter splitting a session stream into files
+        self.signatures = b''  # SIGNATURE entries of the output file blocks, sent in the SYN ACK
+        self.write_queue = queue.Queue()  # in-order data waiting for the writer thread
+        self.writer_thread = None
+        # the writer wakes the main loop through this pair when the window reopens, the main thread sends every ACK
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.update_pending = False  # the writer asked for a window update
+        self.accept_fec = fec
+        self.fec = None  # FecDecoder once parity is negotiated at SYN
+        self.accept_compress = compress
+        self.compress = False  # compressed DATA negotiated at SYN
+        self.data_start_seq = -1
+        self.bufsize = self.max_mss + HEADER_SIZE  # receive buffer sized to the largest segment
+        self.flp = float(flp)
+        self.state = State.NONE
+
+        # segment events are traced in binary off the hot path, text is produced at the end
+        self.tracer = Tracer('Receiver_trace.bin', Role.RECEIVER, trace)
+        self.text_log = text_log
+        self.metrics_dumper = MetricsDumper(self.metrics, metrics_json, metrics_interval) if metrics_json else None
+        # init the UDP socket
+        # define socket for the server side and bind address
+        print(f"The sender is using the address {self.server_address} to receive message!")
+        self.receiver_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.receiver_socket.bind(self.server_address)
+        self.receiver_socket.settimeout(2)
+        # every read goes through recv_batch, so GRO may coalesce datagrams
+        self.io = open_batch_io(self.receiver_socket, self.bufsize, io, gro=True)
+        print(f"Receiving with the {self.io.name} I/O backend")
+    
+    def run(self) -> None:
+        '''
+        This function contain the main logic of the receiver
+        '''
+        while self.state != State.END:
+            # wake up for the delayed ACK
+            timeout = 2 if self.ack_deadline is None else max(self.ack_deadline - get_current_time(), 0) / 1000
+            self.receiver_socket.settimeout(timeout)
+            readable, _, _ = select.select([self.receiver_socket, self.wake_r], [], [], timeout)
+            # try to receive any incoming message from the sender
+            incoming_messages = []
+            if self.receiver_socket in readable:
+                try:
+                    incoming_messages = self.io.recv_batch()
+                except:
+                    pass
+            for incoming_message, sender_address, slot in incoming_messages:
+                # the slot stays in use while its payload is held or queued for writing
+                if not self.handle_segment(incoming_message, sender_address, slot):
+                    self.io.ring.release(slot)
+            # one ACK for the whole batch once enough segments are pending, or the timer expired
+            if self.ack_due():
+                self.reply_ack(self.want_seq)
+            if self.wake_r in readable:
+                self.window_update()
+        if self.fec is not None:
+            self.fec.close()
+        self.wake_r.close()
+        self.wake_w.close()
+        self.metrics.set('ring_slots', len(self.io.ring))
+        self.tracer.close()
+        if self.text_log and self.tracer.verbosity > Verbosity.OFF:
+            convert_file(self.tracer.path, 'Receiver_log.txt')
+        if self.metrics_dumper is not None:
+            self.metrics_dumper.stop()
+        print(self.metrics.summary('Receiver'))
+
+    def handle_segment(self, incoming_message: memoryview, sender_address: tuple, slot: int):
+        '''
+        :param slot: the receive ring slot of incoming_message
+        :return: True when the payload was kept, its slot is released once it is written
+        '''
+        version, type, flags, seq, header_size = parse_segment_header(incoming_message)
+        self.metrics.inc('segments_received')
+        if type != Type.DATA.value:
+            # SYN FIN RESET segment
+            # forward segment loss
+            if random.random() <= self.flp:
+                self.tracer.record(Event.DRP, type, seq, 0)
+                self.metrics.inc('segments_dropped')
+                return
+            if type == Type.SYN.value:
+                self.client_address = sender_address
+                self.tracer.record(Event.RCV, type, seq, 0)
+                print (f"client{sender_address} send syn message, seq: {seq}")
+                if self.file is not None and seq_add(seq, 1, SEQ_MOD[min(version, HEADER_VERSION)]) != self.data_start_seq:
+                    # a restarted sender, not a retransmitted SYN: the output is written afresh,
+                    # or resumed from what the checkpoint has on disk
+                    self.restart()
+                self.accept_syn(version, seq, flags)
+                self.data_start_seq = self.want_seq
+                self.delack = bool(flags & Flag.DELACK) and self.ack_every > 1
+                _, _, fec, resume = parse_syn_payload(flags, incoming_message[header_size:])
+                if self.accept_fec and fec is not None and fec[0] > 0 and self.fec is None:
+                    self.fec = FecDecoder(self.io.ring, fec[0], self.seq_mod)
+                self.compress = self.accept_compress and bool(flags & Flag.COMPRESS)
+                if self.file is None:
+                    self.open_file(resume, bool(flags & Flag.DELTA), bool(flags & Flag.SESSION))
+                    self.writer_thread = threading.Thread(target=self.writer)
+                    self.writer_thread.start()
+                # echo SACK permitted, delayed ACKs, parity and compression, answer the MSS option with ours
+                # and a resumable transfer with the bytes already received
+                self.reply_ack(self.want_seq, flags & (Flag.SACK | Flag.MSS) | (Flag.DELACK if self.delack else 0)
+                               | (Flag.FEC if self.fec is not None else 0) | (Flag.COMPRESS if self.compress else 0)
+                               | (Flag.RESUME if self.checkpoint is not None else 0) | (Flag.DELTA if self.delta is not None else 0)
+                               | (Flag.SESSION if self.session is not None else 0))
+                self.state = State.CONNECT
+            
+            if type == Type.FIN.value:
+                self.tracer.record(Event.RCV, type, seq, 0)
+                print (f"client{sender_address} send fin message, seq: {seq}")
+                if self.state != State.CLOSE:
+                    # flush received data to file, once: a retransmitted FIN only means the FIN ACK was lost
+                    self.close_file()
+                    if self.checkpoint is not None:
+                        self.checkpoint.remove()
+                    if self.delta is not None:
+                        self.report_delta()
+                    if self.session is not None:
+                        self.report_session()
+                    self.want_seq = seq_add(seq, 1, self.seq_mod)
+                    self.state = State.CLOSE
+                    time_wait_thread = threading.Thread(target=self.time_wait)
+                    time_wait_thread.start()
+                self.reply_ack(self.want_seq)
+                
+            if type == Type.RESET.value:
+                self.tracer.record(Event.RCV, type, seq, 0)
+                self.close_file()
+                self.state = State.END
+        else:
+            # data segment
+            data = incoming_message[header_size:]
+            # data loss
+            if random.random() <= self.flp:
+                self.tracer.record(Event.DRP, type, seq, len(data))
+                self.metrics.inc('segments_dropped')
+                return
+            if type == Type.DATA.value:
+                if flags & Flag.COMPRESS:
+                    # the decompressed copy is kept, the slot goes back to the ring
+                    if not self.compress:
+                        return
+                    try:
+                        data = decompress_payload(data, self.max_mss)
+                    except zlib.error:
+                        self.metrics.inc('corrupt_segments')
+                        return
+                    self.metrics.inc('decompressed_segments')
+                    self.tracer.record(Event.RCV, type, seq, len(data))
+                    self.receive_data(seq, data, None, flags)
+                    return False
+                self.tracer.record(Event.RCV, type, seq, len(data))
+                if flags & Flag.PROBE:
+                    # path MTU probe, echo its size
+                    self.reply_ack(seq, Flag.PROBE)
+                    return
+                if flags & Flag.FEC:
+                    # parity segment, its payload is never kept
+                    if self.fec is not None:
+                        self.recover(seq, data)
+                    return
+                return self.receive_data(seq, data, slot, flags)
+
+    def receive_data(self, seq: int, data: memoryview, slot: int, flags: int = 0):
+        kept = super().receive_data(seq, data, slot, flags)
+        self.state = State.DATA_TRANS
+        return kept
+
+    def recover(self, block_seq: int, parity: memoryview):
+        '''rebuild the one missing DATA segment a parity segment covers, as if it had arrived'''
+        recovered = self.fec.recover(block_seq, parity, self.seq_data, self.want_seq)
+        if recovered is None:
+            return
+        seq, payload = recovered
+        slot = self.io.ring.acquire()
+        data = self.io.ring.views[slot][:len(payload)]
+        data[:] = payload
+        self.metrics.inc('fec_recovered_segments')
+        # it fills a gap, ack it at once
+        if not self.receive_data(seq, data, slot, Flag.ACKNOW):
+            self.io.ring.release(slot)
+
+    def deliver(self, seq: int, data: memoryview, slot: int):
+        '''write in-order data, parity of later blocks may still need it'''
+        if self.fec is not None:
+            self.fec.keep(seq, data, slot)
+        self.write_data(data, slot)
+
+    def ack_options(self, flags: int):
+        options = b''
+        if flags & Flag.RESUME:
+            options += RESUME_OFFSET.pack(self.resume_offset)
+        if flags & Flag.DELTA:
+            options += DELTA.pack(self.delta.block_size, len(self.signatures) // SIGNATURE.size) + self.signatures
+        return options
+
+    def send_ack(self, ack_seg: bytes):
+        self.receiver_socket.sendto(ack_seg, self.client_address)
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        self.tracer.record(event, type, seq, length)
+
+    def restart(self):
+        '''drop the state of the interrupted connection, the checkpoint is saved as the file closes'''
+        self.close_file()
+        for slot in self.seq_slots.values():
+            if slot is not None:
+                self.io.ring.release(slot)
+        self.seq_data.clear()
+        self.seq_slots.clear()
+        if self.fec is not None:
+            self.fec.close()
+            self.fec = None
+        self.file = None
+        self.checkpoint = None
+        self.resume_offset = 0
+        self.delta = None
+        self.session = None
+        self.signatures = b''
+        self.write_queue = queue.Queue()
+        self.ack_pending = 0
+        self.ack_deadline = None
+        self.last_ooo_seq = -1
+
+    def open_file(self, resume: tuple, delta: bool = False, session: bool = False):
+        '''
+        open the output file, keeping what an earlier transfer of the same file committed
+        :param resume: (file id, file size) the sender offered at SYN, None if it can't resume
+        :param delta: the sender can send a delta against the output file
+        :param session: the sender sends the files of a session, they go under the output directory
+        '''
+        if session:
+            if self.accept_session and not os.path.isfile(self.store_file):
+                Checkpoint(self.store_file).remove()
+                self.session = self.file = SessionWriter(self.store_file)
+                print(f"receiving a session of files into {self.store_file}/")
+            else:
+                # the sender resets the connection, the output file must survive that
+                self.file = open(os.devnull, 'wb')
+                print(f"declining the session, {self.store_file} can't be the directory of its files")
+            return
+        if resume is not None:
+            self.checkpoint = Checkpoint(self.store_file)
+            self.resume_offset = self.checkpoint.resume_offset(*resume)
+        if self.resume_offset:
+            # bytes written after the last checkpoint may not have reached the disk
+            self.file = open(self.store_file, 'r+b')
+            self.file.truncate(self.resume_offset)
+            self.file.seek(self.resume_offset)
+            self.metrics.set('resumed_bytes', self.resume_offset)
+            print(f"resuming {self.store_file} at byte {self.resume_offset}")
+            return
+        # a checkpoint of an earlier transfer no longer describes the output, a crash must not resume from it
+        Checkpoint(self.store_file).remove()
+        if delta and self.accept_delta and os.path.isfile(self.store_file) and os.path.getsize(self.store_file) > 0:
+            # the existing copy is the basis, a delta stream takes the place of the file data
+            self.checkpoint = None
+            block_size, self.signatures = block_signatures(self.store_file)
+            self.delta = self.file = DeltaWriter(self.store_file, block_size)
+            print(f"sending {len(self.signatures) // SIGNATURE.size} block signatures of {self.store_file} for a delta")
+        else:
+            self.file = open(self.store_file, 'wb')
+
+    def report_delta(self):
+        '''report the closed delta once, the connection is done with it'''
+        delta, self.delta = self.delta, None
+        if delta is None:
+            return
+        if delta.ok:
+            self.metrics.set('delta_rebuilt_bytes', os.path.getsize(self.store_file))
+            print(f"rebuilt {self.store_file} from the delta")
+        else:
+            self.metrics.inc('delta_failures')
+            print(f"delta transfer failed, {self.store_file} is unchanged: {delta.error}")
+
+    def report_session(self):
+        '''report the closed session once, the connection is done with it'''
+        session, self.session = self.session, None
+        if session is None:
+            return
+        self.metrics.set('session_files', session.files)
+        if session.ok:
+            print(f"received {session.files} files into {self.store_file}/")
+        else:
+            self.metrics.inc('session_failures')
+            print(f"session failed after {session.files} files: {session.error}")
+
+    def write_data(self, data: memoryview, slot: int):
+        '''queue in-order data for the writer thread, which releases its ring slot'''
+        if not data:
+            if slot is not None:
+                self.io.ring.release(slot)
+            return  # zero window probe
+        self.queued(len(data))
+        self.write_queue.put((data, slot))
+
+    def writer(self):
+        '''(Multithread is used)write in-order data to disk, reopen the window when the buffer drains'''
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            data, slot = item
+            write_time = get_current_time()
+            self.file.write(data)
+            if slot is not None:
+                self.io.ring.release(slot)
+            self.metrics.observe('write_ms', get_current_time() - write_time)
+            self.metrics.inc('bytes_written', len(data))
+            if self.checkpoint is not None:
+                self.checkpoint.committed += len(data)
+                if self.checkpoint.due():
+                    self.checkpoint.save(self.file)
+            self.drained(len(data))
+            # window update once half the buffer is free again, sent by the main thread
+            if not self.update_pending and self.window_reopened():
+                self.update_pending = True
+                try:
+                    self.wake_w.send(b'\0')
+                except BlockingIOError:
+                    pass  # a wakeup is already queued
+        if self.checkpoint is not None:
+            self.checkpoint.save(self.file)
+        self.file.close()
+
+    def window_update(self):
+        '''(main thread) the writer reopened the window, tell the sender'''
+        try:
+            while self.wake_r.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+        self.update_pending = False
+        if self.window_reopened():
+            self.metrics.inc('window_updates')
+            self.reply_ack(self.want_seq, Flag.UPDATE)
+
+    def close_file(self):
+        '''stop the writer thread, which closes the output file, once per connection'''
+        if self.writer_thread is None:
+            return
+        self.write_queue.put(None)
+        self.writer_thread.join()
+        self.writer_thread = None
+        
+    def time_wait(self):
+        time.sleep(2)   # wait two second
+        self.state = State.END
+
+
+if __name__ == '__main__':
+    # logging is useful for the log part: https://docs.python.org/3/library/logging.html
+    logging.basicConfig(
+        # filename="Receiver_log.txt",
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S')
+
+    parser = argparse.ArgumentParser(
+        usage="python3 receiver.py receiver_port sender_port FileReceived.txt flp rlp [options]")
+    parser.add_argument('receiver_port', type=int)
+    parser.add_argument('sender_port', type=int)
+    parser.add_argument('filename')
+    parser.add_argument('flp', type=float, help='forward loss probability')
+    parser.add_argument('rlp', type=float, help='reverse loss probability')
+    parser.add_argument('--max-win', type=int, default=1<<14, help='receive buffer in bytes, advertised to the sender')
+    parser.add_argument('--io', choices=['auto', *IO_BACKENDS], default='auto', help='batch I/O backend')
+    parser.add_argument('--max-mss', type=int, default=MAX_MSS, help='largest DATA payload accepted, capped by --max-win')
+    parser.add_argument('--trace', choices=TRACE_LEVELS, default='packet', help="segments traced, 'control' skips DATA and ACK")
+    parser.add_argument('--binary-trace', dest='text_log', action='store_false',
+                        help='keep only Receiver_trace.bin, convert it later with tracelog.py')
+    parser.add_argument('--metrics-json', help='dump the transfer metrics to this JSON file while receiving')
+    parser.add_argument('--metrics-interval', type=float, default=1, help='seconds between --metrics-json dumps')
+    parser.add_argument('--ack-every', type=int, default=2, help='delayed ACKs: ack every N in-order segments, 1 disables them')
+    parser.add_argument('--ack-delay', type=int, default=10, help='delayed ACKs: longest time an ACK is held back in milliseconds')
+    parser.add_argument('--no-fec', dest='fec', action='store_false', help='decline the parity segments senders offer')
+    parser.add_argument('--no-compress', dest='compress', action='store_false', help='decline compressed DATA')
+    parser.add_argument('--no-delta', dest='delta', action='store_false', help='always take the whole file, even if filename exists')
+    parser.add_argument('--no-session', dest='session', action='store_false', help='decline sessions of many files')
+    parser.add_argument('--seed', type=int, help='seed the loss random generator for reproducible runs')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    receiver = Receiver(args.receiver_port, args.sender_port, args.filename, args.flp, args.rlp,
+                        max_win=args.max_win, io=args.io, max_mss=args.max_mss,
+                        trace=TRACE_LEVELS[args.trace], text_log=args.text_log,
+                        metrics_json=args.metrics_json, metrics_interval=args.metrics_interval,
+                        ack_every=args.ack_every, ack_delay=args.ack_delay, fec=args.fec,
+                        compress=args.compress, delta=args.delta, session=args.session)
+    receiver.run()
@@ -0,0 +1,394 @@
+import random
+import threading
+
+from util import *
+from rtt import RttEstimator
+from congestion import CONGESTION_CONTROLS
+from retransmit import RetransmitQueue
+from tracelog import Event
+from metrics import Metrics
+
+
+class ReliableSender:
+    def __init__(self, max_win: int, rot: int, min_rto: float = 10, max_rto: float = 60000, cc: str = 'reno',
+                 sack: bool = True, mss: int = DEFAULT_MSS) -> None:
+        '''
+        Sending side of the protocol shared by the threaded (sender.py) and asyncio (aio.py) engines:
+        SACK scoreboard, per-segment timers, loss recovery, window accounting and congestion control hooks.
+        It does no I/O and takes no lock, the engine sends, waits and serializes calls
+        through send_control, trace and rto_changed.
+        :param max_win: the maximum window size in bytes
+        :param rot: the initial retransmission timer in milliseconds
+        :param min_rto: lower bound of the adaptive retransmission timer in milliseconds
+        :param max_rto: upper bound of the adaptive retransmission timer in milliseconds
+        :param cc: the congestion control algorithm, one of CONGESTION_CONTROLS
+        :param sack: whether to ask the receiver for selective acknowledgements
+        :param mss: the DATA payload size, lowered to what the receiver takes
+        '''
+        self.max_win = int(max_win)
+        self.rtt = RttEstimator(int(rot), min_rto, max_rto)  # adaptive RTO, starts from rot
+        self.max_data_size = min(int(mss), MAX_MSS)  # negotiated at SYN
+        self.cc_name = cc
+        self.cc = CONGESTION_CONTROLS[cc](self.max_data_size)  # congestion window, rebuilt once the MSS is known
+        self.sack = sack  # SACK permitted, cleared if the receiver doesn't echo it
+        self.source = None  # lazy segment source, created after SYN ACK
+        self.data_seq = -1
+        self.send_time = {}  # in-flight segment id -> first sending time
+        # segments sent before the last retransmission may be acked because of it, no RTT sample (Karn)
+        self.rtt_valid_id = 0
+        self.win_size = 0  # current slide window size, bytes in flight
+        self.rwnd = float('inf')  # receiver advertised window
+        self.send_id = 0  # next new segment id to send
+        self.last_ack = -1  # highest cumulative ack seq
+        self.redundancy_times = 0  # acks of last_ack, the first one included
+        self.in_recovery = False  # fast recovery after three redundancy acks
+        self.recover_id = -1  # loss recovery ends when segments before recover_id are acked
+        self.sacked_ids = set()  # scoreboard of segments above the cumulative ack the receiver holds
+        self.high_sacked_id = -1
+        self.rexmit_ids = set()  # segments already retransmitted in the current loss recovery
+        self.retransmiss_id_list = []  # retransmiss segment id list
+        self.timers = RetransmitQueue()  # per-segment retransmission timers
+        self.metrics = Metrics()
+
+    # engine hooks
+    def send_control(self, seg: bytes):
+        '''send one segment built here to the receiver'''
+        raise NotImplementedError
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        '''record a segment event'''
+
+    def rto_changed(self):
+        '''the RTO moved, an engine polling with it picks up the new value'''
+
+    # RTO
+    def sample_rtt(self, rtt: float):
+        self.rtt.sample(rtt)
+        self.metrics.observe('rtt_ms', rtt)
+        self.metrics.set('rto_ms', self.rtt.rto)
+        self.rto_changed()
+
+    def timeout_rto(self):
+        # exponential backoff
+        self.rtt.backoff()
+        self.metrics.set('rto_ms', self.rtt.rto)
+        self.rto_changed()
+
+    # window
+    def send_window(self):
+        '''effective window: min(congestion window, receiver window, max_win)'''
+        return min(self.cc.cwnd, self.rwnd, self.max_win)
+
+    def window_open(self):
+        '''the window takes the next new segment, it counts seq space, file bytes, whatever goes on the wire'''
+        return (self.send_id < self.source.seg_count
+                and self.win_size + self.source.length(self.send_id) <= self.send_window())
+
+    def window_blocked(self):
+        '''nothing in flight and the receiver window can't take the next segment'''
+        return self.win_size == 0 and self.send_id < self.source.seg_count and self.rwnd < self.max_data_size
+
+    def update_rwnd(self, rwnd: int):
+        if rwnd is not None and rwnd != self.rwnd:
+            self.rwnd = rwnd
+            self.metrics.set('rwnd', rwnd)
+
+    # sending
+    def start_data(self, source):
+        '''source is the DATA to send, its first seq is the acked point'''
+        self.source = source
+        self.cc = CONGESTION_CONTROLS[self.cc_name](self.max_data_size)
+        self.last_ack = source.start_seq
+        # data_seq is the seq after the last DATA byte
+        self.data_seq = source.end_seq
+
+    def take_retransmissions(self):
+        '''the queued retransmissions still unacked, their timers restarted'''
+        retrans_ids = [id for id in self.retransmiss_id_list if id >= self.source.acked_id and id not in self.sacked_ids]
+        self.retransmiss_id_list = []
+        if retrans_ids:
+            self.rtt_valid_id = self.send_id
+            deadline = get_current_time() + self.rtt.rto
+            for retrans_id in retrans_ids:
+                self.timers.arm(retrans_id, deadline)
+        return retrans_ids
+
+    def sent_new(self):
+        '''the next new segment went out, count it in flight and start its timer'''
+        now = get_current_time()
+        self.send_time[self.send_id] = now
+        self.timers.arm(self.send_id, now + self.rtt.rto)
+        self.win_size += self.source.length(self.send_id)
+        self.send_id += 1
+
+    def probe_window(self):
+        '''zero window probe: an empty DATA segment at the next seq, the receiver replies with its window'''
+        if not self.window_blocked():
+            return
+        probe_seq = self.source.id_to_seq(self.send_id)
+        self.send_control(build_segment_header(Type.DATA, probe_seq))
+        self.metrics.inc('zero_window_probes')
+        self.trace(Event.SND, Type.DATA.value, probe_seq, 0)
+
+    # acknowledgements
+    def on_ack(self, seq: int, flags: int, rwnd: int, blocks: list):
+        '''
+        an ACK of the data transfer: scoreboard, cumulative ack, duplicate acks and loss recovery,
+        then the segment timers; retransmissions are queued in retransmiss_id_list
+        :return: True once every DATA byte is acked
+        '''
+        if self.sack and blocks:
+            self.update_scoreboard(blocks)
+        self.update_rwnd(rwnd)
+        if seq == self.data_seq:
+            self.metrics.inc('bytes_acked', seq_diff(seq, self.last_ack))
+            return True
+        if seq_lt(self.last_ack, seq):
+            self.on_new_ack(seq)
+        elif seq == self.last_ack and not flags & Flag.UPDATE and self.win_size > 0:
+            # window updates and zero window probe replies aren't redundancy acks
+            self.redundancy_times += 1
+            self.metrics.inc('duplicate_acks')
+            if self.in_recovery:
+                self.cc.on_dup_ack()
+                # new SACK blocks may reveal more holes
+                self.retransmit_holes(self.source.seq_to_id(seq))
+        # three redundancy acks, fast retransmit
+        if self.redundancy_times == 3 and not self.in_recovery:
+            self.in_recovery = True
+            self.metrics.inc('fast_retransmits')
+            self.recover_id = self.send_id
+            self.cc.on_enter_recovery(self.win_size, get_current_time())
+            self.rexmit_ids = set()
+            self.retransmit_holes(self.source.seq_to_id(seq))
+            self.redundancy_times = 0
+        # timers keep firing while duplicate acks arrive
+        self.fire_timers()
+        return False
+
+    def on_new_ack(self, seq: int):
+        '''foward slide window'''
+        ack_size = seq_diff(seq, self.last_ack)
+        self.last_ack = seq
+        self.redundancy_times = 1
+        self.win_size -= ack_size
+        self.metrics.inc('bytes_acked', ack_size)
+        ack_id = self.source.seq_to_id(seq)
+        # RTT sample from the newest acked segment, unless it was retransmitted
+        sample_id = ack_id - 1
+        if sample_id in self.send_time and sample_id >= self.rtt_valid_id:
+            self.sample_rtt(get_current_time() - self.send_time[sample_id])
+        else:
+            self.rtt.reset_backoff()
+            self.rto_changed()
+        for id in range(self.source.acked_id, ack_id):
+            self.send_time.pop(id, None)
+            self.sacked_ids.discard(id)
+            self.rexmit_ids.discard(id)
+        self.timers.ack(ack_id)
+        if not self.in_recovery:
+            self.cc.on_ack(ack_size, get_current_time())
+            if ack_id < self.recover_id:
+                # after a timeout, resend the next holes on every ack
+                self.retransmit_holes(ack_id)
+        elif ack_id >= self.recover_id:
+            self.in_recovery = False
+            self.cc.on_exit_recovery()
+        else:
+            # partial ack, the next segment is lost too (NewReno)
+            self.cc.on_partial_ack(ack_size)
+            self.retransmit_holes(ack_id)
+        # drop cumulatively acked segments
+        self.source.release(seq)
+        self.metrics.set('cwnd', self.cc.cwnd)
+        self.metrics.set('in_flight', self.win_size)
+
+    def update_scoreboard(self, blocks: list):
+        '''mark the segments in SACK blocks as held by the receiver'''
+        ack_id = self.source.acked_id
+        for left, right in blocks:
+            left_id = max(self.source.seq_to_id(left), ack_id)
+            right_id = min(self.source.seq_to_id(right), self.send_id)
+            for id in range(left_id, right_id):
+                if id not in self.sacked_ids:
+                    self.sacked_ids.add(id)
+                    self.timers.cancel(id)
+            self.high_sacked_id = max(self.high_sacked_id, right_id - 1)
+
+    def retransmit_holes(self, ack_id: int):
+        '''queue the segments missing below the highest SACKed one, each once per loss recovery'''
+        last_id = max(self.high_sacked_id, ack_id)
+        for id in range(ack_id, last_id + 1):
+            if id not in self.sacked_ids and id not in self.rexmit_ids:
+                self.rexmit_ids.add(id)
+                self.retransmiss_id_list.append(id)
+
+    def fire_timers(self):
+        '''queue every unacked segment whose timer expired, one congestion event per batch, return their ids'''
+        expired_ids = [id for id in self.timers.expired(get_current_time()) if id not in self.sacked_ids]
+        if not expired_ids:
+            return expired_ids
+        self.timeout_rto()
+        self.metrics.inc('timeouts')
+        self.in_recovery = False
+        self.recover_id = self.send_id
+        self.cc.on_timeout(self.win_size, get_current_time())
+        self.metrics.set('cwnd', self.cc.cwnd)
+        self.rexmit_ids = set(expired_ids)
+        self.retransmiss_id_list.extend(expired_ids)
+        return expired_ids
+
+
+class ReliableReceiver:
+    def __init__(self, max_win: int = 1<<14, max_mss: int = MAX_MSS, rlp: float = 0,
+                 ack_every: int = 1, ack_delay: int = 0) -> None:
+        '''
+        Receiving side of the protocol shared by the threaded (receiver.py) and asyncio (aio.py) engines:
+        reassembly of in-order and out-of-order DATA, delayed ACKs, the advertised window and ACK building.
+        The engine owns the socket and the writer through deliver, send_ack, ack_options and trace.
+        :param max_win: the receive buffer in bytes, advertised to the sender as the flow-control window
+        :param max_mss: the largest DATA payload accepted, offered to the sender at SYN
+        :param rlp: reverse loss probability, emulated drop of ACKs
+        :param ack_every: with delayed ACKs, ack once this many in-order segments are pending, 1 acks every segment
+        :param ack_delay: with delayed ACKs, longest time in milliseconds an ACK is held back
+        '''
+        self.max_win = int(max_win)  # receive buffer, 16k by default
+        self.last_wnd = self.max_win  # last advertised window
+        # a segment bigger than the receive buffer could never be accepted
+        self.max_mss = min(int(max_mss), self.max_win, MAX_MSS)
+        self.rlp = float(rlp)
+        self.pending_write = 0  # bytes queued but not written yet
+        self.write_lock = threading.Lock()
+        self.seq_data = {}  # out-of-order data only
+        self.seq_slots = {}  # seq -> receive ring slot of the out-of-order data, None when it has none
+        self.sack = False  # SACK negotiated at SYN
+        self.delack = False  # delayed ACKs negotiated at SYN
+        self.ack_every = max(int(ack_every), 1)
+        self.ack_delay = int(ack_delay)
+        self.ack_pending = 0  # in-order segments received since the last ACK
+        self.ack_deadline = None  # when the pending ACK is due
+        self.last_ooo_seq = -1  # latest out-of-order segment, its SACK block goes first
+        self.want_seq = 0
+        self.version = HEADER_VERSION  # header version negotiated at SYN
+        self.seq_mod = SEQ_MOD[self.version]
+        self.metrics = Metrics()
+
+    # engine hooks
+    def deliver(self, seq: int, data, slot: int):
+        '''hand in-order data to the writer, which releases its ring slot'''
+        raise NotImplementedError
+
+    def send_ack(self, ack_seg: bytes):
+        raise NotImplementedError
+
+    def ack_options(self, flags: int):
+        '''option payloads of an ACK that go between ACK_DELAY and the SACK blocks'''
+        return b''
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        '''record a segment event'''
+
+    def accept_syn(self, version: int, seq: int, flags: int):
+        '''take the header version, first DATA seq and SACK permission of a SYN'''
+        # reply in the sender's header version, v1 senders keep the 16-bit seq space
+        self.version = min(version, HEADER_VERSION)
+        self.seq_mod = SEQ_MOD[self.version]
+        self.want_seq = seq_add(seq, 1, self.seq_mod)
+        self.sack = bool(flags & Flag.SACK)
+
+    def receive_data(self, seq: int, data, slot: int = None, flags: int = 0):
+        '''
+        write in-order DATA, hold out-of-order DATA and ack it
+        :param slot: the receive ring slot of data, None when it has none
+        :return: True when the payload was kept
+        '''
+        kept = False
+        # only in-order data that neither fills nor opens a gap may wait for its ACK
+        delay = self.delack and seq == self.want_seq and not self.seq_data and data and not flags & Flag.ACKNOW
+        if seq_diff(seq, self.want_seq, self.seq_mod) + len(data) > self.rcv_window():
+            # beyond the advertised window, the ack tells the sender the current one
+            self.metrics.inc('beyond_window_segments')
+        elif self.want_seq == seq:
+            # write in-order data and the out-of-order data it makes contiguous
+            self.deliver(seq, data, slot)
+            want_seq = seq_add(seq, len(data), self.seq_mod)
+            while want_seq in self.seq_data:
+                data = self.seq_data.pop(want_seq)
+                self.deliver(want_seq, data, self.seq_slots.pop(want_seq))
+                want_seq = seq_add(want_seq, len(data), self.seq_mod)
+            self.want_seq = want_seq
+            self.metrics.set('held_segments', len(self.seq_data))
+            kept = True
+        elif seq_lt(self.want_seq, seq, self.seq_mod) and seq not in self.seq_data:
+            # hold out-of-order data in its slot
+            self.metrics.inc('out_of_order_segments')
+            self.seq_data[seq] = data
+            self.seq_slots[seq] = slot
+            self.last_ooo_seq = seq
+            self.metrics.set('held_segments', len(self.seq_data))
+            kept = True
+        else:
+            # duplicates of held or written data are ignored
+            self.metrics.inc('duplicate_segments')
+        if delay and kept:
+            self.ack_pending += 1
+            if self.ack_deadline is None:
+                self.ack_deadline = get_current_time() + self.ack_delay
+        else:
+            self.reply_ack(self.want_seq)
+        return kept
+
+    def ack_due(self):
+        '''enough segments are pending, or the delayed ACK timer expired'''
+        return self.ack_pending >= self.ack_every or (
+            self.ack_deadline is not None and get_current_time() >= self.ack_deadline)
+
+    def reply_ack(self, seq: int, flags: int = 0):
+        # the ACK covers every pending segment
+        self.ack_pending = 0
+        self.ack_deadline = None
+        payload = b''
+        if self.version >= 2:
+            flags |= Flag.WND
+            self.last_wnd = self.rcv_window()
+            payload = WINDOW.pack(self.last_wnd)
+        if flags & Flag.MSS:
+            payload += MSS.pack(self.max_mss)
+        if flags & Flag.DELACK:
+            payload += ACK_DELAY.pack(self.ack_delay)
+        payload += self.ack_options(flags)
+        if self.sack and self.seq_data:
+            flags |= Flag.SACK
+            payload += build_sack_blocks(self.sack_blocks())
+        # reverse segment loss
+        if random.random() <= self.rlp:
+            self.trace(Event.DRP, Type.ACK.value, seq, len(payload))
+            self.metrics.inc('acks_dropped')
+            return
+        self.send_ack(build_segment_header(Type.ACK, seq, self.version, flags) + payload)
+        self.trace(Event.SND, Type.ACK.value, seq, len(payload))
+        self.metrics.inc('acks_sent')
+        self.metrics.set('rcv_window', self.last_wnd)
+
+    def sack_blocks(self):
+        '''merge held out-of-order data into SACK blocks, the block of the latest segment first'''
+        return merge_sack_blocks(self.seq_data, self.want_seq, self.last_ooo_seq, self.seq_mod)
+
+    def rcv_window(self):
+        '''free receive buffer: held out-of-order data sits inside the window, queued writes don't'''
+        with self.write_lock:
+            return max(self.max_win - self.pending_write, 0)
+
+    def queued(self, size: int):
+        '''size bytes of in-order data went to the writer, the window shrinks until they are written'''
+        with self.write_lock:
+            self.pending_write += size
+
+    def drained(self, size: int):
+        '''the writer stored size queued bytes'''
+        with self.write_lock:
+            self.pending_write -= size
+
+    def window_reopened(self):
+        '''half the buffer is free again since the last advertised window, worth a window update'''
+        return self.last_wnd < self.max_win // 2 <= self.rcv_window()
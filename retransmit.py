@@ -0,0 +1,56 @@
+import heapq
+
+
+class RetransmitQueue:
+    def __init__(self) -> None:
+        '''
+        Per-segment retransmission timers in a heap keyed by deadline (milliseconds).
+        Arming and expiring cost O(log n). Cancelled, re-armed and acked timers are dropped lazily
+        when they reach the top of the heap.
+        '''
+        self.heap = []  # (deadline, seg_id)
+        self.deadline = {}  # seg_id -> current deadline, missing once cancelled
+        self.acked_id = 0  # timers of segments before acked_id are cancelled
+
+    def __len__(self):
+        return len(self.deadline)
+
+    def arm(self, seg_id: int, deadline: float):
+        '''(re)start the timer of seg_id'''
+        if seg_id < self.acked_id:
+            return  # acked while being sent
+        self.deadline[seg_id] = deadline
+        heapq.heappush(self.heap, (deadline, seg_id))
+
+    def cancel(self, seg_id: int):
+        self.deadline.pop(seg_id, None)
+
+    def ack(self, ack_id: int):
+        '''cancel the timers of every segment cumulatively acked by ack_id'''
+        for seg_id in range(self.acked_id, ack_id):
+            self.deadline.pop(seg_id, None)
+        self.acked_id = max(self.acked_id, ack_id)
+
+    def prune(self):
+        # drop stale entries from the top of the heap
+        while self.heap:
+            deadline, seg_id = self.heap[0]
+            if self.deadline.get(seg_id) == deadline:
+                return
+            heapq.heappop(self.heap)
+
+    def next_deadline(self):
+        '''deadline of the earliest armed timer, None when nothing is armed'''
+        self.prune()
+        return self.heap[0][0] if self.heap else None
+
+    def expired(self, now: float):
+        '''pop the ids of the segments whose timer fired at now'''
+        seg_ids = []
+        self.prune()
+        while self.heap and self.heap[0][0] <= now:
+            _, seg_id = heapq.heappop(self.heap)
+            del self.deadline[seg_id]
+            seg_ids.append(seg_id)
+            self.prune()
+        return seg_ids
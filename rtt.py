@@ -0,0 +1,38 @@
+class RttEstimator:
+    def __init__(self, init_rto: float, min_rto: float, max_rto: float) -> None:
+        '''
+        Retransmission timeout from measured RTT (Jacobson/Karels, RFC 6298), all values in milliseconds.
+        Callers apply Karn's rule: segments that were retransmitted give no sample.
+        :param init_rto: the RTO used until the first sample arrives
+        :param min_rto: lower bound of the RTO
+        :param max_rto: upper bound of the RTO, also caps the exponential backoff
+        '''
+        self.min_rto = float(min_rto)
+        self.max_rto = float(max_rto)
+        self.srtt = None
+        self.rttvar = None
+        self.granularity = 1  # clock granularity G
+        self.ack_delay = 0  # the receiver's max ACK delay, a delayed ACK must not look like a loss (RFC 9002 PTO)
+        self.rto = self.clamp(float(init_rto))
+
+    def clamp(self, rto: float):
+        return min(max(rto, self.min_rto), self.max_rto)
+
+    def sample(self, rtt: float):
+        '''update SRTT/RTTVAR with a new RTT sample and recompute the RTO'''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.reset_backoff()
+
+    def reset_backoff(self):
+        '''drop the backoff once new data is acked, even without a valid sample'''
+        if self.srtt is not None:
+            self.rto = self.clamp(self.srtt + max(self.granularity, 4 * self.rttvar) + self.ack_delay)
+
+    def backoff(self):
+        '''double the RTO after a timeout, kept until the next valid sample'''
+        self.rto = self.clamp(self.rto * 2)
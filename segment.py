@@ -0,0 +1,93 @@
+import mmap
+import os
+
+from util import *
+
+HEADER_CHUNK = 4096  # segment headers per preallocated header buffer
+
+
+class SegmentSource:
+    def __init__(self, file_path: str, start_seq: int, max_data_size: int, offset: int = 0, length: int = None) -> None:
+        '''
+        Lazy DATA segment source backed by an mmap of the file to send.
+        A segment is a (header, payload) pair, the payload a memoryview into the mmap,
+        so neither sending nor resending copies file data in Python.
+        :param file_path: the file to send
+        :param start_seq: sequence number of the first DATA byte
+        :param max_data_size: payload size of every segment except the last one
+        :param offset: file offset of the first byte to send
+        :param length: bytes to send from offset, the rest of the file by default
+        '''
+        self.file_path = file_path
+        self.start_seq = start_seq
+        self.max_data_size = max_data_size
+        self.file = open(file_path, 'rb')
+        total_size = os.fstat(self.file.fileno()).st_size
+        self.offset = min(offset, total_size)
+        # file_size is the size of the byte range sent
+        self.file_size = total_size - self.offset if length is None else min(length, total_size - self.offset)
+        self.mm = None
+        self.view = memoryview(b'')
+        if total_size > 0:  # mmap can't map an empty file
+            # a private mapping nothing writes shares the page cache, and unlike a read-only one
+            # it exports a writable buffer, so sendmmsg can take payload addresses through ctypes
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+            self.view = memoryview(self.mm)
+        self.seg_count = (self.file_size + max_data_size - 1) // max_data_size
+        self.end_seq = seq_add(start_seq, self.file_size)
+        self.acked_id = 0  # segments before acked_id are cumulatively ACKed
+        self.header_chunks = {}  # chunk index -> memoryview of the headers of HEADER_CHUNK segments
+
+    def id_to_seq(self, seg_id: int):
+        return seq_add(self.start_seq, seg_id * self.max_data_size)
+
+    def seq_to_id(self, seq: int):
+        # seq is near the acked point, so the offset stays right for files bigger than the seq space
+        acked_offset = self.acked_id * self.max_data_size
+        offset = acked_offset + seq_diff(seq, self.id_to_seq(self.acked_id))
+        return (offset + self.max_data_size - 1) // self.max_data_size
+
+    def payload(self, seg_id: int):
+        '''the file data of segment seg_id, a view into the mmap'''
+        file_offset = self.offset + seg_id * self.max_data_size
+        end = min(file_offset + self.max_data_size, self.offset + self.file_size)
+        return self.view[file_offset:end]
+
+    def length(self, seg_id: int):
+        '''seq space taken by segment seg_id, its file data length'''
+        return min(self.max_data_size, self.file_size - seg_id * self.max_data_size)
+
+    def header(self, seg_id: int, flags: int = 0):
+        '''
+        the DATA header of segment seg_id, packed in place into its own slot of a preallocated buffer,
+        so a segment costs no header object; a view, rewritten if the segment is built again
+        '''
+        chunk_id, index = divmod(seg_id, HEADER_CHUNK)
+        chunk = self.header_chunks.get(chunk_id)
+        if chunk is None:
+            # acked chunks live on only as long as views of headers still being sent
+            for old_id in [id for id in self.header_chunks if (id + 1) * HEADER_CHUNK <= self.acked_id]:
+                del self.header_chunks[old_id]
+            chunk = self.header_chunks[chunk_id] = memoryview(bytearray(HEADER_CHUNK * HEADER_SIZE))
+        offset = index * HEADER_SIZE
+        HEADER_V2.pack_into(chunk, offset, VERSION_MARK | HEADER_VERSION, Type.DATA.value, flags,
+                            seq_add(self.start_seq, seg_id * self.max_data_size))
+        return chunk[offset:offset + HEADER_SIZE]
+
+    def segment(self, seg_id: int, flags: int = 0):
+        '''the (header, payload) buffers of the DATA segment with id seg_id'''
+        return self.header(seg_id, flags), self.payload(seg_id)
+
+    def release(self, ack_seq: int):
+        '''move the cumulative ack point to ack_seq'''
+        ack_id = min(self.seq_to_id(ack_seq), self.seg_count)
+        self.acked_id = max(self.acked_id, ack_id)
+
+    def close(self):
+        self.view.release()
+        if self.mm is not None:
+            try:
+                self.mm.close()
+            except BufferError:
+                pass  # a payload view is still referenced, the mapping goes with it
+        self.file.close()
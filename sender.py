@@ -1,329 +1,571 @@
-"""
-    Sample code for Sender (multi-threading)
-    Python 3
-    Usage: python3 sender.py receiver_port sender_port FileToSend.txt max_recv_win rto
-    coding: utf-8
-
-    Notes:
-        Try to run the server first with the command:
-            python3 receiver_template.py 9000 10000 FileReceived.txt 1 1
-        Then run the sender:
-            python3 sender_template.py 11000 9000 FileToReceived.txt 1000 1
-
-    Author: Rui Li (Tutor for COMP3331/9331)
-"""
-# here are the libs you may find it useful:
-import datetime, time  # to calculate the time delta of packet transmission
-import logging, sys  # to write the log
-import socket  # Core lib, to send packet via UDP socket
-import threading
-import os
-
-from util import *
-
-BUFFERSIZE = 1024
-
-
-class Sender:
-    def __init__(self, sender_port: int, receiver_port: int, filename: str, max_win: int, rot: int) -> None:
-        '''
-        The Sender will be able to connect the Receiver via UDP
-        :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver
-        :param receiver_port: the UDP port number on which receiver is expecting to receive PTP segments from the sender
-        :param filename: the name of the text file that must be transferred from sender to receiver using your reliable transport protocol.
-        :param max_win: the maximum window size in bytes for the sender window.
-        :param rot: the value of the retransmission timer in milliseconds. This should be an unsigned integer.
-        '''
-        self.sender_port = int(sender_port)
-        self.receiver_port = int(receiver_port)
-        self.sender_address = ("127.0.0.1", self.sender_port)
-        self.receiver_address = ("127.0.0.1", self.receiver_port)
-        self.state = State.NONE
-        self.rot = int(rot)
-        self.bufsize = 1024
-        self.max_data_size = 1000
-        self.file_path = filename
-        self.file_size = -1
-        self.max_win = int(max_win)
-        self.send_seg_list = []  # send seg list
-        self.send_time_list = []  # every segment's sending time list
-        self.win_size = -1  # current slide window size
-        self.init_seq = -1
-        self.data_seq = -1
-        self.fin_seq = -1
-        self.waiting_time = 0.01
-        self.retransmiss_id_list = []  # retransmiss segment id list
-        self.data_seq_to_id = {}
-        self.data_id_to_seq = {}
-        self.cond = threading.Condition()  # lock and condition variable
-        
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.INFO)
-        ch = logging.StreamHandler()
-        ch = logging.FileHandler('Sender_log.txt', 'w+')
-        ch.setLevel(logging.INFO)
-        # add ch to logger
-        self.logger.addHandler(ch)
-
-        # init the UDP socket
-        print (f"The sender is using the address {self.sender_address}")
-        self.sender_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.sender_socket.bind(self.sender_address)
-        self.sender_socket.settimeout(self.rot/1000)
-        
-        self._is_active = True  # for the multi-threading
-        listen_thread = threading.Thread(target=self.listen)
-        listen_thread.start()
-
-    def connect(self):
-        '''connect with receiver with SYN segment
-        '''
-        self.state = State.CONNECT
-        self.init_seq = generate_random_int(0, (1<<16)-1)
-        # self.init_seq = 63443
-        syn_seg = build_segment_header(Type.SYN, self.init_seq)
-        # If SYN transfer times > 3, then send RESET
-        trans_syn_times = 1
-        with self.cond:
-            self.t_start = get_current_time()
-            while self.state == State.CONNECT:
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.sender_socket.sendto(syn_seg, self.receiver_address)
-                if trans_syn_times == 1:
-                    self.logger.info(f'snd  {0:<10}  SYN  {self.init_seq:<6}  0')
-                else:
-                    self.logger.info(f'snd  {t_inv:<10}  SYN  {self.init_seq:<6}  0')
-                # wait for ack result
-                self.cond.wait()  
-                # connect success
-                if self.state == State.READ_FILE:  
-                    break
-                # send RESET
-                if trans_syn_times == 3:
-                    rst_seg = build_segment_header(Type.RESET, 0)
-                    t_inv = round(get_current_time() - self.t_start, 2)
-                    self.sender_socket.sendto(rst_seg, self.receiver_address)
-                    self.logger.info(f'snd  {t_inv:<10}  RST  {0:<6}  0')
-                    self.state = State.END
-                    self._is_active = False
-                    return
-                    
-                trans_syn_times += 1
-                
-    def listen(self):
-        '''(Multithread is used)listen the response from receiver'''
-        logging.debug("Sub-thread for listening is running")
-        while self._is_active:
-            if self.state == State.CONNECT:
-                self.reply_connect()
-            elif self.state == State.READ_FILE:
-                # wait for DATA_TRANS state
-                with self.cond:
-                    self.cond.wait()
-            elif self.state == State.DATA_TRANS:
-                self.reply_data_trans()
-            elif self.state == State.CLOSE:
-                self.reply_close()
-    
-    def reply_connect(self):
-        while self.state == State.CONNECT:
-            try:
-                ack_seg, _ = self.sender_socket.recvfrom(self.bufsize)
-            except:
-                # notify main-thread to resend syn
-                with self.cond:
-                    self.cond.notify_all()
-            else:
-                type, seq = struct.unpack('HH', ack_seg)
-                assert type == Type.ACK.value
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.logger.info(f'rcv  {t_inv:<10}  ACK  {seq:<6}  {len(ack_seg)-4}')
-                self.data_seq = seq
-                # notify main-thread to read file and send data
-                with self.cond:
-                    self.state = State.READ_FILE
-                    self.cond.notify_all()
-        
-    def reply_close(self):
-        while self.state == State.CLOSE:
-            try:
-                ack_seg, _ = self.sender_socket.recvfrom(self.bufsize)
-            except:
-                # notify main-thread to resend fin
-                with self.cond:
-                    self.cond.notify_all()
-            else:
-                type, seq = struct.unpack('HH', ack_seg)
-                assert type == Type.ACK.value
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.logger.info(f'rcv  {t_inv:<10}  ACK  {seq:<6}  {len(ack_seg)-4}')
-                with self.cond:
-                    self.state = State.END
-                    # finish sub-thread
-                    self._is_active = False
-                    # notify main-thread
-                    self.cond.notifyAll()  
-    
-    def reply_data_trans(self):
-        may_retrans_seq = (self.init_seq + 1) % (1<<16)
-        redundancy_times = 0
-        
-        while self.state == State.DATA_TRANS:
-            try:
-                ack_seg, addr = self.sender_socket.recvfrom(self.bufsize)
-            except:
-                # out of time, retrans the oldest unackowledgment segment
-                seq_id = self.data_seq_to_id[may_retrans_seq]
-                with self.cond:
-                    self.retransmiss_id_list.append(seq_id)
-                    self.cond.notify_all()
-            else:
-                # receive ack seg in time
-                type, seq = struct.unpack('HH', ack_seg)
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.logger.info(f'rcv  {t_inv:<10}  ACK  {seq:<6}  {len(ack_seg)-4}')
-                # end data_trans
-                if seq == self.data_seq:  
-                    with self.cond:
-                        self.state = State.CLOSE
-                        self.cond.notifyAll()
-                    break
-                    
-                # compute redundancy ack times
-                if seq != may_retrans_seq:
-                    ack_size = seq - may_retrans_seq
-                    if ack_size < 0:
-                        ack_size += 1<<16
-                    may_retrans_seq = seq
-                    redundancy_times = 1
-                    # foward slide window
-                    with self.cond:
-                        self.win_size -= ack_size
-                        for id in self.retransmiss_id_list:
-                            if self.data_id_to_seq[id] < seq:
-                                # move unneeded retransmiss segment
-                                self.retransmiss_id_list.remove(id)
-                            if seq < self.init_seq and self.data_id_to_seq[id] > self.init_seq:
-                                self.retransmiss_id_list.remove(id)
-                        self.cond.notifyAll()
-                elif seq == may_retrans_seq:
-                    redundancy_times += 1
-                # three redundany ack
-                if redundancy_times == 3:  
-                    with self.cond:
-                        self.retransmiss_id_list.append(self.data_seq_to_id[seq])
-                        self.cond.notifyAll()
-                    redundancy_times = 0
-        
-    def send_data(self):
-        # Wait sub-thread receives SYN ACK
-        with self.cond:
-            while self.state != State.READ_FILE:
-                self.cond.wait()
-        self.readfile()
-        with self.cond:
-            self.state = State.DATA_TRANS
-            self.cond.notify_all()
-        
-        send_id = 0
-        while self.state == State.DATA_TRANS:
-            # no need consider slide window for retransmiss segment part
-            for retrans_id in self.retransmiss_id_list:  # retrasmiss segment
-                seg = self.send_seg_list[retrans_id]
-                self.sender_socket.sendto(seg, self.receiver_address)
-                
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.logger.info(f'snd  {t_inv:<10}  DATA {self.data_id_to_seq[retrans_id]:<6}  {len(seg)-4}')
-                self.retransmiss_id_list.remove(retrans_id)
-                
-            if send_id < len(self.send_seg_list):  # send segment
-                seg = self.send_seg_list[send_id]
-                with self.cond:
-                    if self.win_size + len(seg) - 4 > self.max_win:  # wait for slide window space
-                        self.cond.wait()  
-                if len(self.retransmiss_id_list) > 0:
-                    continue  # go to retransmiss
-                self.sender_socket.sendto(seg, self.receiver_address)
-                self.send_time_list.append(get_current_time())
-                t_inv = round(get_current_time() - self.t_start, 2)
-                self.logger.info(f'snd  {t_inv:<10}  DATA {self.data_id_to_seq[send_id]:<6}  {len(seg)-4:<6}')
-                send_id += 1
-                self.win_size += len(seg) - 4
-
-        print ("Finish sending the file.")
-        
-    def readfile(self):
-        '''read file to send_seg_list, main thread executes
-        '''
-        print (f"Now begin to read the file: {self.file_path}.")
-        file_offset = 0
-        with open(self.file_path, 'rb') as file:
-            info = os.lstat(self.file_path)
-            self.file_size = info.st_size
-            stream = file.read()
-            while True:
-                if (file_offset + self.max_data_size <= self.file_size):
-                    # cur_win_size = min(self.max_win - self.win_size, self.max_data_size)
-                    seg_size = self.max_data_size
-                else:
-                    # cur_win_size = min(self.max_win - self.win_size, fileSize - self.file_offset)
-                    seg_size = self.file_size - file_offset
-                if seg_size == 0:
-                    break
-                
-                data = bytes(stream[file_offset:file_offset+seg_size])
-                file_offset += seg_size
-                    
-                data_seg = build_segment_header(Type.DATA, self.data_seq) + data   
-                # set send_seg_list, data_id_to_seq, data_seq_to_id                      
-                self.send_seg_list.append(data_seg)
-                self.data_seq_to_id[self.data_seq] = len(self.send_seg_list) - 1
-                self.data_id_to_seq[len(self.send_seg_list) - 1] = self.data_seq
-                self.data_seq += len(data)
-                self.data_seq %= 1<<16
-            
-            print ("READFILE completed.")
-        file.close()
-        
-    def close(self):
-        with self.cond:
-            while self.state != State.CLOSE:
-                self.cond.wait()
-        self.fin_seq = self.data_seq
-        fin_seg = build_segment_header(Type.FIN, self.fin_seq)
-        while self.state == State.CLOSE:
-            self.sender_socket.sendto(fin_seg, self.receiver_address)
-            t_inv = round(get_current_time() - self.t_start, 2)
-            self.logger.info(f'snd  {t_inv:<10}  FIN  {self.fin_seq:<6}  0')
-            
-            with self.cond:
-                self.cond.wait()
-
-    def run(self):
-        '''
-        This function contain the main logic of the receiver
-        '''
-        
-        # connected
-        self.connect()
-        if self.state == State.END:  # not make a connect
-            return
-        self.send_data()
-        self.close()
-
-if __name__ == '__main__':
-    # logging is useful for the log part: https://docs.python.org/3/library/logging.html
-    logging.basicConfig(
-        # filename="Sender_log.txt",
-        stream=sys.stderr,
-        level=logging.DEBUG,
-        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
-        datefmt='%Y-%m-%d:%H:%M:%S')
-    
-    if len(sys.argv) != 6:
-        print(
-            "\n===== Error usage, python3 sender.py sender_port receiver_port FileReceived.txt max_win rot ======\n")
-        exit(0)
-
-    sender = Sender(*sys.argv[1:])
-    sender.run()
+"""
+    Sample code for Sender (multi-threading)
+    Python 3
+    Usage: python3 sender.py receiver_port sender_port FileToSend.txt max_recv_win rto
+    coding: utf-8
+
+    Notes:
+        Try to run the server first with the command:
+            python3 receiver_template.py 9000 10000 FileReceived.txt 1 1
+        Then run the sender:
+            python3 sender_template.py 11000 9000 FileToReceived.txt 1000 1
+
+    Author: Rui Li (Tutor for COMP3331/9331)
+"""
+# here are the libs you may find it useful:
+import datetime, time  # to calculate the time delta of packet transmission
+import logging, sys  # to write the log
+import argparse
+import socket  # Core lib, to send packet via UDP socket
+import threading
+import os
+import random  # for the --seed option
+import tempfile
+
+from util import *
+from segment import SegmentSource
+from congestion import CONGESTION_CONTROLS
+from reliable import ReliableSender
+from batchio import MAX_BATCH, IO_BACKENDS, open_batch_io
+from tracelog import TRACE_LEVELS, Event, Role, Tracer, Verbosity, convert_file
+from metrics import MetricsDumper
+from fec import PARITY, FecEncoder
+from compress import COMPRESS_LEVEL, COMPRESS_WORKERS, CompressedSegmentSource
+from checkpoint import file_identity
+from delta import write_delta
+from session import SessionSource, CompressedSessionSource
+
+BUFFERSIZE = 1024
+
+
+class Sender(ReliableSender):
+    def __init__(self, sender_port: int, receiver_port: int, filename: str, max_win: int, rot: int,
+                 min_rto: float = 10, max_rto: float = 60000, cc: str = 'reno', sack: bool = True,
+                 io: str = 'auto', mss: int = DEFAULT_MSS, pmtu_probe: bool = False,
+                 trace: Verbosity = Verbosity.PACKET, text_log: bool = True,
+                 metrics_json: str = None, metrics_interval: float = 1, delack: bool = True,
+                 fec_block: int = 0, fec_parity: int = 1, compress: bool = False,
+                 compress_level: int = COMPRESS_LEVEL, compress_workers: int = COMPRESS_WORKERS,
+                 resume: bool = False, delta: bool = False) -> None:
+        '''
+        The Sender will be able to connect the Receiver via UDP
+        :param sender_port: the UDP port number to be used by the sender to send PTP segments to the receiver
+        :param receiver_port: the UDP port number on which receiver is expecting to receive PTP segments from the sender
+        :param filename: the name of the text file that must be transferred from sender to receiver using your reliable transport protocol.
+            A directory sends every file under it over the one connection, if the receiver takes sessions.
+        :param max_win: the maximum window size in bytes for the sender window.
+        :param rot: the initial value of the retransmission timer in milliseconds. This should be an unsigned integer.
+        :param min_rto: lower bound of the adaptive retransmission timer in milliseconds.
+        :param max_rto: upper bound of the adaptive retransmission timer in milliseconds.
+        :param cc: the congestion control algorithm, one of CONGESTION_CONTROLS.
+        :param sack: whether to ask the receiver for selective acknowledgements.
+        :param io: the batch I/O backend for DATA segments, one of IO_BACKENDS or 'auto'.
+        :param mss: the DATA payload size, lowered to what the receiver takes.
+        :param pmtu_probe: probe the path for a bigger payload than mss before sending data.
+        :param trace: which segments go to the binary trace Sender_trace.bin.
+        :param text_log: convert the trace to Sender_log.txt once the transfer ends.
+        :param metrics_json: dump the metrics to this JSON file every metrics_interval seconds.
+        :param metrics_interval: seconds between metrics dumps.
+        :param delack: let the receiver delay and coalesce ACKs.
+        :param fec_block: send XOR parity after every fec_block DATA segments, 0 disables it.
+        :param fec_parity: most parity segments per block, fewer are sent while little is lost.
+        :param compress: compress DATA payloads with zlib if the receiver takes them.
+        :param compress_level: zlib compression level.
+        :param compress_workers: threads compressing payloads ahead of the send loop.
+        :param resume: let the receiver keep what an interrupted transfer of the file committed, and send the rest.
+        :param delta: if the receiver has a copy of the file, send only what differs from it.
+        '''
+        super().__init__(max_win, rot, min_rto, max_rto, cc, sack, mss)
+        self.sender_port = int(sender_port)
+        self.receiver_port = int(receiver_port)
+        self.sender_address = ("127.0.0.1", self.sender_port)
+        self.receiver_address = ("127.0.0.1", self.receiver_port)
+        self.state = State.NONE
+        self.rot = int(rot)
+        self.bufsize = 1024
+        self.pmtu_probe = pmtu_probe
+        self.file_path = filename
+        self.file_size = -1
+        self.syn_time = None  # sending time of the first SYN, None once SYN is retransmitted
+        self.delack = delack  # delayed ACKs, cleared if the receiver doesn't echo it
+        # (block, parity) offered at SYN, cleared if the receiver doesn't echo it
+        self.fec = (min(int(fec_block), 255), min(max(int(fec_parity), 1), int(fec_block), 255)) if fec_block > 0 else None
+        self.fec_encoder = None
+        self.compress = compress  # cleared if the receiver doesn't echo it
+        self.compress_level = compress_level
+        self.compress_workers = compress_workers
+        # a session streams every file of a directory, resume and delta work on a single file
+        self.session = os.path.isdir(filename)
+        self.session_declined = False  # the receiver doesn't take sessions, a directory can't go to it
+        self.resume = resume and not self.session
+        self.resume_offset = 0  # file bytes the receiver already has
+        self.delta = delta and not self.session
+        self.signatures = None  # (block size, SIGNATURE entries) of the receiver's copy
+        self.delta_path = None  # temporary file of the delta stream sent instead of the file
+        self.init_seq = -1
+        self.fin_seq = -1
+        self.waiting_time = 0.01
+        self.cond = threading.Condition()  # lock and condition variable
+        
+        # segment events are traced in binary off the hot path, text is produced at the end
+        self.tracer = Tracer('Sender_trace.bin', Role.SENDER, trace)
+        self.text_log = text_log
+        self.metrics_dumper = MetricsDumper(self.metrics, metrics_json, metrics_interval) if metrics_json else None
+
+        # init the UDP socket
+        print (f"The sender is using the address {self.sender_address}")
+        self.sender_socket = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.sender_socket.bind(self.sender_address)
+        self.sender_socket.settimeout(self.rtt.rto/1000)
+        if self.pmtu_probe:
+            set_dont_fragment(self.sender_socket)
+        # DATA goes out in batches, ACKs are still read one by one
+        self.io = open_batch_io(self.sender_socket, self.bufsize, io)
+        print (f"Sending DATA with the {self.io.name} I/O backend")
+        
+        self._is_active = True  # for the multi-threading
+        listen_thread = threading.Thread(target=self.listen)
+        listen_thread.start()
+
+    def connect(self):
+        '''connect with receiver with SYN segment
+        '''
+        self.state = State.CONNECT
+        self.init_seq = generate_random_int(0, SEQ_MOD[HEADER_VERSION]-1)
+        # self.init_seq = 63443
+        # offer the largest payload when probing, the probes find what the path carries
+        resume = (file_identity(self.file_path), os.path.getsize(self.file_path)) if self.resume else None
+        flags, payload = build_syn_payload(mss=MAX_MSS if self.pmtu_probe else self.max_data_size, fec=self.fec,
+                                           resume=resume)
+        if self.sack:
+            flags |= Flag.SACK
+        if self.delack:
+            flags |= Flag.DELACK
+        if self.compress:
+            flags |= Flag.COMPRESS
+        if self.delta:
+            flags |= Flag.DELTA
+        if self.session:
+            flags |= Flag.SESSION
+        syn_seg = build_segment_header(Type.SYN, self.init_seq, flags=flags) + payload
+        # If SYN transfer times > 3, then send RESET
+        trans_syn_times = 1
+        with self.cond:
+            while self.state == State.CONNECT:
+                self.sender_socket.sendto(syn_seg, self.receiver_address)
+                self.syn_time = get_current_time() if trans_syn_times == 1 else None
+                self.tracer.record(Event.SND, Type.SYN.value, self.init_seq, 0)
+                # wait for ack result
+                self.cond.wait()  
+                # connect success
+                if self.state == State.READ_FILE:  
+                    break
+                # send RESET
+                if trans_syn_times == 3:
+                    self.reset()
+                    return
+                    
+                trans_syn_times += 1
+                
+    def listen(self):
+        '''(Multithread is used)listen the response from receiver'''
+        logging.debug("Sub-thread for listening is running")
+        while self._is_active:
+            if self.state == State.CONNECT:
+                self.reply_connect()
+            elif self.state == State.READ_FILE:
+                # wait for DATA_TRANS state
+                with self.cond:
+                    self.cond.wait()
+            elif self.state == State.DATA_TRANS:
+                self.reply_data_trans()
+            elif self.state == State.CLOSE:
+                self.reply_close()
+    
+    def reply_connect(self):
+        while self.state == State.CONNECT:
+            try:
+                # the SYN ACK may carry block signatures
+                ack_seg, _ = self.sender_socket.recvfrom(MAX_UDP_PAYLOAD)
+            except:
+                # notify main-thread to resend syn
+                with self.cond:
+                    self.timeout_rto()
+                    self.cond.notify_all()
+            else:
+                _, type, flags, seq, header_size = parse_segment_header(ack_seg)
+                assert type == Type.ACK.value
+                self.tracer.record(Event.RCV, type, seq, len(ack_seg)-header_size)
+                self.sack = self.sack and bool(flags & Flag.SACK)
+                rwnd, mss, ack_delay, resume_offset, signatures, _ = parse_ack_payload(flags, ack_seg[header_size:])
+                if rwnd is not None:
+                    self.rwnd = rwnd
+                self.delack = self.delack and ack_delay is not None
+                if self.delack:
+                    self.rtt.ack_delay = ack_delay
+                if not flags & Flag.FEC:
+                    self.fec = None
+                self.compress = self.compress and bool(flags & Flag.COMPRESS)
+                self.resume_offset = (resume_offset or 0) if self.resume else 0
+                self.signatures = signatures if self.delta else None
+                self.session_declined = self.session and not flags & Flag.SESSION
+                if self.syn_time is not None:
+                    self.sample_rtt(get_current_time() - self.syn_time)
+                self.data_seq = seq
+                # receivers without the MSS option take DEFAULT_MSS, and a segment must fit the window
+                # parity segments carry PARITY on top of a full payload and must fit the receiver too
+                self.max_data_size = min(self.max_data_size, (mss or DEFAULT_MSS) - self.parity_overhead(), self.max_win)
+                if self.pmtu_probe and mss is not None:
+                    self.probe_pmtu(min(mss, self.max_win))
+                # notify main-thread to read file and send data
+                with self.cond:
+                    self.state = State.READ_FILE
+                    self.cond.notify_all()
+        
+    def probe_pmtu(self, limit: int):
+        '''raise max_data_size up the PMTU_PROBE_SIZES ladder while probes are acked (DPLPMTUD, RFC 8899)'''
+        for mss in pmtu_probe_mss(self.max_data_size, limit):
+            probe = build_probe(mss)
+            for _ in range(MAX_PROBES):
+                try:
+                    self.sender_socket.sendto(probe, self.receiver_address)
+                except OSError:
+                    return  # EMSGSIZE, bigger than the local interface MTU
+                self.tracer.record(Event.SND, Type.DATA.value, len(probe), mss)
+                if self.wait_probe_ack(len(probe)):
+                    break
+            else:
+                return  # the path dropped every probe of this size
+            self.max_data_size = mss - self.parity_overhead()
+        
+    def parity_overhead(self):
+        return PARITY.size if self.fec is not None else 0
+
+    def wait_probe_ack(self, size: int):
+        '''wait one rto for the ACK of the probe of size bytes'''
+        deadline = get_current_time() + self.rtt.rto
+        try:
+            while get_current_time() < deadline:
+                self.sender_socket.settimeout(max(deadline - get_current_time(), 0)/1000)
+                ack_seg, _ = self.sender_socket.recvfrom(self.bufsize)
+                _, type, flags, seq, header_size = parse_segment_header(ack_seg)
+                self.tracer.record(Event.RCV, type, seq, len(ack_seg)-header_size)
+                if type == Type.ACK.value and flags & Flag.PROBE and seq == size:
+                    return True
+        except socket.timeout:
+            pass
+        finally:
+            self.sender_socket.settimeout(self.rtt.rto/1000)
+        return False
+
+    def reply_close(self):
+        self.sender_socket.settimeout(self.rtt.rto/1000)
+        while self.state == State.CLOSE:
+            try:
+                ack_seg, _ = self.sender_socket.recvfrom(self.bufsize)
+            except:
+                # notify main-thread to resend fin
+                with self.cond:
+                    self.timeout_rto()
+                    self.cond.notify_all()
+            else:
+                _, type, _, seq, header_size = parse_segment_header(ack_seg)
+                assert type == Type.ACK.value
+                self.tracer.record(Event.RCV, type, seq, len(ack_seg)-header_size)
+                if seq != seq_add(self.data_seq, 1):
+                    continue  # late data ack or window update, not the FIN ACK
+                with self.cond:
+                    self.state = State.END
+                    # finish sub-thread
+                    self._is_active = False
+                    # notify main-thread
+                    self.cond.notifyAll()  
+    
+    def reply_data_trans(self):
+        while self.state == State.DATA_TRANS:
+            # sleep until the earliest segment timer, segments sent meanwhile expire no earlier than one rto
+            with self.cond:
+                deadline = self.timers.next_deadline()
+            timeout = self.rtt.rto
+            if deadline is not None:
+                timeout = min(max(deadline - get_current_time(), 0), timeout)
+            self.sender_socket.settimeout(timeout/1000)
+            try:
+                ack_seg, addr = self.sender_socket.recvfrom(self.bufsize)
+            except:
+                # out of time, retrans the segments whose timer fired
+                with self.cond:
+                    self.fire_timers()
+                    self.probe_window()
+            else:
+                # receive ack seg in time
+                _, type, flags, seq, header_size = parse_segment_header(ack_seg)
+                self.tracer.record(Event.RCV, type, seq, len(ack_seg)-header_size)
+                self.metrics.inc('acks_received')
+                if flags & Flag.PROBE:
+                    continue  # late path MTU probe reply
+                rwnd, _, _, _, _, blocks = parse_ack_payload(flags, ack_seg[header_size:])
+                with self.cond:
+                    if self.on_ack(seq, flags, rwnd, blocks):
+                        # end data_trans
+                        self.state = State.CLOSE
+                    # the window moved, or retransmissions were queued
+                    self.cond.notify_all()
+
+    def fire_timers(self):
+        expired_ids = super().fire_timers()
+        if expired_ids:
+            self.cond.notify_all()
+        return expired_ids
+
+    def send_control(self, seg: bytes):
+        self.sender_socket.sendto(seg, self.receiver_address)
+
+    def trace(self, event: Event, type: int, seq: int, length: int):
+        self.tracer.record(event, type, seq, length)
+
+    def rto_changed(self):
+        self.sender_socket.settimeout(self.rtt.rto/1000)
+
+    def send_data(self):
+        # Wait sub-thread receives SYN ACK
+        with self.cond:
+            while self.state != State.READ_FILE:
+                self.cond.wait()
+        self.readfile()
+        with self.cond:
+            # nothing to send for an empty file
+            self.state = State.DATA_TRANS if self.source.seg_count > 0 else State.CLOSE
+            self.cond.notify_all()
+        
+        while self.state == State.DATA_TRANS:
+            # no need consider slide window for retransmiss segment part
+            with self.cond:
+                # take the pending retransmissions, the listen thread keeps appending
+                retrans_ids = self.take_retransmissions()
+            if retrans_ids:  # retrasmiss segments, acked ones were dropped while waiting
+                # loss recovery waits for their acks
+                segs = [self.source.segment(id, Flag.ACKNOW if self.delack else 0) for id in retrans_ids]
+                self.io.send_batch(segs, self.receiver_address)
+                self.metrics.inc('retransmitted_segments', len(segs))
+                self.metrics.inc('retransmitted_bytes', sum(len(payload) for _, payload in segs))
+                for retrans_id in retrans_ids:
+                    self.tracer.record(Event.SND, Type.DATA.value, self.source.id_to_seq(retrans_id), self.source.length(retrans_id))
+                
+            if self.send_id < self.source.seg_count:  # send segment
+                seg = self.source.segment(self.send_id)
+                with self.cond:
+                    blocked_time = None
+                    while not self.window_open() and not self.retransmiss_id_list and self.state == State.DATA_TRANS:
+                        if blocked_time is None:
+                            blocked_time = get_current_time()
+                        self.cond.wait()  # wait for slide window space
+                    if blocked_time is not None:
+                        self.metrics.observe('window_blocked_ms', get_current_time() - blocked_time)
+                    if len(self.retransmiss_id_list) > 0 or self.state != State.DATA_TRANS:
+                        continue  # go to retransmiss
+                    # every new segment the window takes goes out in one batch
+                    first_id = self.send_id
+                    segs = []
+                    closed_blocks = []  # blocks whose parity follows the batch
+                    while len(segs) < MAX_BATCH and self.window_open():
+                        segs.append(seg)
+                        if self.fec_encoder is not None and self.fec_encoder.closes_block(self.send_id):
+                            closed_blocks.append(self.send_id // self.fec[0])
+                        self.sent_new()
+                        if self.send_id < self.source.seg_count:
+                            seg = self.source.segment(self.send_id)
+                    if self.delack and not self.window_open():
+                        # the window is full or the file is sent, don't let the receiver sit on the ack
+                        segs[-1] = self.source.segment(self.send_id - 1, Flag.ACKNOW)
+                parity_seqs, parity_segs = self.parity(closed_blocks)
+                self.io.send_batch(segs + parity_segs, self.receiver_address)
+                self.metrics.inc('segments_sent', len(segs))
+                self.metrics.inc('bytes_sent', sum(len(payload) for _, payload in segs))
+                if self.compress:
+                    self.metrics.inc('uncompressed_bytes_sent', sum(self.source.length(id) for id in range(first_id, self.send_id)))
+                for id in range(first_id, self.send_id):
+                    self.tracer.record(Event.SND, Type.DATA.value, self.source.id_to_seq(id), self.source.length(id))
+                for parity_seq, (_, payload) in zip(parity_seqs, parity_segs):
+                    self.tracer.record(Event.SND, Type.DATA.value, parity_seq, len(payload))
+            elif not retrans_ids:
+                # the whole file is out, sleep until the listen thread queues a retransmission
+                # or the last ACK ends DATA_TRANS, one RTO at most in case a wakeup is missed
+                with self.cond:
+                    if not self.retransmiss_id_list and self.state == State.DATA_TRANS:
+                        self.cond.wait(self.rtt.rto/1000)
+
+        print ("Finish sending the file.")
+        
+    def parity(self, block_ids: list):
+        '''
+        the parity segments of blocks just sent, more of them per block as more is lost
+        :return: (their seqs, the segments)
+        '''
+        seqs, segs = [], []
+        if not block_ids:
+            return seqs, segs
+        # share of the segments sent so far that had to be resent
+        sent = self.metrics.counters.get('segments_sent', 0)
+        loss = self.metrics.counters.get('retransmitted_segments', 0) / sent if sent else 0
+        for block_id in block_ids:
+            parity_segs = self.fec_encoder.parity(block_id, loss)
+            seqs.extend([self.source.id_to_seq(block_id * self.fec[0])] * len(parity_segs))
+            segs.extend(parity_segs)
+        self.metrics.inc('parity_segments', len(segs))
+        self.metrics.inc('parity_bytes', sum(len(payload) for _, payload in segs))
+        return seqs, segs
+
+    def readfile(self):
+        '''open file as a lazy segment source, main thread executes
+        '''
+        print (f"Now begin to read the file: {self.file_path}.")
+        if self.resume_offset:
+            print (f"The receiver has the first {self.resume_offset} bytes, resuming from there.")
+            self.metrics.set('resumed_bytes', self.resume_offset)
+        # the DATA stream is the file, a delta against the receiver's copy, or the files of a session
+        path = self.file_path if self.signatures is None else self.write_delta()
+        if self.compress:
+            # compress a window and a batch ahead of the send loop
+            ahead = self.max_win // self.max_data_size + MAX_BATCH
+            source_class = CompressedSessionSource if self.session else CompressedSegmentSource
+            self.source = source_class(path, self.data_seq, self.max_data_size, offset=self.resume_offset,
+                                       level=self.compress_level, workers=self.compress_workers, ahead=ahead)
+        else:
+            source_class = SessionSource if self.session else SegmentSource
+            self.source = source_class(path, self.data_seq, self.max_data_size, offset=self.resume_offset)
+        self.start_data(self.source)
+        self.file_size = self.source.file_size if self.signatures is None else os.path.getsize(self.file_path)
+        if self.session:
+            self.metrics.set('session_files', len(self.source.names))
+            print (f"Sending {len(self.source.names)} files, {self.file_size} bytes framed, in one session.")
+        if self.fec is not None:
+            self.fec_encoder = FecEncoder(self.source, *self.fec)
+        print ("READFILE completed.")
+        
+    def write_delta(self):
+        '''write the delta of the file against the receiver's copy to a temporary file, return its path'''
+        fd, self.delta_path = tempfile.mkstemp(prefix='delta-')
+        with os.fdopen(fd, 'wb') as out:
+            literal_bytes, copied_bytes = write_delta(self.file_path, *self.signatures, out)
+        self.metrics.set('delta_literal_bytes', literal_bytes)
+        self.metrics.set('delta_copied_bytes', copied_bytes)
+        self.metrics.set('delta_stream_bytes', os.path.getsize(self.delta_path))
+        print (f"Sending a delta: {literal_bytes} new bytes, {copied_bytes} bytes copied from the receiver's copy.")
+        return self.delta_path
+
+    def close(self):
+        with self.cond:
+            while self.state != State.CLOSE:
+                self.cond.wait()
+        self.fin_seq = self.data_seq
+        fin_seg = build_segment_header(Type.FIN, self.fin_seq)
+        while self.state == State.CLOSE:
+            self.sender_socket.sendto(fin_seg, self.receiver_address)
+            self.tracer.record(Event.SND, Type.FIN.value, self.fin_seq, 0)
+            
+            with self.cond:
+                # FIN ACK may arrive before waiting
+                if self.state == State.CLOSE:
+                    self.cond.wait()
+        self.source.close()
+        if self.delta_path is not None:
+            os.remove(self.delta_path)
+
+    def reset(self):
+        '''abort the connection with a RESET'''
+        rst_seg = build_segment_header(Type.RESET, 0)
+        self.sender_socket.sendto(rst_seg, self.receiver_address)
+        self.tracer.record(Event.SND, Type.RESET.value, 0, 0)
+        self.metrics.inc('resets_sent')
+        with self.cond:
+            self.state = State.END
+            self._is_active = False
+            self.cond.notify_all()
+
+    def run(self):
+        '''
+        This function contain the main logic of the receiver
+        '''
+        
+        # connected
+        self.connect()
+        if self.state != State.END and self.session_declined:
+            print ("The receiver doesn't take sessions, a directory can't be sent to it.")
+            self.reset()
+        elif self.state != State.END:  # made a connect
+            self.send_data()
+            self.close()
+        self.close_trace()
+        self.report_metrics()
+
+    def report_metrics(self):
+        '''ratios for the end of transfer summary, then print it'''
+        elapsed = self.metrics.elapsed()
+        sent = self.metrics.counters.get('segments_sent', 0)
+        if elapsed > 0:
+            self.metrics.set('goodput_Bps', max(self.file_size, 0) / elapsed)
+        if sent:
+            self.metrics.set('retransmit_ratio', self.metrics.counters.get('retransmitted_segments', 0) / sent)
+        if self.compress and self.metrics.counters.get('bytes_sent'):
+            self.metrics.set('compression_ratio', self.metrics.counters.get('uncompressed_bytes_sent', 0)
+                             / self.metrics.counters['bytes_sent'])
+        if self.metrics_dumper is not None:
+            self.metrics_dumper.stop()
+        print(self.metrics.summary('Sender'))
+
+    def close_trace(self):
+        self.tracer.close()
+        if self.text_log and self.tracer.verbosity > Verbosity.OFF:
+            convert_file(self.tracer.path, 'Sender_log.txt')
+
+if __name__ == '__main__':
+    # logging is useful for the log part: https://docs.python.org/3/library/logging.html
+    logging.basicConfig(
+        # filename="Sender_log.txt",
+        stream=sys.stderr,
+        level=logging.DEBUG,
+        format='%(asctime)s,%(msecs)03d %(levelname)-8s %(message)s',
+        datefmt='%Y-%m-%d:%H:%M:%S')
+    
+    parser = argparse.ArgumentParser(
+        usage="python3 sender.py sender_port receiver_port FileToSend.txt max_win rot [options]")
+    parser.add_argument('sender_port', type=int)
+    parser.add_argument('receiver_port', type=int)
+    parser.add_argument('filename', help='the file to send, or a directory to send all its files in one session')
+    parser.add_argument('max_win', type=int, help='maximum window size in bytes')
+    parser.add_argument('rot', type=int, help='initial retransmission timer in milliseconds')
+    parser.add_argument('--min-rto', type=float, default=10, help='lower bound of the adaptive RTO in milliseconds')
+    parser.add_argument('--max-rto', type=float, default=60000, help='upper bound of the adaptive RTO in milliseconds')
+    parser.add_argument('--cc', choices=CONGESTION_CONTROLS, default='reno', help='congestion control algorithm')
+    parser.add_argument('--no-sack', dest='sack', action='store_false', help="don't negotiate selective acknowledgements")
+    parser.add_argument('--io', choices=['auto', *IO_BACKENDS], default='auto', help='batch I/O backend for DATA segments')
+    parser.add_argument('--mss', type=int, default=DEFAULT_MSS, help='DATA payload size in bytes, lowered to what the receiver takes')
+    parser.add_argument('--pmtu-probe', action='store_true', help='probe the path for a bigger payload than --mss before sending')
+    parser.add_argument('--trace', choices=TRACE_LEVELS, default='packet', help="segments traced, 'control' skips DATA and ACK")
+    parser.add_argument('--binary-trace', dest='text_log', action='store_false',
+                        help='keep only Sender_trace.bin, convert it later with tracelog.py')
+    parser.add_argument('--metrics-json', help='dump the transfer metrics to this JSON file while sending')
+    parser.add_argument('--metrics-interval', type=float, default=1, help='seconds between --metrics-json dumps')
+    parser.add_argument('--no-delack', dest='delack', action='store_false', help='ask the receiver to ack every segment')
+    parser.add_argument('--fec', type=int, default=0, metavar='N', help='send XOR parity after every N DATA segments, 0 disables it')
+    parser.add_argument('--fec-parity', type=int, default=1, metavar='K',
+                        help='most parity segments per block, as many are sent as the loss rate calls for')
+    parser.add_argument('--compress', action='store_true', help='compress DATA payloads with zlib if the receiver takes them')
+    parser.add_argument('--compress-level', type=int, default=COMPRESS_LEVEL, choices=range(1, 10), metavar='1-9', help='zlib compression level')
+    parser.add_argument('--compress-workers', type=int, default=COMPRESS_WORKERS, help='threads compressing payloads ahead of sending, 0 compresses inline')
+    parser.add_argument('--resume', action='store_true', help='skip what the receiver kept from an interrupted transfer of the file')
+    parser.add_argument('--delta', action='store_true', help="send only what differs from the receiver's copy of the file, if it has one")
+    parser.add_argument('--seed', type=int, help='seed the initial seq random generator for reproducible runs')
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    sender = Sender(args.sender_port, args.receiver_port, args.filename, args.max_win, args.rot,
+                    min_rto=args.min_rto, max_rto=args.max_rto, cc=args.cc, sack=args.sack, io=args.io,
+                    mss=args.mss, pmtu_probe=args.pmtu_probe, trace=TRACE_LEVELS[args.trace], text_log=args.text_log,
+                    metrics_json=args.metrics_json, metrics_interval=args.metrics_interval, delack=args.delack,
+                    fec_block=args.fec, fec_parity=args.fec_parity, compress=args.compress,
+                    compress_level=args.compress_level, compress_workers=args.compress_workers, resume=args.resume,
+                    delta=args.delta)
+    sender.run()
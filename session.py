@@ -0,0 +1,186 @@
+import bisect
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+from util import *
+from segment import SegmentSource
+from compress import CompressedSegmentSource
+
+# file frame of a session stream: name length, size, mode and mtime in ns, then the UTF-8 name and the data
+FILE_HEADER = struct.Struct('!HQIq')
+OPEN_FILES = 16  # mmaps of session files kept open
+
+
+def session_files(root: str):
+    '''relative paths of the regular files under root, in a stable order'''
+    names = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = os.path.join(dir_path, file_name)
+            if os.path.isfile(path):
+                names.append(os.path.relpath(path, root))
+    return names
+
+
+def safe_path(root: str, name: str):
+    '''where a received file goes under root, names that would leave root are refused'''
+    path = os.path.normpath(name)
+    if os.path.isabs(path) or path == '.' or path.split(os.sep)[0] == '..':
+        raise ValueError(f'unsafe file name in session: {name!r}')
+    return os.path.join(root, path)
+
+
+class SessionSource(SegmentSource):
+    def __init__(self, root: str, start_seq: int, max_data_size: int, offset: int = 0, length: int = None) -> None:
+        '''
+        Segment source over the session stream of every file under root: each file framed by
+        FILE_HEADER and its name, back to back, so one connection carries them all and the
+        next file goes out while the tail of the previous one is still in flight.
+        Payloads inside one file are views into its mmap, only segments across a frame boundary are joined.
+        :param root: the directory to send
+        :param offset: stream offset of the first byte to send
+        :param length: stream bytes to send from offset, the rest of the stream by default
+        '''
+        self.file_path = root
+        self.start_seq = start_seq
+        self.max_data_size = max_data_size
+        self.names = session_files(root)
+        self.parts = []  # (stream offset, length, frame header bytes or index of a file in names)
+        self.starts = []  # stream offset of every part, for bisect
+        stream_size = 0
+        for index, name in enumerate(self.names):
+            stat = os.stat(os.path.join(root, name))
+            encoded = name.encode()
+            header = FILE_HEADER.pack(len(encoded), stat.st_size, stat.st_mode & 0o7777, stat.st_mtime_ns) + encoded
+            for part, size in ((header, len(header)), (index, stat.st_size)):
+                if size:
+                    self.parts.append((stream_size, size, part))
+                    self.starts.append(stream_size)
+                    stream_size += size
+        self.stream_size = stream_size
+        self.offset = min(offset, stream_size)
+        self.file_size = stream_size - self.offset if length is None else min(length, stream_size - self.offset)
+        self.seg_count = (self.file_size + max_data_size - 1) // max_data_size
+        self.end_seq = seq_add(start_seq, self.file_size)
+        self.acked_id = 0
+        self.header_chunks = {}
+        self.views = OrderedDict()  # file index -> memoryview of its mmap, least recently used first
+
+    def file_view(self, index: int):
+        view = self.views.get(index)
+        if view is None:
+            with open(os.path.join(self.file_path, self.names[index]), 'rb') as f:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+            self.views[index] = view
+            if len(self.views) > OPEN_FILES:
+                # in-flight payloads keep their mapping alive until they are dropped
+                self.views.popitem(last=False)
+        else:
+            self.views.move_to_end(index)
+        return view
+
+    def payload(self, seg_id: int):
+        start = self.offset + seg_id * self.max_data_size
+        end = min(start + self.max_data_size, self.offset + self.file_size)
+        pieces = []
+        i = bisect.bisect_right(self.starts, start) - 1
+        while start < end:
+            part_start, size, part = self.parts[i]
+            lo, hi = start - part_start, min(end - part_start, size)
+            pieces.append(part[lo:hi] if isinstance(part, bytes) else self.file_view(part)[lo:hi])
+            start = part_start + hi
+            i += 1
+        return pieces[0] if len(pieces) == 1 else b''.join(pieces)
+
+    def close(self):
+        self.views.clear()
+
+
+class CompressedSessionSource(CompressedSegmentSource, SessionSource):
+    '''session stream with zlib compressed payloads'''
+
+
+class SessionWriter:
+    def __init__(self, root: str) -> None:
+        '''
+        File-like target of a session stream: writes every file it frames under root,
+        each one to name.part first and renamed once complete, then sets its mode and mtime.
+        :param root: the directory the files go to, created if needed
+        '''
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.header = bytearray()  # frame header and name read so far
+        self.name_size = None  # name length once FILE_HEADER is read
+        self.meta = None  # (path, mode, mtime) of the file being written
+        self.out = None
+        self.remaining = 0  # bytes of the current file still to come
+        self.files = 0  # files completed
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        data = memoryview(data)
+        try:
+            while data:
+                if self.out is not None:
+                    chunk = data[:self.remaining]
+                    self.out.write(chunk)
+                    self.remaining -= len(chunk)
+                    data = data[len(chunk):]
+                    if not self.remaining:
+                        self.finish_file()
+                    continue
+                # frame header, then the name
+                need = FILE_HEADER.size if self.name_size is None else FILE_HEADER.size + self.name_size
+                take = need - len(self.header)
+                self.header += data[:take]
+                data = data[take:]
+                if len(self.header) < need:
+                    continue
+                if self.name_size is None:
+                    self.name_size = FILE_HEADER.unpack_from(self.header)[0]
+                    if self.name_size:
+                        continue
+                self.start_file()
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            self.error = e
+
+    def start_file(self):
+        name_size, size, mode, mtime = FILE_HEADER.unpack_from(self.header)
+        path = safe_path(self.root, bytes(self.header[FILE_HEADER.size:]).decode())
+        self.header.clear()
+        self.name_size = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.meta = (path, mode, mtime)
+        self.out = open(f'{path}.part', 'wb')
+        self.remaining = size
+        if not size:
+            self.finish_file()
+
+    def finish_file(self):
+        path, mode, mtime = self.meta
+        self.out.close()
+        self.out = None
+        os.replace(f'{path}.part', path)
+        os.chmod(path, mode)
+        os.utime(path, ns=(mtime, mtime))
+        self.files += 1
+
+    def close(self):
+        '''drop a file cut short by the end of the stream'''
+        if self.out is not None:
+            self.out.close()
+            os.remove(f'{self.meta[0]}.part')
+            self.out = None
+            if self.error is None:
+                self.error = ValueError(f'the session ended inside {self.meta[0]}')
+        elif self.header and self.error is None:
+            self.error = ValueError('the session ended inside a file header')
+
+    @property
+    def ok(self):
+        return self.error is None
@@ -0,0 +1,57 @@
+'''
+A sender killed mid-transfer and started again against the same receiver:
+the receiver must start the output over, not append the new transfer to the partial file.
+'''
+import filecmp
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench import free_ports
+
+
+def start_sender(work_dir, sender_port, receiver_port, source, seed):
+    '''a sender process, the seed sets its initial seq'''
+    return subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'sender.py'), str(sender_port), str(receiver_port), source,
+         '4000', '50', '--seed', str(seed)],
+        cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_restarted_sender_rewrites_the_output(tmp_path):
+    source = tmp_path / 'source.bin'
+    source.write_bytes(random.Random(1).randbytes(1 << 20))
+    output = tmp_path / 'received.bin'
+    receiver_port, sender_port = free_ports(2)
+    # forward loss keeps the transfer slow enough to interrupt
+    receiver = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'receiver.py'), str(receiver_port), str(sender_port), str(output),
+         '0.1', '0', '--seed', '1'],
+        cwd=tmp_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(0.3)  # receiver socket bound
+        sender = start_sender(tmp_path, sender_port, receiver_port, str(source), 2)
+        deadline = time.monotonic() + 30
+        while not (output.exists() and output.stat().st_size >= 1 << 18):
+            assert sender.poll() is None, 'the first transfer ended before it could be interrupted'
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        sender.kill()
+        sender.wait()
+
+        # a new process picks a new initial seq
+        sender = start_sender(tmp_path, sender_port, receiver_port, str(source), 3)
+        assert sender.wait(timeout=60) == 0
+        assert receiver.wait(timeout=30) == 0
+    finally:
+        for proc in (receiver, sender):
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+    assert output.stat().st_size == source.stat().st_size
+    assert filecmp.cmp(source, output, shallow=False)
@@ -0,0 +1,172 @@
+import argparse
+import enum
+import queue
+import struct
+import sys
+import threading
+import time
+
+from util import Type
+
+# trace file header: magic, format version, role
+TRACE_HEADER = struct.Struct('!4sBB')
+TRACE_MAGIC = b'PTPT'
+TRACE_VERSION = 1
+# one record: event, segment type, seq, payload length, monotonic time in ns
+TRACE_RECORD = struct.Struct('=BBxxIIQ')
+TRACE_BUFFER_RECORDS = 4096  # records per buffer handed to the writer thread
+
+
+class Event(enum.IntEnum):
+    SND = 0
+    RCV = 1
+    DRP = 2
+
+
+class Role(enum.IntEnum):
+    SENDER = 0
+    RECEIVER = 1
+
+
+class Verbosity(enum.IntEnum):
+    OFF = 0
+    CONTROL = 1  # SYN, FIN and RESET segments
+    PACKET = 2  # every segment
+
+
+TRACE_LEVELS = {level.name.lower(): level for level in Verbosity}
+# DATA and ACK segments are only traced per packet
+PACKET_TYPES = (Type.DATA.value, Type.ACK.value)
+# received segments are 'rcv' in the sender log and 'rev' in the receiver log
+EVENT_NAMES = {
+    Role.SENDER: ('snd', 'rcv', 'drp'),
+    Role.RECEIVER: ('snd', 'rev', 'drp'),
+}
+TYPE_NAMES = {
+    Type.DATA.value: 'DATA',
+    Type.ACK.value: 'ACK',
+    Type.SYN.value: 'SYN',
+    Type.FIN.value: 'FIN',
+    Type.RESET.value: 'RST',
+}
+
+
+class Tracer:
+    def __init__(self, path: str, role: Role, verbosity: Verbosity = Verbosity.PACKET,
+                 capacity: int = TRACE_BUFFER_RECORDS) -> None:
+        '''
+        Segment events as fixed-size binary records in a preallocated buffer,
+        full buffers are written to path by a background thread.
+        :param path: the binary trace file, not created when verbosity is OFF
+        :param role: whether the events are the sender's or the receiver's
+        :param verbosity: which segments are traced
+        :param capacity: records per buffer
+        '''
+        self.path = path
+        self.role = role
+        self.verbosity = verbosity
+        self.capacity = capacity
+        self.lock = threading.Lock()  # the sender traces from two threads
+        self.buffer = bytearray(capacity * TRACE_RECORD.size)
+        self.count = 0  # records in buffer
+        self.full = queue.Queue()  # (buffer, count) waiting for the writer thread, None to stop
+        self.free = queue.Queue()  # written buffers, reused
+        self.free.put(bytearray(len(self.buffer)))
+        self.file = None
+        self.writer_thread = None
+        if verbosity > Verbosity.OFF:
+            self.file = open(path, 'wb')
+            self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, role))
+            self.writer_thread = threading.Thread(target=self.writer, daemon=True)
+            self.writer_thread.start()
+
+    def record(self, event: Event, type: int, seq: int, length: int):
+        '''trace one segment, type is a Type value'''
+        if self.verbosity < (Verbosity.PACKET if type in PACKET_TYPES else Verbosity.CONTROL):
+            return
+        with self.lock:
+            TRACE_RECORD.pack_into(self.buffer, self.count * TRACE_RECORD.size,
+                                   event, type, seq, length, time.monotonic_ns())
+            self.count += 1
+            if self.count == self.capacity:
+                self.swap()
+
+    def swap(self):
+        # hand the full buffer over, take a written one back
+        self.full.put((self.buffer, self.count))
+        try:
+            self.buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.buffer = bytearray(len(self.buffer))
+        self.count = 0
+
+    def writer(self):
+        '''(Multithread is used)write full buffers to the trace file'''
+        while True:
+            item = self.full.get()
+            if item is None:
+                break
+            buffer, count = item
+            self.file.write(memoryview(buffer)[:count * TRACE_RECORD.size])
+            self.free.put(buffer)
+        self.file.close()
+
+    def close(self):
+        '''write the records left and close the trace file'''
+        if self.writer_thread is None:
+            return
+        with self.lock:
+            if self.count:
+                self.swap()
+            self.full.put(None)
+        self.writer_thread.join()
+        self.writer_thread = None
+
+
+def read_trace(path: str):
+    '''
+    :return: the role and the (event, type, seq, length, ns) records of a binary trace
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < TRACE_HEADER.size:
+        raise ValueError(f'{path} is not a trace file')
+    magic, version, role = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError(f'{path} is not a version {TRACE_VERSION} trace file')
+    body = memoryview(data)[TRACE_HEADER.size:]
+    # a run killed mid-write may leave a partial record
+    body = body[:len(body) - len(body) % TRACE_RECORD.size]
+    return Role(role), TRACE_RECORD.iter_unpack(body)
+
+
+def convert(path: str, text_file):
+    '''write a binary trace to text_file in the Sender_log.txt/Receiver_log.txt format'''
+    role, records = read_trace(path)
+    names = EVENT_NAMES[role]
+    t_start = None
+    for event, type, seq, length, ns in records:
+        if t_start is None:
+            # times are relative to the first traced segment
+            t_start = ns
+            t_inv = 0
+        else:
+            t_inv = round((ns - t_start) / 1e6, 2)
+        text_file.write(f'{names[event]}  {t_inv:<10}  {TYPE_NAMES[type]:<4} {seq:<6}  {length}\n')
+
+
+def convert_file(path: str, text_path: str):
+    with open(text_path, 'w') as text_file:
+        convert(path, text_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert a binary trace to the text log format')
+    parser.add_argument('trace', help='binary trace written by sender.py or receiver.py')
+    parser.add_argument('output', nargs='?', help='text log, stdout by default')
+    args = parser.parse_args()
+
+    if args.output is None:
+        convert(args.trace, sys.stdout)
+    else:
+        convert_file(args.trace, args.output)
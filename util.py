@@ -1,6 +1,7 @@
-from enum import Enum
+from enum import Enum, IntFlag
 import struct
 import random
+import socket
 import time
 
 # random.seed(10)
@@ -12,6 +13,37 @@ class Type(Enum):
     FIN = 3
     RESET = 4
     
+class Flag(IntFlag):
+    # SYN: SACK permitted, ACK: SACK blocks follow the header
+    SACK = 1
+    # ACK: advertised receive window follows the header
+    WND = 2
+    # ACK: unsolicited window update, not a duplicate ack
+    UPDATE = 4
+    # SYN: the connection carries one stripe of a file, STRIPE follows the header
+    STRIPE = 8
+    # SYN and SYN ACK: largest DATA payload the endpoint takes, MSS follows the header
+    MSS = 16
+    # DATA: padded path MTU probe carrying no data, ACK: reply to it, seq is the probe size
+    PROBE = 32
+    # SYN: delayed ACKs accepted, SYN ACK: the receiver delays ACKs, ACK_DELAY follows the header
+    DELACK = 64
+    # DATA: the sender waits for an ACK after this segment, don't delay it
+    ACKNOW = 128
+    # SYN: parity offered, FEC follows the header, SYN ACK: parity accepted,
+    # DATA: XOR parity of the block starting at seq, fec.PARITY follows the header
+    FEC = 256
+    # SYN: zlib compressed DATA offered, SYN ACK: accepted, DATA: the payload is compressed
+    COMPRESS = 512
+    # SYN: resume a transfer of the file, RESUME follows the header,
+    # SYN ACK: RESUME_OFFSET follows the header, the bytes the receiver already has
+    RESUME = 1024
+    # SYN: a delta against the receiver's copy is welcome,
+    # SYN ACK: DELTA and the SIGNATURE of every block of the copy follow the header, DATA carries a delta stream
+    DELTA = 2048
+    # SYN: DATA carries a session.FILE_HEADER framed stream of many files, SYN ACK: accepted
+    SESSION = 4096
+
 class State(Enum):
     NONE = 0
     CONNECT = 1
@@ -19,19 +51,187 @@ class State(Enum):
     DATA_TRANS = 3
     CLOSE = 4
     END = 5
+    PROBE = 6
     
-def build_segment_header(type: Type, seq: int):
+# v1 header: native type and 16-bit seq
+HEADER_V1 = struct.Struct('HH')
+# v2 header: version, type, flags, 32-bit seq (ack number for ACK), network byte order
+HEADER_V2 = struct.Struct('!BBHI')
+# v1 headers start with the type value (0-4), so the high bit marks a versioned header
+VERSION_MARK = 0x80
+HEADER_VERSION = 2
+HEADER_SIZE = HEADER_V2.size
+SEQ_MOD = {1: 1<<16, 2: 1<<32}
+# largest UDP payload over IPv4
+MAX_UDP_PAYLOAD = 65507
+# DATA payload used when the peer doesn't negotiate one, fits the 1024 byte buffers of old receivers
+DEFAULT_MSS = 1000
+MAX_MSS = MAX_UDP_PAYLOAD - HEADER_SIZE
+
+def build_segment_header(type: Type, seq: int, version: int = HEADER_VERSION, flags: int = 0):
     # for DATA SEQ FIN RESET
-    header = struct.pack('HH', type.value, seq)
+    if version == 1:
+        return HEADER_V1.pack(type.value, seq)
+    header = HEADER_V2.pack(VERSION_MARK | version, type.value, flags, seq)
     return header
 
+def parse_segment_header(segment: bytes):
+    '''return (version, type, flags, seq, header_size) of a v1 or v2 segment'''
+    if segment[0] & VERSION_MARK:
+        mark, type, flags, seq = HEADER_V2.unpack_from(segment)
+        return mark & ~VERSION_MARK, type, flags, seq, HEADER_V2.size
+    type, seq = HEADER_V1.unpack_from(segment)
+    return 1, type, 0, seq, HEADER_V1.size
+
+# SACK block: left edge and right edge (seq after the block) of data held out of order
+SACK_BLOCK = struct.Struct('!II')
+MAX_SACK_BLOCKS = 4
+
+def build_sack_blocks(blocks: list):
+    return b''.join(SACK_BLOCK.pack(left, right) for left, right in blocks[:MAX_SACK_BLOCKS])
+
+def parse_sack_blocks(payload: bytes):
+    return [SACK_BLOCK.unpack_from(payload, offset) for offset in range(0, len(payload) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
+
+def merge_sack_blocks(seq_data: dict, want_seq: int, last_seq: int, mod: int = SEQ_MOD[HEADER_VERSION]):
+    '''merge out-of-order data (seq -> data) into SACK blocks, the block holding last_seq first'''
+    blocks = []
+    for seq in sorted(seq_data, key=lambda seq: seq_diff(seq, want_seq, mod)):
+        end = seq_add(seq, len(seq_data[seq]), mod)
+        if blocks and blocks[-1][1] == seq:
+            blocks[-1][1] = end
+        else:
+            blocks.append([seq, end])
+    for i, (left, right) in enumerate(blocks):
+        if seq_leq(left, last_seq, mod) and seq_lt(last_seq, right, mod):
+            blocks.insert(0, blocks.pop(i))
+            break
+    return blocks
+
+# advertised receive window, bytes the receiver accepts beyond the ack number
+WINDOW = struct.Struct('!I')
+
+MSS = struct.Struct('!H')
+
+# longest time in ms the receiver holds back an ACK
+ACK_DELAY = struct.Struct('!H')
+
+# resume offset of a SYN ACK
+RESUME_OFFSET = struct.Struct('!Q')
+# delta transfer: block size and block count of the receiver's copy, a SIGNATURE per block follows
+DELTA = struct.Struct('!II')
+# rolling (Adler-32) and strong checksums of a block
+SIGNATURE = struct.Struct('!I8s')
+
+def parse_ack_payload(flags: int, payload: bytes):
+    '''
+    return (advertised window or None, MSS or None, max ACK delay or None, resume offset or None,
+            (block size, signatures) or None, SACK blocks) of an ACK
+    '''
+    wnd = mss = ack_delay = resume_offset = signatures = None
+    if flags & Flag.WND:
+        wnd, = WINDOW.unpack_from(payload)
+        payload = payload[WINDOW.size:]
+    if flags & Flag.MSS:
+        mss, = MSS.unpack_from(payload)
+        payload = payload[MSS.size:]
+    if flags & Flag.DELACK:
+        ack_delay, = ACK_DELAY.unpack_from(payload)
+        payload = payload[ACK_DELAY.size:]
+    if flags & Flag.RESUME:
+        resume_offset, = RESUME_OFFSET.unpack_from(payload)
+        payload = payload[RESUME_OFFSET.size:]
+    if flags & Flag.DELTA:
+        block_size, count = DELTA.unpack_from(payload)
+        end = DELTA.size + count * SIGNATURE.size
+        signatures = (block_size, bytes(payload[DELTA.size:end]))
+        payload = payload[end:]
+    blocks = parse_sack_blocks(payload) if flags & Flag.SACK else []
+    return wnd, mss, ack_delay, resume_offset, signatures, blocks
+
+# stripe of a striped transfer: transfer id shared by its connections, file size, stripe offset and length
+STRIPE = struct.Struct('!IQQQ')
+
+# forward error correction: DATA segments per block, most parity segments per block
+FEC = struct.Struct('!BB')
+# resumable transfer: identity and size of the file sent
+RESUME = struct.Struct('!16sQ')
+
+def build_syn_payload(mss: int = None, stripe: tuple = None, fec: tuple = None, resume: tuple = None):
+    '''options of a SYN, return (flags, payload)'''
+    flags, payload = 0, b''
+    if mss is not None:
+        flags |= Flag.MSS
+        payload += MSS.pack(mss)
+    if stripe is not None:
+        flags |= Flag.STRIPE
+        payload += STRIPE.pack(*stripe)
+    if fec is not None:
+        flags |= Flag.FEC
+        payload += FEC.pack(*fec)
+    if resume is not None:
+        flags |= Flag.RESUME
+        payload += RESUME.pack(*resume)
+    return flags, payload
+
+def parse_syn_payload(flags: int, payload: bytes):
+    '''return (MSS or None, stripe or None, (block, parity) or None, (file id, file size) or None) of a SYN'''
+    mss = stripe = fec = resume = None
+    if flags & Flag.MSS:
+        mss, = MSS.unpack_from(payload)
+        payload = payload[MSS.size:]
+    if flags & Flag.STRIPE:
+        stripe = STRIPE.unpack_from(payload)
+        payload = payload[STRIPE.size:]
+    if flags & Flag.FEC:
+        fec = FEC.unpack_from(payload)
+        payload = payload[FEC.size:]
+    if flags & Flag.RESUME:
+        resume = RESUME.unpack_from(payload)
+    return mss, stripe, fec, resume
+
+# datagram sizes tried by path MTU probing: 1500 byte Ethernet, 4k, 9000 byte jumbo frames, then loopback-only sizes
+PMTU_PROBE_SIZES = (1472, 4072, 8972, 16384, 32768, MAX_UDP_PAYLOAD)
+MAX_PROBES = 3  # a probe size fails after this many unacked probes (RFC 8899 MAX_PROBES)
+
+def pmtu_probe_mss(base: int, limit: int):
+    '''the payload sizes to probe, from just above base up to limit'''
+    sizes = {size - HEADER_SIZE for size in PMTU_PROBE_SIZES if size - HEADER_SIZE <= limit}
+    sizes.add(limit)
+    return sorted(size for size in sizes if size > base)
+
+def build_probe(mss: int):
+    '''DATA segment padded to mss bytes of payload, the seq field carries its datagram size'''
+    return build_segment_header(Type.DATA, mss + HEADER_SIZE, flags=Flag.PROBE) + bytes(mss)
+
+def set_dont_fragment(sock: socket.socket):
+    '''set DF on every datagram so probes bigger than the path MTU are dropped, not fragmented (Linux)'''
+    IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+    IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    except OSError:
+        pass
+
 def generate_random_int(left: int, right: int):
     return random.randint(left, right)
 
 def get_current_time():
     return time.time() * 1000
 
-def normal_seq(seq: int):
-    if seq >= (1<<16):
-        return seq - (1<<16)
-    return seq
+# wrap-safe sequence arithmetic, mod is the sequence space of the header version
+def seq_add(seq: int, n: int, mod: int = SEQ_MOD[HEADER_VERSION]):
+    return (seq + n) % mod
+
+def seq_diff(a: int, b: int, mod: int = SEQ_MOD[HEADER_VERSION]):
+    '''signed distance from b to a, valid while they are less than half the space apart'''
+    d = (a - b) % mod
+    if d >= mod // 2:
+        d -= mod
+    return d
+
+def seq_lt(a: int, b: int, mod: int = SEQ_MOD[HEADER_VERSION]):
+    return seq_diff(a, b, mod) < 0
+
+def seq_leq(a: int, b: int, mod: int = SEQ_MOD[HEADER_VERSION]):
+    return seq_diff(a, b, mod) <= 0